@@ -0,0 +1,33 @@
+import argparse
+
+import yaml
+from sekisyu.engine.engine_host import EngineHost
+
+
+def main():
+    """
+    sample usage engine_host.exe --config engine_host_example.yaml
+    """
+    parser = argparse.ArgumentParser(description="config of engine host")
+    parser.add_argument("--config", help="config files for engine host")
+    args = parser.parse_args()
+    with open(args.config, "r") as f:
+        data = yaml.safe_load(f)
+    # 他のマシンから使う場合だけhostを明示する
+    host = EngineHost(
+        data.get("host", "127.0.0.1"),
+        data["port"],
+        data["engines"],
+        data.get("token"),
+    )
+    print(f"engine host listening on {host.address}", flush=True)
+    try:
+        host.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        host.shutdown()
+
+
+if __name__ == "__main__":
+    main()
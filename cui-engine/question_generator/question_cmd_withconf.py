@@ -1,21 +1,20 @@
 import argparse
 import dataclasses
-import glob
 import json
 import os
 from typing import List
 
 import yaml
-from dacite import Config, from_dict
-from sekisyu.engine.config_engine import ConfigEngine
-from sekisyu.engine.engine_generator import generate_engine
+from sekisyu.board.kif_manifest import KifManifest
+from sekisyu.engine.engine_generator import generate_engine_dict
+from sekisyu.engine.engine_pool import EnginePool
 from sekisyu.qgen.question_generator import generate_question_from_pos
 from shogi import CSA, KIF, Board
 
 
-def run_sfen(sfen_to_use, config, engine, output):
-    ques = generate_question_from_pos(
-        f"position sfen {sfen_to_use} moves",
+def generate_question(engine, pos_cmd: str, config):
+    return generate_question_from_pos(
+        pos_cmd,
         engine,
         config["go_cmd"],
         1,
@@ -28,6 +27,16 @@ def run_sfen(sfen_to_use, config, engine, output):
         else None,
     )
 
+
+def run_sfen(sfen_to_use, config, engine, output):
+    pos_cmd = f"position sfen {sfen_to_use} moves"
+    if isinstance(engine, EnginePool):
+        ques = engine.run_with_engine(
+            lambda eng, pos_cmd: generate_question(eng, pos_cmd, config), pos_cmd
+        )
+    else:
+        ques = generate_question(engine, pos_cmd, config)
+
     with open(output, "w", encoding="utf8") as f:
         json.dump(
             dataclasses.asdict(ques),
@@ -42,6 +51,8 @@ def run_sfen(sfen_to_use, config, engine, output):
 def run_kif(file_names: List[str], config, engine, output_root) -> None:
     """
     棋譜ファイルを受け取って纏めて解析するコマンドも付ける(qsaから解析＋可視化をしたい)
+
+    engineにEnginePoolを渡すと1棋譜の各局面を並列に解析する
     """
 
     for file_name in file_names:
@@ -55,21 +66,24 @@ def run_kif(file_names: List[str], config, engine, output_root) -> None:
         save_dir = f"{output_root}/data_{os.path.basename(file_name)}"
         os.makedirs(save_dir, exist_ok=True)
         board = Board(data["sfen"])
-        for i, move in enumerate(data["moves"]):
-            ques = generate_question_from_pos(
-                f"position sfen {board.sfen()} moves",
-                engine,
-                config["go_cmd"],
-                1,
-                0,
-                0,
-                go_cmd_calc=config["go_cmd_calc"] if "go_cmd_calc" in config else None,
-                go_cmd_null=config["go_cmd_null"] if "go_cmd_null" in config else None,
-                go_cmd_null_enemy=config["go_cmd_null_enemy"]
-                if "go_cmd_null_enemy" in config
-                else None,
+        sfens = []
+        for move in data["moves"]:
+            sfens.append(board.sfen())
+            board.push_usi(move)
+
+        pos_cmds = [f"position sfen {sfen} moves" for sfen in sfens]
+        if isinstance(engine, EnginePool):
+            questions = engine.map(
+                lambda eng, pos_cmd: generate_question(eng, pos_cmd, config), pos_cmds
+            )
+        else:
+            questions = (
+                generate_question(engine, pos_cmd, config) for pos_cmd in pos_cmds
+            )
+        for i, (sfen, ques) in enumerate(zip(sfens, questions)):
+            output_file_name = (
+                f"{save_dir}/{i:03}_{sfen.replace('/' ,'_').replace(' ', '_')}.json"
             )
-            output_file_name = f"{save_dir}/{i:03}_{board.sfen().replace('/' ,'_').replace(' ', '_')}.json"
             with open(output_file_name, "w", encoding="utf8") as f:
                 json.dump(
                     dataclasses.asdict(ques),
@@ -79,7 +93,6 @@ def run_kif(file_names: List[str], config, engine, output_root) -> None:
                     sort_keys=True,
                     separators=(",", ": "),
                 )
-            board.push_usi(move)
 
 
 def main():
@@ -97,20 +110,22 @@ def main():
     args = parser.parse_args()
     with open(args.config) as f:
         config = yaml.safe_load(f)
-    engine_config: ConfigEngine() = from_dict(
-        data_class=ConfigEngine,
-        data=config["engine_config"],
-        config=Config(cast=[tuple, int, str]),
-    )
-    engine = generate_engine(engine_config)
+    # pool_sizeを指定した場合、同じエンジンを複数起動して棋譜の局面を並列に解析する
+    pool_size = config.get("pool_size", 1)
+    if args.kif is not None and pool_size > 1:
+        engine = EnginePool(config["engine_config"], pool_size)
+    else:
+        engine = generate_engine_dict(config["engine_config"])
 
     # あまり上品なコードではないがバイナリを増やしたくない
     if args.sfen is not None:
         sfen_to_use = args.sfen.replace("__space__", " ")
         run_sfen(sfen_to_use, config, engine, args.output)
     if args.kif is not None:
-        # ワイルドカード対応
-        kif_list = glob.glob(args.kif)
+        # ワイルドカード対応。kif_manifestを指定すると前回から変化のないフォルダは読み直さない
+        kif_list = KifManifest(
+            args.kif, config.get("kif_manifest"), parse_header=False
+        ).files()
         run_kif(kif_list, config, engine, args.kif_out_root)
     engine.quit()
 
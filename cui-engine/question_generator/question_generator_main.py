@@ -2,7 +2,6 @@ import argparse
 import dataclasses
 
 # from sekisyu.qgen.question_render import ConfigQuestionRender, question_render
-import glob
 import json
 import os
 from typing import List, Optional
@@ -10,6 +9,7 @@ from typing import List, Optional
 import yaml
 from dacite import Config, from_dict
 from sekisyu.board.get_board_from_pos_cmd import get_board_from_pos_cmd
+from sekisyu.board.kif_manifest import KifManifest
 from sekisyu.engine.config_engine import ConfigEngine
 from sekisyu.engine.engine_generator import generate_engine
 
@@ -39,6 +39,8 @@ class ConfigQuestionGenerator:
     diff_min: int = -300
 
     go_cmd: str = "go nodes 500000"
+    # 棋譜ファイル一覧のキャッシュ(json)の保存先
+    kif_manifest: Optional[str] = None
 
 
 def modify_config(config: ConfigQuestionGenerator):
@@ -46,7 +48,11 @@ def modify_config(config: ConfigQuestionGenerator):
         kif_path = input("kifpath : 解析する棋譜の場所を指定してください（デフォルト:kif）")
         if kif_path == "":
             kif_path = "kif"
-        kifnum = len(glob.glob(kif_path + "/*kif")) + len(glob.glob(kif_path + "/*csa"))
+        kifnum = len(
+            KifManifest(
+                [kif_path + "/*kif", kif_path + "/*csa"], parse_header=False
+            ).files()
+        )
         if kifnum == 0:
             print("棋譜が見つかりません", kif_path)
             continue
@@ -226,9 +232,10 @@ def main():
         print("棋譜解析用のエンジンの起動に失敗しました")
         print("debug message : ", config_qgen.engine_config)
         raise ValueError
-    kifs = []
-    for kif in config_qgen.kifs:
-        kifs.extend(glob.glob(kif))
+    # kif_manifestを指定すると前回から変化のないフォルダは読み直さない
+    kifs = KifManifest(
+        config_qgen.kifs, config_qgen.kif_manifest, parse_header=False
+    ).files()
 
     os.makedirs(config_qgen.output_dir, exist_ok=True)
 
@@ -2,6 +2,7 @@ import argparse
 import sys
 import threading
 from queue import Queue
+from typing import Optional
 
 import yaml
 from sekisyu.engine.base_engine import BaseEngine, UsiEngineState
@@ -11,11 +12,25 @@ from sekisyu.engine.engine_generator import generate_engine_dict
 # nuitkaのバージョンを上げたら解決した。フリーランチバンザイ...?
 
 
-def add_input(input_queue):
+def add_input(event_queue):
     while True:
-        txt = sys.stdin.readline().rstrip()
+        line = sys.stdin.readline()
+        # 標準入力が閉じられたらGUIが落ちたとみなして終了する
+        if line == "":
+            event_queue.put(("input", "quit"))
+            break
+        txt = line.rstrip()
         if txt != "":
-            input_queue.put(txt)
+            event_queue.put(("input", txt))
+
+
+def wait_bestmove_worker(engine: BaseEngine, event_queue, go_id: int):
+    """
+    エンジンがbestmoveを返したらイベントを積む。
+    dlshogiのponderhitのようにgoを送りなおす場合に途中で起きないよう、状態ではなくbestmoveの数で待つ
+    """
+    engine.wait_for_bestmove()
+    event_queue.put(("bestmove", go_id))
 
 
 def usi_engine(engine: BaseEngine):
@@ -23,57 +38,65 @@ def usi_engine(engine: BaseEngine):
     engineを各種guiに接続する
     engine (BaseEngine) : 使うエンジン
     """
-    # 現在bestmoveを待機中である
-    wait_bestmove: bool = False
+    # 現在bestmoveを待機中のgoの番号。待っていなければNone
+    wait_go_id: Optional[int] = None
+    go_id = 0
 
     engine.set_print_info(True)
-    input_queue = Queue()
+    # 標準入力とbestmoveの到着を両方ともこのqueueで受け取る
+    event_queue = Queue()
 
     # 標準入力をマルチスレッドで入れる
     # https://stackoverflow.com/questions/2408560/non-blocking-console-input
-    input_thread = threading.Thread(target=add_input, args=(input_queue,))
+    input_thread = threading.Thread(target=add_input, args=(event_queue,))
     input_thread.daemon = True
     input_thread.start()
 
     while True:
-        if not input_queue.empty():
-            message = input_queue.get()
-            # 先頭の文字列で判別する。
-            messages = message.split()
-            if len(messages):
-                token = messages[0]
-            if token == "go":
-                engine.send_command(message)
-                engine.wait_for_state(UsiEngineState.WaitBestmove)
-                wait_bestmove = True
-            elif token == "isready":
-                # エンジンはboot済であることを仮定
-                engine.send_isready_and_wait()
-                print("readyok", flush=True)
-            elif token == "usi":
-                options = engine.get_usi_option()
-                print("id name " + engine.get_name())
-                for option in options:
-                    print(option, flush=True)
-                print("usiok", flush=True)
-            elif token == "setoption":
-                engine.send_command(message)
-            elif token == "quit":
-                engine.quit()
-                break
-            else:
-                engine.send_command(message)
-        else:
-            # 標準入力がないときはエンジンからの出力を待つ
-            # もとい、bestmoveを受け取ったらそれをパースして出力する
-            if wait_bestmove:
-                if engine.get_state() == UsiEngineState.WaitCommand:
-                    ply = engine.get_current_think_result()
+        # イベントが来るまでブロックする(CPUを使わない)
+        event, value = event_queue.get()
+        if event == "bestmove":
+            # bestmoveを受け取ったらそれをパースして出力する
+            if wait_go_id == value:
+                ply = engine.get_current_think_result()
+                with engine.latency.measure("parse_pv"):
                     ply = engine.parse_pv(ply)
-                    print(
-                        "bestmove " + ply.bestmove + " ponder " + ply.ponder, flush=True
-                    )
-                    wait_bestmove = False
+                print("bestmove " + ply.bestmove + " ponder " + ply.ponder, flush=True)
+                wait_go_id = None
+            continue
+
+        message = value
+        # 先頭の文字列で判別する。
+        messages = message.split()
+        if len(messages):
+            token = messages[0]
+        if token == "go":
+            engine.send_command(message)
+            engine.wait_for_state(UsiEngineState.WaitBestmove)
+            go_id += 1
+            wait_go_id = go_id
+            wait_thread = threading.Thread(
+                target=wait_bestmove_worker, args=(engine, event_queue, go_id)
+            )
+            wait_thread.daemon = True
+            wait_thread.start()
+        elif token == "isready":
+            # エンジンはboot済であることを仮定
+            engine.send_isready_and_wait()
+            print("readyok", flush=True)
+        elif token == "usi":
+            options = engine.get_usi_option()
+            print("id name " + engine.get_name())
+            for option in options:
+                print(option, flush=True)
+            print("usiok", flush=True)
+        elif token == "setoption":
+            engine.send_command(message)
+        elif token == "quit":
+            engine.quit()
+            break
+        else:
+            engine.send_command(message)
 
 
 def main():
@@ -1,95 +1,218 @@
 import os
+import threading
+from queue import Empty, Queue
+from typing import Dict, Optional
 
 from sekisyu.battle.battle_server import BattleServer
 from sekisyu.battle.config_auto_battle import AutoBattleResult, ConfigAutoBattle
+from sekisyu.battle.engine_lifecycle import EngineLifecycleManager
+from sekisyu.battle.sprt import PentanomialSprt, score_1p
 from sekisyu.csa.csa import playout_to_csa_v22
-from sekisyu.engine.engine_generator import generate_engine_dict
+from sekisyu.playout.playout import BasePlayOut
 
 
-def kif_make(conf: ConfigAutoBattle, reboot_engine: bool = True) -> AutoBattleResult:
+def is_2p_black_game(conf: ConfigAutoBattle, game_id: int) -> bool:
+    """
+    game_id局目で2pが先手になるか。flipなら奇数局目で先後を入れ替える
+    """
+    return conf.flip and game_id % 2 == 1
+
+
+def get_initial_pos(
+    conf: ConfigAutoBattle,
+    server: BattleServer,
+    openings: Dict[int, str],
+    game_id: int,
+) -> Optional[str]:
+    """
+    flipの場合、先後を入れ替えた2局(2k, 2k + 1局目)は同じ開始局面から指す
+
+    Args:
+        openings (dict(int, str)): game_id // 2 -> 開始局面。kif_makeの間共有する
+
+    Returns:
+        str : 開始局面。flipでなければNone(局毎にランダム)
+    """
+    if not conf.flip:
+        return None
+    pair_id = game_id // 2
+    if pair_id not in openings:
+        openings[pair_id] = server.choose_initial_pos()
+    return openings[pair_id]
+
+
+def create_sprt(conf: ConfigAutoBattle) -> Optional[PentanomialSprt]:
+    if conf.sprt is None:
+        return None
+    if not conf.flip:
+        raise ValueError("sprt requires flip to pair games with swapped colors")
+    return PentanomialSprt(conf.sprt)
+
+
+def save_playout(
+    conf: ConfigAutoBattle, server: BattleServer, playout: BasePlayOut, game_id: int
+) -> None:
+    """
+    棋譜をjson, csaで保存する。ファイル名は先手_後手_game_idの順になる
+    """
+    engine1, engine2 = server.engines
+    if server.is_2p_black:
+        names = f"{engine2.engine_name}_{engine1.engine_name}"
+    else:
+        names = f"{engine1.engine_name}_{engine2.engine_name}"
+    path = f"{conf.kif_prefix}{playout.timestamp}_{names}_{game_id}"
+    if conf.save_json:
+        playout.to_json(f"{path}.json")
+    if conf.save_csa:
+        playout_to_csa_v22(playout, f"{path}.csa")
+
+
+def kif_make(conf: ConfigAutoBattle, reboot_engine: bool = False) -> AutoBattleResult:
+    """
+    連続対局を行う
+
+    Args:
+        conf (ConfigAutoBattle): 対局の設定
+        reboot_engine (bool): Trueなら1局ごとにエンジンを起動しなおす。
+            Falseならエンジンを使い回し、落ちたときかconf.recycle_games局ごとに起動しなおす
+
+    Returns:
+        AutoBattleResult : 対局結果
+    """
     print(conf)
-    engine1 = generate_engine_dict(conf.config_1p)
-    engine2 = generate_engine_dict(conf.config_2p)
-    engine1.set_print_info(False)
-    engine2.set_print_info(False)
+    if conf.parallel_games > 1:
+        return kif_make_parallel(conf, reboot_engine)
+    manager = EngineLifecycleManager(
+        [conf.config_1p, conf.config_2p],
+        recycle_games=1 if reboot_engine else conf.recycle_games,
+        health_check_timeout=conf.health_check_timeout,
+    )
+    engine1, engine2 = manager.get_engines()
     server: BattleServer = BattleServer(engine1, engine2, conf.config)
 
     os.makedirs(os.path.dirname(conf.kif_prefix), exist_ok=True)
 
-    win_1p_black: int = 0
-    win_1p_white: int = 0
-    draw_1p_black: int = 0
-    draw_1p_white: int = 0
-
-    win_2p_black: int = 0
-    win_2p_white: int = 0
-    draw_2p_black: int = 0
-    draw_2p_white: int = 0
+    result = AutoBattleResult()
+    openings: Dict[int, str] = {}
+    sprt = create_sprt(conf)
 
     for i in range(conf.battle_num):
-        if conf.flip:
-            if i % 2 == 1:
-                server.is_2p_black = True
-            else:
-                server.is_2p_black = False
-        playout = server.play_one_game()
-
-        if playout.result.is_black_win():
-            if server.is_2p_black:
-                win_2p_black += 1
-            else:
-                win_1p_black += 1
-        if playout.result.is_white_win():
-            if server.is_2p_black:
-                win_1p_white += 1
-            else:
-                win_2p_white += 1
-        if playout.result.is_draw():
-            if server.is_2p_black:
-                draw_1p_white += 1
-                draw_2p_black += 1
-            else:
-                draw_2p_white += 1
-                draw_1p_black += 1
+        # 落ちたエンジンなどはここで起動しなおされる
+        engine1, engine2 = manager.get_engines()
+        server.engines = [engine1, engine2]
+        server.is_2p_black = is_2p_black_game(conf, i)
+        playout = server.play_one_game(get_initial_pos(conf, server, openings, i))
+        manager.finish_game()
+
+        result.add_game(playout.result, server.is_2p_black)
 
         if i % conf.print_interval == 0:
-            print(
-                f"{win_1p_black+win_1p_white}-{draw_1p_black+draw_1p_white}-{win_2p_black+win_2p_white} 1p_black {win_1p_black} - {draw_1p_black} - {win_2p_white}, 1p_white {win_1p_white} - {draw_1p_white} - {win_2p_black}"  # noqa
-            )
-        if server.is_2p_black:
-            if conf.save_json:
-                playout.to_json(
-                    f"{conf.kif_prefix}{playout.timestamp}_{engine2.engine_name}_{engine1.engine_name}_{i}.json"
-                )
-            if conf.save_csa:
-                playout_to_csa_v22(
-                    playout,
-                    f"{conf.kif_prefix}{playout.timestamp}_{engine2.engine_name}_{engine1.engine_name}_{i}.csa",
-                )
-        else:
-            if conf.save_json:
-                playout.to_json(
-                    f"{conf.kif_prefix}{playout.timestamp}_{engine1.engine_name}_{engine2.engine_name}_{i}.json"
-                )
-            if conf.save_csa:
-                playout_to_csa_v22(
-                    playout,
-                    f"{conf.kif_prefix}{playout.timestamp}_{engine1.engine_name}_{engine2.engine_name}_{i}.csa",
-                )
-        if reboot_engine:
-            server.terminate()
-            engine1 = generate_engine_dict(conf.config_1p)
-            engine2 = generate_engine_dict(conf.config_2p)
-            engine1.set_print_info(False)
-            engine2.set_print_info(False)
-            server: BattleServer = BattleServer(engine1, engine2, conf.config)
-
-    server.terminate()
-    return AutoBattleResult(
-        win_1p_black=win_1p_black,
-        win_1p_white=win_1p_white,
-        draw_1p_black=draw_1p_black,
-        draw_1p_white=draw_1p_white,
-        win_2p_black=win_2p_black,
-        win_2p_white=win_2p_white,
-    )
+            print(result.to_str())
+        save_playout(conf, server, playout, i)
+
+        if sprt is not None and sprt.add_game(
+            i, score_1p(playout.result, server.is_2p_black)
+        ):
+            print(sprt.to_str())
+            if sprt.status() is not None:
+                print(f"sprt finished : {sprt.status()} accepted after {i + 1} games")
+                break
+
+    manager.terminate()
+    return result
+
+
+def kif_make_parallel(
+    conf: ConfigAutoBattle, reboot_engine: bool = False
+) -> AutoBattleResult:
+    """
+    conf.parallel_games組のエンジンで同時に連続対局を行う。
+
+    対局番号は直列の場合と同じく0からbattle_num - 1で、先後の入れ替えや棋譜のファイル名も対局番号で決まる。
+    対局の大半はエンジンの思考待ちなのでスレッドで並列化する
+
+    Args:
+        conf (ConfigAutoBattle): 対局の設定
+        reboot_engine (bool): kif_makeと同じ
+
+    Returns:
+        AutoBattleResult : 全ての対局を合わせた結果
+    """
+    os.makedirs(os.path.dirname(conf.kif_prefix), exist_ok=True)
+
+    game_ids: "Queue[int]" = Queue()
+    for i in range(conf.battle_num):
+        game_ids.put(i)
+
+    num_workers = min(conf.parallel_games, conf.battle_num)
+    # worker毎の対局結果。最後に足し合わせる
+    results = [AutoBattleResult() for _ in range(num_workers)]
+    lock = threading.Lock()
+    finished_games = [0]
+    openings: Dict[int, str] = {}
+    sprt = create_sprt(conf)
+    # SPRTの判定がついたらset。対局中のものは最後まで指すが新しい対局は始めない
+    stop_event = threading.Event()
+
+    def merge_results() -> AutoBattleResult:
+        merged = AutoBattleResult()
+        for worker_result in results:
+            merged.merge(worker_result)
+        return merged
+
+    def worker(worker_id: int) -> None:
+        manager = EngineLifecycleManager(
+            [conf.config_1p, conf.config_2p],
+            recycle_games=1 if reboot_engine else conf.recycle_games,
+            health_check_timeout=conf.health_check_timeout,
+        )
+        try:
+            engine1, engine2 = manager.get_engines()
+            # initial_pos_listのファイルの読み込みが重ならないようにする
+            with lock:
+                server = BattleServer(engine1, engine2, conf.config)
+            while not stop_event.is_set():
+                try:
+                    i = game_ids.get_nowait()
+                except Empty:
+                    break
+                engine1, engine2 = manager.get_engines()
+                server.engines = [engine1, engine2]
+                server.is_2p_black = is_2p_black_game(conf, i)
+                with lock:
+                    initial_pos = get_initial_pos(conf, server, openings, i)
+                playout = server.play_one_game(initial_pos)
+                manager.finish_game()
+                save_playout(conf, server, playout, i)
+
+                with lock:
+                    results[worker_id].add_game(playout.result, server.is_2p_black)
+                    if finished_games[0] % conf.print_interval == 0:
+                        print(f"{merge_results().to_str()} (game {i})")
+                    finished_games[0] += 1
+                    if (
+                        sprt is not None
+                        and not stop_event.is_set()
+                        and sprt.add_game(
+                            i, score_1p(playout.result, server.is_2p_black)
+                        )
+                    ):
+                        print(sprt.to_str())
+                        if sprt.status() is not None:
+                            print(
+                                f"sprt finished : {sprt.status()} accepted after {finished_games[0]} games"
+                            )
+                            stop_event.set()
+        finally:
+            manager.terminate()
+
+    threads = [
+        threading.Thread(target=worker, args=(worker_id,))
+        for worker_id in range(num_workers)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return merge_results()
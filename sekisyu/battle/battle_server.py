@@ -1,13 +1,14 @@
-import copy
 import os
 import random
 import time
 from datetime import datetime
 from enum import IntEnum
+from typing import Optional
 
+import shogi
 from pytz import timezone
 from sekisyu.battle.config_battle import ConfigBattle
-from sekisyu.battle.draw_checker import draw_check_from_go_cmd
+from sekisyu.battle.draw_checker import RepetitionChecker
 from sekisyu.engine.base_engine import BaseEngine
 from sekisyu.playout.log_scanner import Scanner
 from sekisyu.playout.playinfo import BasePlayInfoPack
@@ -58,6 +59,9 @@ class BattleServer:
         # 開始局面からの手数
         self.game_ply = 1
 
+        # 千日手の判定に使う局面の履歴
+        self.repetition = RepetitionChecker("position startpos")
+
         # 現在のゲーム状態
         # ゲームが終了したら、game_result.is_gameover() == Trueになる。
         self.game_result = GameResult.INIT
@@ -157,18 +161,31 @@ class BattleServer:
 
         self.__time_setting = time_setting
 
-    def play_one_game(self):
+    def choose_initial_pos(self) -> str:
+        """
+        開始局面をランダムに選ぶ
+        """
+        if len(self.config.initial_pos_list) > 0:
+            return random.choice(self.config.initial_pos_list)
+        return "position startpos moves"
+
+    def play_one_game(self, initial_pos: Optional[str] = None):
+        """
+        1局指す
+
+        Args:
+            initial_pos (str): 開始局面。先後を入れ替えて同じ局面から指す場合などに指定する。
+                Noneならinitial_pos_listからランダムに選ぶ
+        """
 
         # ゲーム対局中ではないか？これは前提条件の違反
         if self.game_result == GameResult.PLAYING:
             raise ValueError("must be gameover.")
 
         # 局面をランダムに選ぶ
-        if len(self.config.initial_pos_list) > 0:
-            sfen = random.choice(self.config.initial_pos_list)
-        else:
-            sfen = "position startpos moves"
-        sfen = sfen.replace("\n", "")
+        if initial_pos is None:
+            initial_pos = self.choose_initial_pos()
+        sfen = initial_pos.replace("\n", "")
 
         if "position" not in sfen:
             sfen = "position " + sfen
@@ -178,12 +195,12 @@ class BattleServer:
             sfen += " moves"
 
         self.sfen = sfen
-        initial_ply = len(sfen.split(" ")) - 2
-        if initial_ply % 2 == 1:
-            self.side_to_move = Turn.BLACK
-        else:
-            self.side_to_move = Turn.WHITE
-        self.game_ply = initial_ply
+        # 千日手の判定用に局面を1手ずつ追いかける
+        self.repetition = RepetitionChecker(sfen)
+        # sfenから始まる場合もあるので手番と手数は盤面から取る
+        board = self.repetition.board
+        self.side_to_move = Turn.BLACK if board.turn == shogi.BLACK else Turn.WHITE
+        self.game_ply = board.move_number
 
         for engine in self.engines:
             engine.send_isready_and_wait()  # やねうら王は毎回isreadyを読んだほうがいい？
@@ -223,8 +240,7 @@ class BattleServer:
             game_config=self.config,
             tags=self.config.tags,
         )
-        if len(self.sfen.split(" ")) > 3:
-            playout.plys = copy.deepcopy(self.sfen.split(" ")[3:])
+        playout.plys = self.sfen.split(" moves", 1)[1].split()
         while self.game_ply < self.config.moves_to_draw:
 
             # 手番側に属するエンジンを取得する
@@ -232,10 +248,19 @@ class BattleServer:
             engine = self.engine(self.side_to_move)
             # engine_waiting = self.engine(self.side_to_move.flip())
             # 千日手を発見
-            if draw_check_from_go_cmd(self.sfen):
+            repetition = self.repetition.check()
+            if repetition == GameResult.DRAW:
+                print("found inf loop", self.sfen)
                 self.game_result = GameResult.DRAW
                 playout.result = self.game_result
                 break
+            elif repetition is not None:
+                # 連続王手の千日手は王手をかけた側の反則負け
+                print("found perpetual check", self.sfen)
+                self.game_result = repetition
+                playout.result = self.game_result
+                self.__game_over()
+                return playout
 
             engine.send_command(self.sfen)
 
@@ -312,6 +337,7 @@ class BattleServer:
                 self.__game_over()
                 return playout
             self.sfen = self.sfen + " " + bestmove
+            self.repetition.push_usi(bestmove)
             self.game_ply += 1
 
             # inctime分、時間を加算
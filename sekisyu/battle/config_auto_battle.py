@@ -1,7 +1,20 @@
 import dataclasses
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 
 from sekisyu.battle.config_battle import ConfigBattle
+from sekisyu.playout.playout import GameResult
+
+
+@dataclasses.dataclass
+class ConfigSprt:
+    # 帰無仮説のelo差(1p - 2p)
+    elo0: float = 0.0
+    # 対立仮説のelo差(1p - 2p)
+    elo1: float = 5.0
+    # 第1種の誤り率(H0が正しいのにH1を採択する)
+    alpha: float = 0.05
+    # 第2種の誤り率(H1が正しいのにH0を採択する)
+    beta: float = 0.05
 
 
 @dataclasses.dataclass
@@ -24,6 +37,14 @@ class ConfigAutoBattle:
     save_json: bool = True
     # playoutのcsaを保存する
     save_csa: bool = True
+    # この対局数ごとにエンジンを起動しなおす。0なら落ちたときだけ起動しなおす
+    recycle_games: int = 0
+    # 対局前の生存確認(isready)を待つ秒数
+    health_check_timeout: float = 60.0
+    # 同時に行う対局数。対局毎にエンジンを1組ずつ起動する
+    parallel_games: int = 1
+    # 指定した場合、先後を入れ替えた2局毎にSPRTを行い、判定がついたらbattle_numに達する前に打ち切る
+    sprt: Optional[ConfigSprt] = None
 
 
 @dataclasses.dataclass
@@ -34,3 +55,41 @@ class AutoBattleResult:
     draw_1p_white: int = 0
     win_2p_black: int = 0
     win_2p_white: int = 0
+
+    def add_game(self, result: GameResult, is_2p_black: bool) -> None:
+        """
+        1局分の結果を加える
+
+        Args:
+            result (GameResult): 対局結果
+            is_2p_black (bool): 2pが先手だったか
+        """
+        if result.is_black_win():
+            if is_2p_black:
+                self.win_2p_black += 1
+            else:
+                self.win_1p_black += 1
+        if result.is_white_win():
+            if is_2p_black:
+                self.win_1p_white += 1
+            else:
+                self.win_2p_white += 1
+        if result.is_draw():
+            if is_2p_black:
+                self.draw_1p_white += 1
+            else:
+                self.draw_1p_black += 1
+
+    def merge(self, other: "AutoBattleResult") -> None:
+        """
+        別の対局結果を足し合わせる
+        """
+        for f in dataclasses.fields(self):
+            setattr(self, f.name, getattr(self, f.name) + getattr(other, f.name))
+
+    def to_str(self) -> str:
+        return (
+            f"{self.win_1p_black+self.win_1p_white}-{self.draw_1p_black+self.draw_1p_white}-{self.win_2p_black+self.win_2p_white} "  # noqa
+            f"1p_black {self.win_1p_black} - {self.draw_1p_black} - {self.win_2p_white}, "
+            f"1p_white {self.win_1p_white} - {self.draw_1p_white} - {self.win_2p_black}"
+        )
@@ -9,7 +9,7 @@ class ConfigBattle:
     対局条件を格納する。
 
     initial_pos_list (list(str)):
-        初期局面のリスト。デフォルトは["startpos moves"]。現状sfen形式は非対応
+        初期局面のリスト。デフォルトは["startpos moves"]。"sfen ... moves ..."の形式も使える
 
     initial_pos_filename str:
         初期局面のリストが格納されたファイル
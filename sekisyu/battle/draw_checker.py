@@ -1,25 +1,117 @@
+from typing import Dict, List, Optional
+
 import shogi
+from sekisyu.board.get_board_from_pos_cmd import get_board_from_pos_cmd
+from sekisyu.playout.playout import GameResult
+
+
+class RepetitionChecker:
+    """
+    対局中の局面を1手ずつ追いかけて千日手を判定する
+
+    python-shogiが差分更新しているzobrist hashで局面を数えるので、1手あたりの判定はO(1)。
+    同一局面が4回現れたら千日手とし、その間一方が王手をかけ続けていた場合は王手をかけた側の反則負けとする
+    """
+
+    def __init__(self, pos_cmd: str) -> None:
+        """
+        Args:
+            pos_cmd (str): 開始局面のpositionコマンド。startpos, sfenのどちらでもよい
+        """
+        # 局面のhash -> 出現回数
+        self.counts: Dict[int, int] = {}
+        # 局面のhash -> 最初に出現した手数
+        self.first_ply: Dict[int, int] = {}
+        # 手番毎の、連続して王手をかけている手の数
+        self.check_streak: List[int] = [0, 0]
+        self.ply = 0
+        self.result: Optional[GameResult] = None
+        # 不正な指し手などで局面を追えなくなったらTrue
+        self.broken = False
+
+        moves_id = pos_cmd.find("moves")
+        if moves_id == -1:
+            moves_id = len(pos_cmd)
+        self.board: shogi.Board = get_board_from_pos_cmd(pos_cmd[:moves_id])
+        moves = pos_cmd[moves_id + 6 :].split(" ")
+        self.add_position()
+        for move in moves:
+            if move != "":
+                self.push_usi(move)
+
+    def add_position(self) -> None:
+        """
+        現在の局面を数え、千日手になっていればresultに書く
+        """
+        key = self.board.zobrist_hash()
+        count = self.counts.get(key, 0) + 1
+        self.counts[key] = count
+        if count == 1:
+            self.first_ply[key] = self.ply
+            return
+        if count < 4:
+            return
+        # 同一局面の間は手番が同じなので、span手のうち各手番が指したのはspan // 2手
+        span = self.ply - self.first_ply[key]
+        for turn in (shogi.BLACK, shogi.WHITE):
+            if self.check_streak[turn] * 2 >= span:
+                self.result = GameResult.from_illeagal(turn)  # type:ignore
+                return
+        self.result = GameResult.DRAW
+
+    def push_usi(self, move: str) -> None:
+        """
+        1手進める
+        """
+        if self.broken or self.result is not None:
+            return
+        try:
+            turn = self.board.turn
+            self.board.push_usi(move)
+        except Exception:
+            print("bad move found", move)
+            self.broken = True
+            return
+        self.ply += 1
+        if self.board.is_check():
+            self.check_streak[turn] += 1
+        else:
+            self.check_streak[turn] = 0
+        self.add_position()
+
+    def check(self) -> Optional[GameResult]:
+        """
+        Returns:
+            GameResult : 千日手ならDRAW、連続王手の千日手なら王手をかけた側の反則負け。それ以外はNone
+        """
+        return self.result
 
 
 def draw_check_from_go_cmd(pos_cmd: str) -> bool:
     """
     goコマンドに送られた内容から引き分け判定を行う
-    python-shogiをつかって出てきた局面をsfenにしてsetを作って云々でやるべきか、やねうら王の機能を使うべきかは要検証
-    とりあえず動けばよかろうでpython-shogiで雑に判定する
+    対局中に繰り返し呼ぶ場合は手数の2乗の計算量になるので、RepetitionCheckerを使いまわすこと
     """
-    assert "startpos" in pos_cmd
-    try:
-        board = shogi.Board()
-        moves = pos_cmd.split(" ")
-        if len(moves) < 3:
-            return False
-        moves = moves[3:]
-        for move in moves:
-            board.push_usi(move)
-        result = board.is_fourfold_repetition()
-        if result:
-            print("found inf loop", pos_cmd)
-    except Exception:
-        print("bad move found", pos_cmd)
-        return False
-    return result  # type:ignore
+    result = RepetitionChecker(pos_cmd).check()
+    if result is not None:
+        print("found inf loop", pos_cmd)
+    return result is not None
+
+
+if __name__ == "__main__":
+    loop = " 5i4h 5a4b 4h5i 4b5a" * 3
+    print(draw_check_from_go_cmd("position startpos moves" + loop))
+    print(RepetitionChecker("position startpos moves" + loop).check())
+    print(
+        RepetitionChecker(
+            "position sfen lnsgkgsnl/1r5b1/ppppppppp/9/9/9/PPPPPPPPP/1B5R1/LNSGKGSNL b - 1 moves"
+            + loop
+        ).check()
+    )
+    # 先手が王手をかけ続ける千日手は先手の反則負け
+    perpetual = " 4i5i 5a4a 5i4i 4a5a" * 3
+    print(
+        RepetitionChecker(
+            "position sfen 4k4/9/9/9/9/9/9/9/K4R3 b - 1 moves" + perpetual
+        ).check()
+    )
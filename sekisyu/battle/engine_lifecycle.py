@@ -0,0 +1,215 @@
+import copy
+import os
+import signal
+import subprocess
+import threading
+from typing import Any, Dict, List, Optional
+
+from sekisyu.engine.base_engine import BaseEngine
+from sekisyu.engine.engine_generator import generate_engine_dict
+
+
+def run_with_timeout(func, timeout: float) -> bool:
+    """
+    funcを別スレッドで実行し、timeout秒以内に終わったかを返す。
+    固まったエンジン相手でも呼び出し側が止まらないようにするためのもの
+
+    Args:
+        func (callable): 実行する関数
+        timeout (float): 待つ秒数
+
+    Returns:
+        bool : 時間内に例外なく終わったらTrue
+    """
+    succeeded = threading.Event()
+
+    def worker() -> None:
+        try:
+            func()
+            succeeded.set()
+        except Exception as e:
+            print(f"info string engine call failed {e}")
+
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    return succeeded.is_set()
+
+
+def kill_process_tree(proc: subprocess.Popen) -> None:
+    """
+    プロセスを子プロセスごと強制終了する。
+    エンジンはshell=Trueで起動しているので、procを止めるだけではエンジン本体が残る。
+    起動スクリプトを挟む場合はエンジンが孫以降になるので子孫を全て止める
+    """
+    if os.name == "nt":
+        subprocess.run(
+            ["taskkill", "/F", "/T", "/PID", str(proc.pid)],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+    else:
+        # 先に子孫を全て集めておく(親が死ぬとinitの子になって辿れなくなる)
+        descendants = []
+        parents = [proc.pid]
+        while len(parents) > 0:
+            result = subprocess.run(
+                ["pgrep", "-P", ",".join(str(pid) for pid in parents)],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                universal_newlines=True,
+            )
+            parents = [int(pid) for pid in result.stdout.split()]
+            descendants.extend(parents)
+        for pid in descendants:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+    proc.kill()
+
+
+def kill_engine_process(engine: BaseEngine, close_timeout: float = 5.0) -> None:
+    """
+    エンジンのプロセスを強制終了する。quitに応答しないエンジンがCPUを使い続けないようにするためのもの。
+    virtual engineの場合は中のエンジンのプロセスを終了する
+
+    Args:
+        close_timeout (float): reactorがパイプの切断を検出するまで待つ秒数
+    """
+    proc = getattr(engine, "proc", None)
+    if proc is not None:
+        try:
+            kill_process_tree(proc)
+        except OSError as e:
+            print(f"info string failed to kill engine {e}")
+        # reactorに登録されたままのfdを閉じると、次に起動したエンジンが同じ番号のfdを
+        # 登録できなくなるので、reactorがEOFを読んで登録を外すまで待ってから閉じる
+        transport_closed = getattr(engine, "transport_closed", None)
+        if (
+            getattr(engine, "reactor_registered", False)
+            and transport_closed is not None
+            and not transport_closed.wait(close_timeout)
+        ):
+            # 閉じられない場合はパイプを残す(fdが漏れるだけで他のエンジンは止まらない)
+            print(f"info string engine pipe not closed {engine.get_name()}")
+        else:
+            engine.close_process()
+    children = list(getattr(engine, "engines", []))
+    for attr in ["engine", "engine_analyze"]:
+        child = getattr(engine, attr, None)
+        if child is not None and child is not engine:
+            children.append(child)
+    for child in children:
+        kill_engine_process(child)
+
+
+class EngineLifecycleManager:
+    """
+    連続対局で使うエンジンを起動したまま使い回す
+
+    対局の前にisreadyで生存確認を行い、落ちている、または応答がないエンジンだけを起動しなおす。
+    recycle_gamesを指定した場合はその対局数ごとに起動しなおす
+    """
+
+    def __init__(
+        self,
+        configs: List[Dict[str, Any]],
+        recycle_games: int = 0,
+        health_check_timeout: float = 60.0,
+    ) -> None:
+        """
+        Args:
+            configs (list(dict(str, any))): generate_engine_dictに渡すエンジンの設定
+            recycle_games (int): この対局数ごとにエンジンを起動しなおす。0なら落ちない限り使い続ける
+            health_check_timeout (float): isreadyの応答を待つ秒数
+        """
+        self.configs = configs
+        self.recycle_games = recycle_games
+        self.health_check_timeout = health_check_timeout
+        self.engines: List[Optional[BaseEngine]] = [None] * len(configs)
+        # 起動してから指した対局数
+        self.games_since_boot: List[int] = [0] * len(configs)
+        # 起動しなおした回数
+        self.restart_count: List[int] = [0] * len(configs)
+
+    def boot(self, index: int) -> BaseEngine:
+        """
+        index番目のエンジンを(起動済なら落としてから)起動する
+        """
+        self.shutdown(index)
+        engine = generate_engine_dict(copy.deepcopy(self.configs[index]))
+        engine.set_print_info(False)
+        self.engines[index] = engine
+        self.games_since_boot[index] = 0
+        return engine
+
+    def shutdown(self, index: int, force: bool = False) -> None:
+        """
+        index番目のエンジンを終了する
+
+        Args:
+            force (bool): Trueならquitを送らずにプロセスを強制終了する。応答がないと分かっているエンジン用
+        """
+        engine = self.engines[index]
+        if engine is None:
+            return
+        self.engines[index] = None
+        if force:
+            kill_engine_process(engine)
+            return
+        # 応答のないエンジンのquitは返ってこないことがあるので待ちすぎない
+        if not run_with_timeout(engine.quit, self.health_check_timeout):
+            # quitを待つスレッドは諦めるだけなので、プロセスを止めないと裏でCPUを使い続ける
+            print(f"info string failed to quit engine {engine.get_name()}. kill it")
+            kill_engine_process(engine)
+
+    def health_check(self, engine: BaseEngine) -> bool:
+        """
+        エンジンが生きていてisreadyに応答するか
+
+        Returns:
+            bool : 対局に使えるならTrue
+        """
+        if engine.is_dead():
+            return False
+        if not run_with_timeout(
+            engine.send_isready_and_wait, self.health_check_timeout
+        ):
+            return False
+        return not engine.is_dead()
+
+    def get_engines(self) -> List[BaseEngine]:
+        """
+        対局に使うエンジンを返す。必要なものだけ起動しなおす
+
+        Returns:
+            list(BaseEngine) : configsと同じ順番のエンジン
+        """
+        for index, engine in enumerate(self.engines):
+            if engine is None:
+                self.boot(index)
+                continue
+            if self.recycle_games > 0 and (
+                self.games_since_boot[index] >= self.recycle_games
+            ):
+                self.boot(index)
+                continue
+            if not self.health_check(engine):
+                print(f"info string restart engine {engine.get_name()}")
+                self.restart_count[index] += 1
+                # isreadyに応答しないエンジンはquitにも応答しないので待たずに止める
+                self.shutdown(index, force=True)
+                self.boot(index)
+        return self.engines  # type:ignore
+
+    def finish_game(self) -> None:
+        """
+        1局終わったら呼ぶ
+        """
+        for index in range(len(self.engines)):
+            self.games_since_boot[index] += 1
+
+    def terminate(self) -> None:
+        for index in range(len(self.engines)):
+            self.shutdown(index)
@@ -0,0 +1,131 @@
+import math
+from typing import Dict, List, Optional
+
+from sekisyu.battle.config_auto_battle import ConfigSprt
+from sekisyu.playout.playout import GameResult
+
+"""
+連続対局の逐次確率比検定(SPRT)
+
+同じ開始局面から先後を入れ替えて指した2局を1組とし、1pの2局の合計得点(0, 0.5, 1, 1.5, 2)の
+5項分布(pentanomial)から対数尤度比(LLR)を求める。
+LLRはfishtestなどと同じ正規近似 LLR = N * (s1 - s0) * (2 * mu - s0 - s1) / (2 * var) を使う
+"""
+
+# 空のbinがあると分散が0になりうるので全binに足しておく
+REGULARIZE = 1e-3
+
+
+def elo_to_score(elo: float) -> float:
+    """
+    elo差から期待得点を求める
+    """
+    return 1.0 / (1.0 + 10.0 ** (-elo / 400.0))
+
+
+def score_1p(result: GameResult, is_2p_black: bool) -> float:
+    """
+    1局の1pの得点。勝ち1、負け0、それ以外(千日手、最大手数など)0.5
+    """
+    if result.is_black_win():
+        return 0.0 if is_2p_black else 1.0
+    if result.is_white_win():
+        return 1.0 if is_2p_black else 0.0
+    return 0.5
+
+
+class PentanomialSprt:
+    """
+    先後を入れ替えた2局を1組としたSPRT
+
+    pentanomial (list(int)):
+        1pの2局の合計得点が0, 0.5, 1, 1.5, 2だった組の数
+    """
+
+    def __init__(self, config: ConfigSprt) -> None:
+        self.config = config
+        self.pentanomial: List[int] = [0] * 5
+        self.s0 = elo_to_score(config.elo0)
+        self.s1 = elo_to_score(config.elo1)
+        # LLRがこれを下回ればH0、上回ればH1を採択する
+        self.lower_bound = math.log(config.beta / (1.0 - config.alpha))
+        self.upper_bound = math.log((1.0 - config.beta) / config.alpha)
+        # 対局番号 // 2 -> 終わった対局の1pの得点。2局揃ったらpentanomialに積む
+        self.pending: Dict[int, List[float]] = {}
+
+    def add_game(self, game_id: int, score: float) -> bool:
+        """
+        1局分の1pの得点を加える。並列対局で終わる順番が前後してもよい
+
+        Args:
+            game_id (int): 対局番号。2k, 2k + 1局目を1組とする
+            score (float): 1pの得点
+
+        Returns:
+            bool : 組が揃ってLLRが更新されたらTrue
+        """
+        scores = self.pending.setdefault(game_id // 2, [])
+        scores.append(score)
+        if len(scores) < 2:
+            return False
+        del self.pending[game_id // 2]
+        self.add_pair(scores[0] + scores[1])
+        return True
+
+    def add_pair(self, pair_score: float) -> None:
+        """
+        1組の1pの合計得点(0-2)を加える
+        """
+        self.pentanomial[int(round(pair_score * 2))] += 1
+
+    def num_pairs(self) -> int:
+        return sum(self.pentanomial)
+
+    def llr(self) -> float:
+        """
+        対数尤度比を返す
+        """
+        n = self.num_pairs()
+        if n == 0:
+            return 0.0
+        counts = [count + REGULARIZE for count in self.pentanomial]
+        total = sum(counts)
+        # 1組の得点を0-1に正規化したもの
+        scores = [index / 4.0 for index in range(5)]
+        mu = sum(c * x for c, x in zip(counts, scores)) / total
+        var = sum(c * (x - mu) ** 2 for c, x in zip(counts, scores)) / total
+        if var <= 0.0:
+            return 0.0
+        return n * (self.s1 - self.s0) * (2.0 * mu - self.s0 - self.s1) / (2.0 * var)
+
+    def status(self) -> Optional[str]:
+        """
+        検定の結果
+
+        Returns:
+            str : H0を採択したら"H0"、H1を採択したら"H1"、まだ判定できなければNone
+        """
+        llr = self.llr()
+        if llr <= self.lower_bound:
+            return "H0"
+        if llr >= self.upper_bound:
+            return "H1"
+        return None
+
+    def to_str(self) -> str:
+        return (
+            f"sprt elo0={self.config.elo0} elo1={self.config.elo1} "
+            f"llr={self.llr():.3f} ({self.lower_bound:.3f}, {self.upper_bound:.3f}) "
+            f"pentanomial={self.pentanomial}"
+        )
+
+
+if __name__ == "__main__":
+    sprt = PentanomialSprt(ConfigSprt(elo0=0.0, elo1=10.0))
+    # 1pが明らかに強い場合
+    game_id = 0
+    while sprt.status() is None:
+        for score in [1.0, 0.5, 1.0, 0.0, 1.0, 1.0]:
+            sprt.add_game(game_id, score)
+            game_id += 1
+    print(game_id, sprt.status(), sprt.to_str())
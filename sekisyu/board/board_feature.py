@@ -0,0 +1,131 @@
+from typing import List, Tuple
+
+import numpy as np
+import shogi
+
+"""
+盤面のnumpy表現
+
+盤上の駒は(先後2 x 駒の種類14) x 81升のone-hot、持ち駒は先後2 x 駒の種類7の枚数で表す。
+駒のidはforcebook_engine.get_piece_idと同じで、先手の駒が0-13、後手の駒が14-27
+"""
+
+NUM_PIECE_ID = 28
+NUM_HAND_PIECE = 7
+# 持ち駒の枚数の最大値
+HAND_MAX = 18
+BOARD_FEATURE_SIZE = NUM_PIECE_ID * 81
+HAND_FEATURE_SIZE = 2 * NUM_HAND_PIECE * HAND_MAX
+
+SQUARE_INDEX = np.arange(81)
+
+
+def bitboard_to_array(bitboard: int) -> np.ndarray:
+    """
+    81bitのbitboardを升毎のbool配列にする
+    """
+    bits = np.unpackbits(
+        np.frombuffer(bitboard.to_bytes(11, "little"), dtype=np.uint8),
+        bitorder="little",
+    )
+    return bits[:81].astype(bool)
+
+
+def encode_board(board: shogi.Board) -> np.ndarray:
+    """
+    盤上の駒をone-hotにする
+
+    Returns:
+        np.ndarray : shape (28 x 81,)。駒id x 81 + 升の位置が1
+    """
+    pieces = np.asarray(board.pieces)
+    occupied = pieces != shogi.NONE
+    piece_id = (
+        pieces
+        - 1
+        + NUM_PIECE_ID // 2 * bitboard_to_array(board.occupied.by_color[shogi.WHITE])
+    )
+    out = np.zeros(BOARD_FEATURE_SIZE)
+    out[piece_id[occupied] * 81 + SQUARE_INDEX[occupied]] = 1.0
+    return out
+
+
+def encode_square_pieces(board: shogi.Board) -> np.ndarray:
+    """
+    升毎の駒idを並べた小さい表現。棋譜の索引のように大量の局面を持つ場合に使う
+
+    Returns:
+        np.ndarray : shape (81,)のuint8。駒id + 1、空き升は0
+    """
+    pieces = np.asarray(board.pieces)
+    piece_id = pieces + NUM_PIECE_ID // 2 * bitboard_to_array(
+        board.occupied.by_color[shogi.WHITE]
+    )
+    return np.where(pieces != shogi.NONE, piece_id, 0).astype(np.uint8)
+
+
+def encode_hand(board: shogi.Board) -> np.ndarray:
+    """
+    持ち駒の枚数
+
+    Returns:
+        np.ndarray : shape (2, 7)。[先後][駒の種類 - 1]の枚数
+    """
+    out = np.zeros((2, NUM_HAND_PIECE))
+    for color in shogi.COLORS:
+        for piece_type, num in board.pieces_in_hand[color].items():
+            out[color, piece_type - 1] = num
+    return out
+
+
+def hand_to_onehot(hand: np.ndarray) -> np.ndarray:
+    """
+    持ち駒の枚数をone-hotにする。0枚の駒は全て0
+
+    Args:
+        hand (np.ndarray): shape (..., 2, 7)の持ち駒の枚数
+
+    Returns:
+        np.ndarray : shape (..., 2 x 7 x 18)。(先後 x 7 + 駒の種類 - 1) x 18 + 枚数 - 1が1
+    """
+    counts = np.arange(1, HAND_MAX + 1)
+    onehot = (hand[..., None] == counts).astype(float)
+    return onehot.reshape(hand.shape[:-2] + (HAND_FEATURE_SIZE,))
+
+
+def encode_boards(boards: List[shogi.Board]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    複数の盤面をまとめてencodeする
+
+    Returns:
+        tuple(np.ndarray, np.ndarray) : shape (n, 28 x 81)の盤上の駒、shape (n, 2, 7)の持ち駒
+    """
+    if len(boards) == 0:
+        return np.zeros((0, BOARD_FEATURE_SIZE)), np.zeros((0, 2, NUM_HAND_PIECE))
+    return (
+        np.stack([encode_board(board) for board in boards]),
+        np.stack([encode_hand(board) for board in boards]),
+    )
+
+
+def encode_moves(
+    moves: List[str], ply_min: int = 0, ply_max: int = 10000
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    平手から指し手を進めた各局面をencodeする。ply_min手目からply_max手目まで
+
+    Returns:
+        tuple(np.ndarray, np.ndarray) : encode_boardsと同じ
+    """
+    board = shogi.Board()
+    board_features = []
+    hands = []
+    for i in range(min(ply_max, len(moves))):
+        board.push(shogi.Move.from_usi(moves[i]))
+        if i < ply_min:
+            continue
+        board_features.append(encode_board(board))
+        hands.append(encode_hand(board))
+    if len(board_features) == 0:
+        return np.zeros((0, BOARD_FEATURE_SIZE)), np.zeros((0, 2, NUM_HAND_PIECE))
+    return np.stack(board_features), np.stack(hands)
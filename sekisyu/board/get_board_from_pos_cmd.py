@@ -1,24 +1,178 @@
+import copy
+import threading
+from collections import Counter, OrderedDict
+from typing import List, Optional, Tuple
+
 import shogi
 
 
-def get_board_from_pos_cmd(pos_cmd: str) -> shogi.Board:
+def split_pos_cmd(pos_cmd: str) -> Tuple[str, Tuple[str, ...]]:
+    """
+    positionコマンドを開始局面のsfenと指し手に分ける
+
+    Returns:
+        tuple(str, tuple(str)) : 開始局面のsfen(startposなら空文字)、指し手
+    """
     sfen_id = pos_cmd.find("sfen")
     moves_id = pos_cmd.find("moves")
 
+    sfen = ""
     if sfen_id != -1:
         if moves_id != -1:
             sfen = pos_cmd[sfen_id + 5 : moves_id]
         else:
             sfen = pos_cmd[sfen_id + 5 :]
-        board = shogi.Board(sfen=sfen)
-    else:
-        board = shogi.Board()
+    moves: Tuple[str, ...] = ()
     if moves_id != -1:
-        moves = pos_cmd[moves_id + 6 :].split(" ")
-        for move in moves:
-            if move != "":
-                board.push_usi(move)
-    return board
+        moves = tuple(move for move in pos_cmd[moves_id + 6 :].split(" ") if move != "")
+    return sfen.strip(), moves
+
+
+def copy_board(board: shogi.Board) -> shogi.Board:
+    """
+    盤面を複製する。copy.deepcopyやsfenからの再構築より1桁速い
+    """
+    out = shogi.Board.__new__(shogi.Board)
+    out.pseudo_legal_moves = shogi.PseudoLegalMoveGenerator(out)
+    out.legal_moves = shogi.LegalMoveGenerator(out)
+    out.piece_bb = list(board.piece_bb)
+    out.pieces_in_hand = [Counter(hand) for hand in board.pieces_in_hand]
+    occupied = shogi.Occupied.__new__(shogi.Occupied)
+    occupied.by_color = list(board.occupied.by_color)
+    occupied.bits = board.occupied.bits
+    occupied.l45 = board.occupied.l45
+    occupied.r45 = board.occupied.r45
+    occupied.l90 = board.occupied.l90
+    out.occupied = occupied
+    out.king_squares = list(board.king_squares)
+    out.pieces = list(board.pieces)
+    out.turn = board.turn
+    out.move_number = board.move_number
+    out.captured_piece_stack = copy.copy(board.captured_piece_stack)
+    out.move_stack = copy.copy(board.move_stack)
+    out.incremental_zobrist_hash = board.incremental_zobrist_hash
+    out.transpositions = Counter(board.transpositions)
+    return out
+
+
+class BoardCache:
+    """
+    positionコマンド -> 盤面のLRUキャッシュ
+
+    キャッシュにない局面でも、開始局面が同じで指し手が前方一致する局面があれば
+    そこから残りの指し手だけを進める。対局の進行やpvのように1手ずつ伸びていく局面で効く
+    """
+
+    def __init__(self, max_entries: int = 64) -> None:
+        self.max_entries = max_entries
+        # (開始局面のsfen, 指し手) -> 盤面。最後に使ったものが末尾
+        self.boards: "OrderedDict[Tuple[str, Tuple[str, ...]], shogi.Board]" = (
+            OrderedDict()
+        )
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def find_prefix(
+        self, sfen: str, moves: Tuple[str, ...]
+    ) -> Tuple[Optional[shogi.Board], int]:
+        """
+        指し手がもっとも長く前方一致する盤面を探す
+
+        Returns:
+            tuple(shogi.Board, int) : 盤面(なければNone)、一致した指し手の数
+        """
+        board = self.boards.get((sfen, moves))
+        if board is not None:
+            self.boards.move_to_end((sfen, moves))
+            return board, len(moves)
+        best_key = None
+        best_len = -1
+        for key in self.boards:
+            key_sfen, key_moves = key
+            num = len(key_moves)
+            if (
+                key_sfen == sfen
+                and best_len < num < len(moves)
+                and moves[:num] == key_moves
+            ):
+                best_key = key
+                best_len = num
+        if best_key is None:
+            return None, 0
+        self.boards.move_to_end(best_key)
+        return self.boards[best_key], best_len
+
+    def get(self, pos_cmd: str) -> shogi.Board:
+        """
+        positionコマンドの局面の盤面を返す。返り値は複製なので自由に変更してよい
+        """
+        sfen, moves = split_pos_cmd(pos_cmd)
+        with self.lock:
+            cached, num = self.find_prefix(sfen, moves)
+            if cached is not None and num == len(moves):
+                self.hits += 1
+                return copy_board(cached)
+            self.misses += 1
+            board = (
+                copy_board(cached)
+                if cached is not None
+                else shogi.Board(sfen=sfen if sfen != "" else None)
+            )
+        for move in moves[num:]:
+            board.push_usi(move)
+        with self.lock:
+            self.boards[(sfen, moves)] = copy_board(board)
+            while len(self.boards) > self.max_entries:
+                self.boards.popitem(last=False)
+        return board
+
+
+board_cache = BoardCache()
+
+
+def get_board_from_pos_cmd(pos_cmd: str) -> shogi.Board:
+    return board_cache.get(pos_cmd)
+
+
+class BoardCursor:
+    """
+    1つの盤面に指し手をpush, popしながらpvなどを辿るためのもの
+
+    positionコマンドの文字列を伸ばしてget_board_from_pos_cmdを呼び直す代わりに使う
+    """
+
+    def __init__(self, pos_cmd: str) -> None:
+        self.board = get_board_from_pos_cmd(pos_cmd)
+        self.pos_cmd = pos_cmd if "moves" in pos_cmd else pos_cmd + " moves"
+        # pushした指し手
+        self.moves: List[str] = []
+
+    def push(self, move: str) -> None:
+        self.board.push_usi(move)
+        self.moves.append(move)
+
+    def pop(self) -> str:
+        self.board.pop()
+        return self.moves.pop()
+
+    def pop_all(self) -> None:
+        """
+        pushした指し手を全て戻す
+        """
+        while self.moves:
+            self.pop()
+
+    def sfen(self) -> str:
+        return self.board.sfen()
+
+    def get_pos_cmd(self) -> str:
+        """
+        現在の局面のpositionコマンド
+        """
+        if len(self.moves) == 0:
+            return self.pos_cmd
+        return self.pos_cmd + " " + " ".join(self.moves)
 
 
 if __name__ == "__main__":
@@ -35,3 +189,39 @@ if __name__ == "__main__":
             "position sfen lnsgkgsnl/1r5b1/ppppppppp/9/9/9/PPPPPPPPP/1B5R1/LNSGKGSNL b - 1"
         )
     )
+
+    import random
+    import time
+
+    # 前方一致でたどった盤面が最初から並べた盤面と一致するか、速度はどうか
+    rnd = random.Random(0)
+    board = shogi.Board()
+    moves: List[str] = []
+    for _ in range(150):
+        legal_moves = list(board.legal_moves)
+        if not legal_moves:
+            break
+        move = rnd.choice(legal_moves).usi()
+        board.push_usi(move)
+        moves.append(move)
+    elapsed_cache = 0.0
+    elapsed_scratch = 0.0
+    for num in range(len(moves) + 1):
+        pos_cmd = "position startpos moves " + " ".join(moves[:num])
+        start = time.perf_counter()
+        sfen = get_board_from_pos_cmd(pos_cmd).sfen()
+        elapsed_cache += time.perf_counter() - start
+        start = time.perf_counter()
+        scratch = shogi.Board()
+        for move in moves[:num]:
+            scratch.push_usi(move)
+        elapsed_scratch += time.perf_counter() - start
+        assert sfen == scratch.sfen()
+    print(f"cache {elapsed_cache * 1000:.1f}ms scratch {elapsed_scratch * 1000:.1f}ms")
+
+    cursor = BoardCursor("position startpos")
+    for move in moves[:10]:
+        cursor.push(move)
+    print(cursor.get_pos_cmd(), cursor.sfen())
+    cursor.pop_all()
+    print(cursor.sfen())
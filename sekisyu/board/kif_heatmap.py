@@ -0,0 +1,137 @@
+import argparse
+import glob
+import time
+from typing import Optional, Tuple
+
+import numpy as np
+from sekisyu.board.board_feature import (
+    HAND_MAX,
+    NUM_HAND_PIECE,
+    NUM_PIECE_ID,
+    encode_moves,
+    hand_to_onehot,
+)
+from sekisyu.board.kif_index import load_kif_moves
+
+"""
+棋譜集の駒の配置の頻度表(heatmap)
+
+手数を区切った区間毎に、盤上の駒(28 x 81)と持ち駒(14 x 18)が現れる頻度を棋譜1局あたりで数えておく。
+.npyで保存し、np.loadのmmap_modeで開くので同じマシンで動く複数のエンジンはページを共有する
+"""
+
+
+class KifHeatmap:
+    """
+    手数の区間毎の駒の頻度表
+    """
+
+    def __init__(
+        self, board: np.ndarray, hand: np.ndarray, ply_starts: np.ndarray
+    ) -> None:
+        """
+        Args:
+            board (np.ndarray): shape (区間数, 28, 81)。区間内の局面で駒idの駒がその升にあった回数 / 棋譜数
+            hand (np.ndarray): shape (区間数, 14, 18)。(先後 x 7 + 駒の種類 - 1, 枚数 - 1)の持ち駒があった回数 / 棋譜数
+            ply_starts (np.ndarray): shape (区間数,)。各区間の最初の手数
+        """
+        self.board = board
+        self.hand = hand
+        self.ply_starts = ply_starts
+
+    @classmethod
+    def build(
+        cls, file_glob: str, bucket_size: int = 10, ply_max: int = 200
+    ) -> "KifHeatmap":
+        """
+        globに一致する棋譜を全て読み込んで頻度表を作る。読めない棋譜は飛ばす
+
+        Args:
+            bucket_size (int): 1区間の手数
+            ply_max (int): ply_max手目までの局面を数える
+        """
+        num_bucket = (ply_max + bucket_size - 1) // bucket_size
+        board = np.zeros((num_bucket, NUM_PIECE_ID * 81))
+        hand = np.zeros((num_bucket, 2 * NUM_HAND_PIECE * HAND_MAX))
+        num_games = 0
+        file_list = sorted(glob.glob(file_glob))
+        for i, file_name in enumerate(file_list):
+            try:
+                game_boards, game_hands = encode_moves(
+                    load_kif_moves(file_name), 0, ply_max
+                )
+            except Exception as e:
+                print(f"failed to load {file_name} : {e}")
+                continue
+            num_games += 1
+            # i番目の局面はi + 1手目を指した後の局面
+            bucket_ids = np.arange(len(game_boards)) // bucket_size
+            np.add.at(board, bucket_ids, game_boards)
+            np.add.at(hand, bucket_ids, hand_to_onehot(game_hands))
+            if i % 1000 == 0:
+                print(f"{i} / {len(file_list)} files loaded")
+        if num_games > 0:
+            board /= num_games
+            hand /= num_games
+        return cls(
+            board.reshape(num_bucket, NUM_PIECE_ID, 81).astype(np.float32),
+            hand.reshape(num_bucket, 2 * NUM_HAND_PIECE, HAND_MAX).astype(np.float32),
+            np.arange(num_bucket, dtype=np.int32) * bucket_size + 1,
+        )
+
+    def save(self, prefix: str) -> None:
+        """
+        prefix.board.npy, prefix.hand.npy, prefix.plies.npyに保存する
+        """
+        np.save(f"{prefix}.board.npy", self.board)
+        np.save(f"{prefix}.hand.npy", self.hand)
+        np.save(f"{prefix}.plies.npy", self.ply_starts)
+
+    @classmethod
+    def load(cls, prefix: str, mmap: bool = True) -> "KifHeatmap":
+        """
+        saveしたものを読み込む。mmapならファイルをメモリマップする
+        """
+        mmap_mode = "r" if mmap else None
+        return cls(
+            np.load(f"{prefix}.board.npy", mmap_mode=mmap_mode),
+            np.load(f"{prefix}.hand.npy", mmap_mode=mmap_mode),
+            np.load(f"{prefix}.plies.npy"),
+        )
+
+    def get(self, ply: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        ply手目を指した後の局面が含まれる区間の頻度表。最後の区間より後の手数は最後の区間を使う
+
+        Returns:
+            tuple(np.ndarray, np.ndarray) : shape (28, 81)の盤上の駒、shape (14, 18)の持ち駒の頻度
+        """
+        bucket = max(int(np.searchsorted(self.ply_starts, ply, side="right")) - 1, 0)
+        return self.board[bucket], self.hand[bucket]
+
+
+def load_kif_heatmap(prefix: str) -> Optional[KifHeatmap]:
+    """
+    頻度表を読み込む。prefixが空(USIの<empty>を含む)ならNone
+    """
+    if prefix in ("", "<empty>"):
+        return None
+    return KifHeatmap.load(prefix)
+
+
+if __name__ == "__main__":
+    """
+    sample usage python kif_heatmap.py --kif "kif/black/*" --out kif/black_heatmap --bucket 10
+    """
+    parser = argparse.ArgumentParser(description="build kif heatmap for forcebook")
+    parser.add_argument("--kif", help="glob of kif files")
+    parser.add_argument("--out", help="prefix of output npy files")
+    parser.add_argument("--bucket", type=int, default=10, help="plies per bucket")
+    parser.add_argument("--ply_max", type=int, default=200, help="max ply to count")
+    args = parser.parse_args()
+    start = time.perf_counter()
+    heatmap = KifHeatmap.build(args.kif, args.bucket, args.ply_max)
+    heatmap.save(args.out)
+    print(
+        f"{len(heatmap.ply_starts)} buckets saved in {time.perf_counter() - start:.1f}s"
+    )
@@ -0,0 +1,237 @@
+import argparse
+import glob
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+import shogi
+from sekisyu.board.board_feature import encode_hand, encode_square_pieces
+from shogi import CSA, KIF
+
+"""
+棋譜集の全局面の索引
+
+局面は升毎の駒id(81byte)と持ち駒の枚数(14byte)で持ち、類似度はforcebookと同じく
+同じ升にある同じ駒の重みの和 + 持ち駒の少ない方の枚数 x 重みで計算する。
+メモリ上では局面を手数順に並べ、駒は升毎に連続するように(81, 局面数)で持つ。
+検索では手数の範囲に入る局面だけを、クエリの駒がある升の分だけ比べるので、
+100万局面でも手数の幅が20手程度なら1回の検索は数十ms
+"""
+
+
+def load_kif_moves(file_name: str) -> List[str]:
+    """
+    csa, kifファイルの指し手を読み込む
+    """
+    if file_name.endswith(".kif"):
+        return KIF.Parser.parse_file(file_name)[0]["moves"]
+    return CSA.Parser.parse_file(file_name)[0]["moves"]
+
+
+class KifIndex:
+    """
+    棋譜集の全局面を持ち、与えた局面に最も似た局面を含む棋譜を探す
+    """
+
+    def __init__(
+        self,
+        files: np.ndarray,
+        offsets: np.ndarray,
+        pieces: np.ndarray,
+        hands: np.ndarray,
+        plies: np.ndarray,
+    ) -> None:
+        """
+        Args:
+            files (np.ndarray): shape (棋譜数,)の棋譜ファイル名
+            offsets (np.ndarray): shape (棋譜数 + 1,)。i番目の棋譜の局面はoffsets[i]からoffsets[i + 1] - 1行目
+            pieces (np.ndarray): shape (局面数, 81)のencode_square_piecesの結果
+            hands (np.ndarray): shape (局面数, 14)の持ち駒の枚数
+            plies (np.ndarray): shape (局面数,)の手数
+        """
+        self.files = files
+        self.offsets = offsets
+        # 手数順に並べ替える。同じ手数の中では棋譜の順のまま
+        self.order = np.argsort(plies, kind="stable")
+        self.plies = plies[self.order]
+        # 升毎に連続させておくと、駒のある升だけを比べるときに必要な行だけを読める
+        self.pieces_by_square = np.ascontiguousarray(pieces[self.order].T)
+        self.hands = hands[self.order]
+        game_ids = np.repeat(
+            np.arange(len(files), dtype=np.int32), np.diff(offsets).astype(np.int64)
+        )
+        self.game_ids = game_ids[self.order]
+
+    @classmethod
+    def build(cls, file_glob: str) -> "KifIndex":
+        """
+        globに一致する棋譜を全て読み込んで索引を作る。読めない棋譜は飛ばす
+        """
+        files = []
+        offsets = [0]
+        pieces = []
+        hands = []
+        plies = []
+        file_list = sorted(glob.glob(file_glob))
+        for i, file_name in enumerate(file_list):
+            try:
+                moves = load_kif_moves(file_name)
+                board = shogi.Board()
+                game_pieces = []
+                game_hands = []
+                for mv in moves:
+                    board.push(shogi.Move.from_usi(mv))
+                    game_pieces.append(encode_square_pieces(board))
+                    game_hands.append(encode_hand(board).reshape(-1))
+            except Exception as e:
+                print(f"failed to load {file_name} : {e}")
+                continue
+            if len(game_pieces) == 0:
+                continue
+            files.append(file_name)
+            pieces.extend(game_pieces)
+            hands.extend(game_hands)
+            plies.extend(range(1, len(game_pieces) + 1))
+            offsets.append(offsets[-1] + len(game_pieces))
+            if i % 1000 == 0:
+                print(f"{i} / {len(file_list)} files loaded")
+        return cls(
+            np.array(files),
+            np.array(offsets, dtype=np.int64),
+            np.array(pieces, dtype=np.uint8).reshape(-1, 81),
+            np.array(hands, dtype=np.uint8).reshape(-1, 14),
+            np.array(plies, dtype=np.int16),
+        )
+
+    def save(self, path: str) -> None:
+        """
+        棋譜の順に戻して保存する
+        """
+        inverse = np.empty_like(self.order)
+        inverse[self.order] = np.arange(len(self.order))
+        np.savez(
+            path,
+            files=self.files,
+            offsets=self.offsets,
+            pieces=self.pieces_by_square.T[inverse],
+            hands=self.hands[inverse],
+            plies=self.plies[inverse],
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "KifIndex":
+        data = np.load(path)
+        return cls(
+            data["files"],
+            data["offsets"],
+            data["pieces"],
+            data["hands"],
+            data["plies"],
+        )
+
+    def num_games(self) -> int:
+        return len(self.files)
+
+    def get_ply_range(self, ply_min: int, ply_max: int) -> Tuple[int, int]:
+        """
+        手数がply_min以上ply_max以下の局面の(手数順の)行の範囲
+        """
+        start = int(np.searchsorted(self.plies, ply_min, side="left"))
+        end = int(np.searchsorted(self.plies, ply_max, side="right"))
+        return start, end
+
+    def calc_similarity(
+        self,
+        board: shogi.Board,
+        piece_weight: np.ndarray,
+        hand_weight: np.ndarray,
+        start: int = 0,
+        end: Optional[int] = None,
+    ) -> np.ndarray:
+        """
+        手数順でstart行目からend - 1行目の局面とboardの類似度
+
+        Args:
+            piece_weight (np.ndarray): shape (28,)の駒id毎の重み。相手の駒を無視するなら0にする
+            hand_weight (np.ndarray): shape (2, 7)の持ち駒の重み
+            start (int): 比べる最初の行
+            end (int): 比べる最後の行 + 1。Noneなら最後まで
+
+        Returns:
+            np.ndarray : shape (end - start,)の類似度
+        """
+        if end is None:
+            end = len(self.plies)
+        query = encode_square_pieces(board)
+        output = np.zeros(end - start)
+        # 駒のある升だけを比べる
+        for square in np.nonzero(query)[0]:
+            weight = piece_weight[int(query[square]) - 1]
+            if weight == 0:
+                continue
+            output += (
+                self.pieces_by_square[square, start:end] == query[square]
+            ) * weight
+        hand = encode_hand(board).reshape(-1)
+        output += np.minimum(self.hands[start:end], hand) @ hand_weight.reshape(-1)
+        return output
+
+    def query(
+        self,
+        board: shogi.Board,
+        piece_weight: np.ndarray,
+        hand_weight: np.ndarray,
+        top_k: int = 1,
+        ply_min: int = 0,
+        ply_max: int = 10000,
+    ) -> List[Tuple[str, float]]:
+        """
+        boardに似た局面を含む棋譜を類似度の高い順にtop_k個返す。棋譜の類似度はその中で最も似た局面の類似度
+
+        Args:
+            ply_min (int): この手数以上の局面だけを比べる
+            ply_max (int): この手数以下の局面だけを比べる
+
+        Returns:
+            list(tuple(str, float)) : 棋譜ファイル名と類似度
+        """
+        if self.num_games() == 0:
+            return []
+        start, end = self.get_ply_range(ply_min, ply_max)
+        sims = self.calc_similarity(board, piece_weight, hand_weight, start, end)
+        # 範囲に局面のない棋譜は-inf
+        game_sims = np.full(self.num_games(), -np.inf)
+        np.maximum.at(game_sims, self.game_ids[start:end], sims)
+        top_k = min(top_k, len(game_sims))
+        top_ids = np.argpartition(-game_sims, top_k - 1)[:top_k]
+        top_ids = top_ids[np.argsort(-game_sims[top_ids])]
+        return [
+            (str(self.files[i]), float(game_sims[i]))
+            for i in top_ids
+            if game_sims[i] != -np.inf
+        ]
+
+
+def load_kif_index(path: str) -> Optional[KifIndex]:
+    """
+    索引を読み込む。pathが空(USIの<empty>を含む)ならNone
+    """
+    if path in ("", "<empty>"):
+        return None
+    return KifIndex.load(path)
+
+
+if __name__ == "__main__":
+    """
+    sample usage python kif_index.py --kif "kif/black/*" --out kif/black_index.npz
+    """
+    parser = argparse.ArgumentParser(description="build kif index for forcebook")
+    parser.add_argument("--kif", help="glob of kif files")
+    parser.add_argument("--out", help="output npz file")
+    args = parser.parse_args()
+    start = time.perf_counter()
+    index = KifIndex.build(args.kif)
+    index.save(args.out)
+    print(
+        f"{index.num_games()} games {len(index.plies)} positions indexed in {time.perf_counter() - start:.1f}s"
+    )
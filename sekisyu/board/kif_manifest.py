@@ -0,0 +1,293 @@
+import dataclasses
+import fnmatch
+import glob
+import json
+import os
+import threading
+from typing import Dict, List, Optional, Union
+
+from dacite import from_dict
+from shogi import CSA, KIF
+
+"""
+棋譜集のファイル一覧と棋譜の情報のキャッシュ
+
+ファイル一覧だけを使う場合(parse_header=False)は、ディレクトリのmtimeが変わっていなければ
+ファイル一覧をそのまま使い、変わっていればそのディレクトリだけを読み直す。
+棋譜の情報も使う場合は、上書きされた棋譜でディレクトリのmtimeは変わらないので毎回scandirで
+ファイルのmtime, sizeを確かめ、変わったものだけ読み直す。
+cache_pathを指定すればjsonに保存して次回の起動でも使う
+"""
+
+
+@dataclasses.dataclass
+class KifManifestEntry:
+    """
+    1つの棋譜ファイルの情報
+
+    players (list(str)): 対局者の名前(先手、後手)
+    date (str): 対局日
+    event (str): 棋戦
+    result (str): 勝った側。先手なら"b"、後手なら"w"、それ以外は"-"
+    ply (int): 手数
+    parsed (bool): 棋譜を読んで上の情報を書いたか(読めなかった場合もTrue)
+    """
+
+    path: str
+    mtime: float
+    size: int
+    players: List[str] = dataclasses.field(default_factory=lambda: ["", ""])
+    date: str = ""
+    event: str = ""
+    result: str = "-"
+    ply: int = 0
+    parsed: bool = False
+
+
+@dataclasses.dataclass
+class KifManifestDir:
+    """
+    ディレクトリのmtimeと、その中のパターンに一致するファイル
+    """
+
+    mtime: float
+    files: List[str] = dataclasses.field(default_factory=list)
+
+
+def read_kif_text(path: str) -> str:
+    for enc in ["utf-8-sig", "cp932"]:
+        try:
+            with open(path, encoding=enc) as f:
+                return f.read()
+        except UnicodeDecodeError:
+            pass
+    with open(path, encoding="utf-8", errors="replace") as f:
+        return f.read()
+
+
+def read_header_value(text: str, keys: List[str]) -> str:
+    """
+    keysのいずれかで始まる最初の行の残りを返す
+    """
+    for line in text.splitlines():
+        for key in keys:
+            if line.startswith(key):
+                return line[len(key) :].strip()
+    return ""
+
+
+def parse_kif_entry(entry: KifManifestEntry) -> None:
+    """
+    csa, kif, jsonファイルを読んでentryに棋譜の情報を書く。読めない場合は空のまま
+    """
+    entry.parsed = True
+    try:
+        if entry.path.endswith(".json"):
+            # sekisyuのplayoutのjson
+            from sekisyu.playout.playout import GameResult
+
+            with open(entry.path) as f:
+                dat = json.load(f)
+            entry.players = [str(name) for name in dat.get("player_name", ["", ""])]
+            entry.date = str(dat.get("timestamp", ""))
+            result = GameResult(int(dat.get("result", GameResult.INIT)))
+            entry.result = (
+                "b" if result.is_black_win() else "w" if result.is_white_win() else "-"
+            )
+            entry.ply = len(dat.get("plys", []))
+            return
+        text = read_kif_text(entry.path)
+        if entry.path.endswith(".kif"):
+            dat = KIF.Parser.parse_str(text)[0]
+            entry.date = read_header_value(text, ["開始日時：", "対局日："])
+            entry.event = read_header_value(text, ["棋戦："])
+        else:
+            dat = CSA.Parser.parse_str(text)[0]
+            entry.date = read_header_value(text, ["$START_TIME:"])
+            entry.event = read_header_value(text, ["$EVENT:"])
+        entry.players = [name or "" for name in dat["names"]]
+        entry.result = dat["win"]
+        entry.ply = len(dat["moves"])
+    except Exception as e:
+        print(f"failed to parse {entry.path} : {e}")
+
+
+class KifManifest:
+    """
+    globのパターンに一致する棋譜ファイルの一覧と棋譜の情報
+    """
+
+    def __init__(
+        self,
+        patterns: Union[str, List[str]],
+        cache_path: Optional[str] = None,
+        parse_header: bool = True,
+    ) -> None:
+        """
+        Args:
+            patterns (str or list(str)): 棋譜ファイルのglobのパターン。ex "kif/black/*.csa"
+            cache_path (str): 保存先のjson。Noneなら保存しない
+            parse_header (bool): Falseならファイル一覧だけを持ち、棋譜は読まない
+        """
+        self.patterns = [patterns] if isinstance(patterns, str) else list(patterns)
+        self.cache_path = cache_path
+        self.parse_header = parse_header
+        # (ディレクトリ, ファイル名のパターン) -> ディレクトリの情報
+        self.dirs: Dict[str, KifManifestDir] = {}
+        # ファイルのパス -> 棋譜の情報
+        self.entries: Dict[str, KifManifestEntry] = {}
+        self.file_list: List[str] = []
+        # パターン -> 一致するファイル
+        self.pattern_files: Dict[str, List[str]] = {}
+        # 保存していない変更があればTrue
+        self.dirty = False
+        self.lock = threading.Lock()
+        self.load()
+        self.refresh()
+
+    def load(self) -> None:
+        if self.cache_path is None or not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path) as f:
+                dat = json.load(f)
+        except json.decoder.JSONDecodeError:
+            print(f"bad manifest file {self.cache_path}")
+            return
+        self.dirs = {
+            key: from_dict(data_class=KifManifestDir, data=value)
+            for key, value in dat["dirs"].items()
+        }
+        self.entries = {
+            key: from_dict(data_class=KifManifestEntry, data=value)
+            for key, value in dat["entries"].items()
+        }
+
+    def save(self) -> None:
+        if self.cache_path is None:
+            return
+        dat = {
+            "dirs": {
+                key: dataclasses.asdict(value) for key, value in self.dirs.items()
+            },
+            "entries": {
+                key: dataclasses.asdict(value) for key, value in self.entries.items()
+            },
+        }
+        tmp_path = self.cache_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(dat, f, ensure_ascii=False)
+        os.replace(tmp_path, self.cache_path)
+
+    def scan_dir(self, dir_name: str, name_pattern: str, full: bool) -> List[str]:
+        """
+        ディレクトリ内のパターンに一致するファイルを返す。
+        parse_header=Falseでディレクトリのmtimeが前回と同じならキャッシュを使う。
+        それ以外はscandirでファイルのmtime, sizeを確かめ、変わった棋譜だけ読み直す
+        """
+        key = f"{dir_name}\t{name_pattern}"
+        try:
+            dir_mtime = os.stat(dir_name or ".").st_mtime
+        except OSError:
+            if self.dirs.pop(key, None) is not None:
+                self.dirty = True
+            return []
+        cached = self.dirs.get(key)
+        dir_changed = cached is None or cached.mtime != dir_mtime
+        # 上書きされたファイルではディレクトリのmtimeは変わらないので、棋譜の情報を使う場合は省略しない
+        if not dir_changed and not full and not self.parse_header:
+            return cached.files  # type:ignore
+
+        files = []
+        with os.scandir(dir_name or ".") as it:
+            for dir_entry in it:
+                # globと同じく隠しファイルは明示しない限り含めない
+                if dir_entry.name.startswith(".") and not name_pattern.startswith("."):
+                    continue
+                if not fnmatch.fnmatchcase(dir_entry.name, name_pattern):
+                    continue
+                path = os.path.join(dir_name, dir_entry.name)
+                stat = dir_entry.stat()
+                files.append(path)
+                entry = self.entries.get(path)
+                if (
+                    entry is not None
+                    and entry.mtime == stat.st_mtime
+                    and entry.size == stat.st_size
+                ):
+                    continue
+                self.entries[path] = KifManifestEntry(path, stat.st_mtime, stat.st_size)
+                self.dirty = True
+        files.sort()
+        if dir_changed or cached.files != files:  # type:ignore
+            self.dirs[key] = KifManifestDir(dir_mtime, files)
+            self.dirty = True
+        return files
+
+    def refresh(self, full: bool = False) -> List[str]:
+        """
+        ファイル一覧を更新する。変化のないディレクトリはstatを1回呼ぶだけ
+
+        Args:
+            full (bool): Trueならディレクトリのmtimeに関わらず全てのファイルのmtime, sizeを確かめる
+
+        Returns:
+            list(str) : パターンに一致するファイルの一覧
+        """
+        with self.lock:
+            file_list = []
+            for pattern in self.patterns:
+                pattern_files = []
+                dir_pattern, name_pattern = os.path.split(pattern)
+                if glob.has_magic(dir_pattern):
+                    dir_names = sorted(
+                        d for d in glob.glob(dir_pattern) if os.path.isdir(d)
+                    )
+                else:
+                    dir_names = [dir_pattern]
+                for dir_name in dir_names:
+                    pattern_files.extend(self.scan_dir(dir_name, name_pattern, full))
+                self.pattern_files[pattern] = pattern_files
+                file_list.extend(pattern_files)
+            for path in file_list:
+                # 別のパターンと共有したキャッシュなどで情報が欠けていたら作り直す
+                if path not in self.entries:
+                    stat = os.stat(path)
+                    self.entries[path] = KifManifestEntry(
+                        path, stat.st_mtime, stat.st_size
+                    )
+                    self.dirty = True
+                # 新しいファイルと、parse_header=Falseで作ったキャッシュのファイルの棋譜を読む
+                if self.parse_header and not self.entries[path].parsed:
+                    parse_kif_entry(self.entries[path])
+                    self.dirty = True
+            # 消えたファイルの情報は捨てる
+            alive = set(file_list)
+            if self.dirty:
+                self.entries = {
+                    path: entry for path, entry in self.entries.items() if path in alive
+                }
+                self.save()
+                self.dirty = False
+            self.file_list = file_list
+            return file_list
+
+    def files(self, pattern: Optional[str] = None) -> List[str]:
+        """
+        refreshした時点のファイル一覧。patternを指定するとそのパターンに一致するものだけ
+        """
+        if pattern is not None:
+            return self.pattern_files[pattern]
+        return self.file_list
+
+    def get_entries(self) -> List[KifManifestEntry]:
+        return [self.entries[path] for path in self.file_list]
+
+
+def list_kif_files(
+    patterns: Union[str, List[str]], cache_path: Optional[str] = None
+) -> List[str]:
+    """
+    glob.globの代わり。cache_pathを指定すると前回の一覧から変わったディレクトリだけを読み直す
+    """
+    return KifManifest(patterns, cache_path, parse_header=False).files()
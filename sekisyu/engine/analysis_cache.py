@@ -0,0 +1,237 @@
+import dataclasses
+import json
+import sqlite3
+import threading
+from typing import List, Optional, Tuple
+
+from dacite import Config, from_dict
+from sekisyu.board.get_board_from_pos_cmd import get_board_from_pos_cmd, split_pos_cmd
+from sekisyu.playout.playinfo import BasePlayInfoPack
+from sekisyu.playout.usi_value import UsiEvalValue
+
+"""
+局面解析結果のディスクキャッシュ
+
+(正規化したsfen, 直近の指し手, goコマンド, エンジン名とオプション)をキーにBasePlayInfoPackをsqliteに保存する。
+定跡付近の局面や、接待エンジンが直前の局面を読み直す場合など同じ解析を何度も行うのを避ける
+
+同じsfenでも千日手や連続王手の千日手が絡むと最善手が変わるので、キーには最後に駒を取った手より後の
+直近history_plies手の指し手も含める。駒を取ると取られた側の駒が減るので、取り返さない限りそれより前の局面は
+現れない(取り返して元に戻る場合は考えない)。history_plies=0なら手順に関わらず同じ局面は同じキーになる
+"""
+
+# キーに含める直近の指し手の数の既定値
+DEFAULT_HISTORY_PLIES = 16
+
+
+def normalize_position(pos_cmd: str) -> str:
+    """
+    positionコマンドを手数を除いたsfenに変換する。
+    同じ局面に別の手順で到達した場合も同じキーになる
+
+    Args:
+        pos_cmd (str): "position startpos moves ..."などのpositionコマンド
+
+    Returns:
+        str : 手数を除いたsfen
+    """
+    sfen = get_board_from_pos_cmd(pos_cmd).sfen()
+    return sfen.rsplit(" ", 1)[0]
+
+
+def get_repetition_history(pos_cmd: str, history_plies: int) -> List[str]:
+    """
+    千日手の判定に関わりうる直近の指し手。
+    最後に駒を取った手より後の指し手のうち、最大でhistory_plies手
+
+    Args:
+        pos_cmd (str): positionコマンド
+        history_plies (int): 最大の手数
+
+    Returns:
+        list(str) : 指し手。古い順
+    """
+    _, moves = split_pos_cmd(pos_cmd)
+    if history_plies <= 0 or len(moves) == 0:
+        return []
+    captured = list(get_board_from_pos_cmd(pos_cmd).captured_piece_stack)
+    output: List[str] = []
+    for i in range(len(moves) - 1, max(len(moves) - history_plies, 0) - 1, -1):
+        # 駒を取った手より前の局面には戻れない
+        if len(captured) == len(moves) and captured[i] != 0:
+            break
+        output.append(moves[i])
+    output.reverse()
+    return output
+
+
+def make_cache_key(
+    pos_cmd: str,
+    go_cmd: str,
+    engine_name: str,
+    options: List[Tuple[str, str]],
+    history_plies: int = DEFAULT_HISTORY_PLIES,
+) -> str:
+    """
+    キャッシュのキーを作る
+
+    Args:
+        pos_cmd (str): positionコマンド
+        go_cmd (str): goコマンド
+        engine_name (str): エンジン名
+        options (list((str, str))): エンジンのオプション
+        history_plies (int): キーに含める直近の指し手の最大数。0なら局面だけで決める
+
+    Returns:
+        str : キー
+    """
+    return json.dumps(
+        [
+            normalize_position(pos_cmd),
+            get_repetition_history(pos_cmd, history_plies),
+            " ".join(go_cmd.split()),
+            engine_name,
+            sorted([str(name), str(value)] for name, value in options),
+        ],
+        ensure_ascii=False,
+    )
+
+
+class AnalysisCache:
+    """
+    sqliteを使った解析結果のLRUキャッシュ
+
+    hits (int):
+        キャッシュにあった回数
+
+    misses (int):
+        キャッシュになかった回数
+    """
+
+    def __init__(self, path: str, max_entries: int = 100000) -> None:
+        """
+        Args:
+            path (str): sqliteのファイル。":memory:"ならメモリ上に置く
+            max_entries (int): 保存する最大件数。超えたら最後に使われたのが古いものから消す
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS analysis ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, last_used INTEGER NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS analysis_last_used ON analysis(last_used)"
+        )
+        self.conn.commit()
+        # last_usedに使う通し番号
+        row = self.conn.execute(
+            "SELECT COALESCE(MAX(last_used), 0), COUNT(*) FROM analysis"
+        ).fetchone()
+        self.clock: int = row[0]
+        self.num_entries: int = row[1]
+        self.hits = 0
+        self.misses = 0
+
+    def tick(self) -> int:
+        self.clock += 1
+        return self.clock
+
+    def get(self, key: str) -> Optional[BasePlayInfoPack]:
+        """
+        キャッシュから解析結果を取り出す
+
+        Returns:
+            BasePlayInfoPack : 解析結果。キャッシュになければNone
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value FROM analysis WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.conn.execute(
+                "UPDATE analysis SET last_used = ? WHERE key = ?", (self.tick(), key)
+            )
+            self.conn.commit()
+        return from_dict(
+            data_class=BasePlayInfoPack,
+            data=json.loads(row[0]),
+            config=Config(cast=[UsiEvalValue]),
+        )
+
+    def put(self, key: str, think_result: BasePlayInfoPack) -> None:
+        """
+        解析結果をキャッシュに保存する
+        """
+        value = json.dumps(dataclasses.asdict(think_result), ensure_ascii=False)
+        with self.lock:
+            exists = self.conn.execute(
+                "SELECT 1 FROM analysis WHERE key = ?", (key,)
+            ).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO analysis (key, value, last_used) VALUES (?, ?, ?)",
+                (key, value, self.tick()),
+            )
+            if exists is None:
+                self.num_entries += 1
+            if self.num_entries > self.max_entries:
+                self.conn.execute(
+                    "DELETE FROM analysis WHERE key IN "
+                    "(SELECT key FROM analysis ORDER BY last_used LIMIT ?)",
+                    (self.num_entries - self.max_entries,),
+                )
+                self.num_entries = self.max_entries
+            self.conn.commit()
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def to_str(self) -> str:
+        return (
+            f"hits={self.hits} misses={self.misses} "
+            f"hit_rate={self.hit_rate():.3f} entries={self.num_entries}"
+        )
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+
+if __name__ == "__main__":
+    cache = AnalysisCache(":memory:", max_entries=2)
+    pack = BasePlayInfoPack(bestmove="7g7f")
+    key_a = make_cache_key(
+        "position startpos moves 7g7f 3c3d",
+        "go nodes 1000",
+        "yane",
+        [("Threads", "4")],
+        history_plies=0,
+    )
+    key_b = make_cache_key(
+        "position sfen lnsgkgsnl/1r5b1/pppppp1pp/6p2/9/2P6/PP1PPPPPP/1B5R1/LNSGKGSNL b - 3",
+        "go  nodes 1000",
+        "yane",
+        [("Threads", "4")],
+        history_plies=0,
+    )
+    # history_plies=0なら手順と手数が違っても同じ局面なら同じキー
+    print(key_a == key_b)
+    # 既定では直近の指し手が違えば別のキー
+    print(
+        make_cache_key("position startpos moves 7g7f 3c3d", "go nodes 1000", "yane", [])
+        == make_cache_key(
+            "position startpos moves 7g7f 4a3b 3c3d 3b4a", "go nodes 1000", "yane", []
+        )
+    )
+    cache.put(key_a, pack)
+    print(cache.get(key_b))
+    cache.put("b", pack)
+    cache.put("c", pack)
+    # 最後に使ってからもっとも古いkey_aが消える
+    print(cache.get(key_a), cache.to_str())
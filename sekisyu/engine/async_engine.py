@@ -0,0 +1,508 @@
+import asyncio
+import os
+import shlex
+import sys
+import threading
+from typing import Any, Coroutine, List, Optional, Tuple
+
+from sekisyu.engine.base_engine import BaseEngine, UsiEngineState
+from sekisyu.engine.latency import LatencyRecorder
+from sekisyu.engine.yaneuraou_engine import YaneuraOuEngine
+from sekisyu.playout.playinfo import BasePlayInfo, BasePlayInfoPack, parse_info_line
+
+"""
+asyncioベースのUSIエンジン
+
+BaseEngineはエンジン毎に読み書き2本のスレッドを立てるが、
+こちらは1本のイベントループで全てのエンジンのパイプを捌く
+"""
+
+
+class AsyncUsiEngine:
+    """
+    asyncio.create_subprocess_execで起動するUSIエンジン
+
+    boot(), isready(), position(), go()はawait可能で、go()はBasePlayInfoPackを返す。
+    コマンドの送信順序とエンジンの状態による送信待ちはBaseEngine.write_workerと同じ規則に従う
+    """
+
+    def __init__(self, engine_name: str = "") -> None:
+        self.engine_name = engine_name
+        self.engine_path: str = ""
+        self.engine_fullpath: str = ""
+        self.engine_state: Optional[UsiEngineState] = None
+        self.exit_state: Optional[str] = None
+        self.options: List[Tuple[str, str]] = []
+        # infoから始まる文字列を標準出力する(gui用のdirty hack)
+        self.print_info = False
+        self.think_result: BasePlayInfoPack = BasePlayInfoPack()
+        # 最後に送ったpositionコマンド(position()メソッドと名前が被るので別名にする)
+        self.current_position = ""
+        self.dead = False
+        self.usi_options: List[str] = []
+        # コマンド毎の応答時間の計測
+        self.latency = LatencyRecorder()
+
+        # private
+        self.proc: Optional[asyncio.subprocess.Process] = None
+        self.read_task: Optional["asyncio.Task[None]"] = None
+        self.write_task: Optional["asyncio.Task[None]"] = None
+        # asyncioのオブジェクトはループ上で生成する必要があるのでboot()で作る
+        self.send_queue: Optional["asyncio.Queue[str]"] = None
+        self.state_changed: Optional[asyncio.Condition] = None
+        # 応答待ちのfuture
+        self.readyok_future: Optional["asyncio.Future[None]"] = None
+        self.bestmove_future: Optional["asyncio.Future[BasePlayInfoPack]"] = None
+        self.oneline_future: Optional["asyncio.Future[str]"] = None
+        self.usiok_future: Optional["asyncio.Future[List[str]]"] = None
+
+    def get_name(self) -> str:
+        """
+        エンジン名を取得する
+
+        Returns:
+            str: エンジン名
+        """
+        if self.engine_name == "":
+            return self.engine_path
+        return self.engine_name
+
+    def set_option(self, options: List[Tuple[str, str]]) -> None:
+        """
+        boot時にエンジンに送るオプションを設定する
+
+        options list((str, str)):
+            setoption name options[i][0] value options[i][1]
+        """
+        self.options = options
+
+    def is_connected(self) -> bool:
+        return self.proc is not None
+
+    async def boot(self, engine_path: str) -> None:
+        """
+        エンジンを起動し、オプションを送ってreadyokが返るまで待つ
+
+        engine_path (str):
+            起動するエンジンのパス。"ssh host path"のような引数付きの文字列も可
+        """
+        await self.quit()
+        self.engine_state = None
+        self.exit_state = None
+        self.dead = False
+        self.engine_path = engine_path
+        self.send_queue = asyncio.Queue()
+        self.state_changed = asyncio.Condition()
+        await self.change_state(UsiEngineState.WaitConnecting)
+
+        # このフィルタリングは本当は危うい(BaseEngine.bootと同じ)
+        cwd: Optional[str] = None
+        if "ssh " not in self.engine_path:
+            self.engine_fullpath = os.path.join(os.getcwd(), self.engine_path)
+            if not os.path.exists(self.engine_fullpath):
+                await self.change_state(UsiEngineState.Disconnected)
+                self.exit_state = "Connection Error"
+                raise FileNotFoundError(self.engine_fullpath + " not found.")
+            cwd = os.path.dirname(self.engine_fullpath)
+        else:
+            self.engine_fullpath = self.engine_path
+
+        self.proc = await asyncio.create_subprocess_exec(
+            *shlex.split(self.engine_fullpath, posix=os.name != "nt"),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+            cwd=cwd,
+        )
+        await self.change_state(UsiEngineState.Connected)
+
+        self.read_task = asyncio.ensure_future(self.read_worker())
+        self.write_task = asyncio.ensure_future(self.write_worker())
+
+        for option in self.options:
+            self.send_command(f"setoption name {option[0]} value {option[1]}")
+        await self.isready()
+
+    async def quit(self) -> None:
+        """
+        エンジンにquitを送り、終了を待つ
+        """
+        if self.proc is None:
+            return
+        if self.proc.returncode is None and not self.dead:
+            self.send_command("quit")
+        if self.write_task is not None:
+            await self.write_task
+            self.write_task = None
+        if self.read_task is not None:
+            await self.read_task
+            self.read_task = None
+        if self.proc.returncode is None:
+            self.proc.terminate()
+            await self.proc.wait()
+        self.proc = None
+        await self.change_state(UsiEngineState.Disconnected)
+
+    def send_command(self, cmd: str) -> None:
+        """
+        エンジンにコマンドを送る。実際の送信はwrite_workerが状態を見ながら行う
+        """
+        assert self.send_queue is not None
+        self.send_queue.put_nowait(cmd)
+
+    async def isready(self) -> None:
+        """
+        isreadyを送り、readyokを待つ
+        """
+        loop = asyncio.get_running_loop()
+        self.readyok_future = loop.create_future()
+        await self.change_state(UsiEngineState.WaitReadyOk)
+        self.send_command("isready")
+        await self.readyok_future
+
+    async def position(self, pos_cmd: str) -> None:
+        """
+        局面を設定する
+
+        pos_cmd (str):
+            "position startpos moves ..."の形式。"position"は省略してもよい
+        """
+        if not pos_cmd.startswith("position"):
+            pos_cmd = "position " + pos_cmd
+        self.send_command(pos_cmd)
+
+    async def go(self, go_cmd: str) -> BasePlayInfoPack:
+        """
+        goコマンドを送り、bestmoveが返ってくるまで待つ
+
+        go_cmd (str):
+            送られるgoコマンド。ex "go byoyomi 1000"
+        """
+        loop = asyncio.get_running_loop()
+        future: "asyncio.Future[BasePlayInfoPack]" = loop.create_future()
+        self.bestmove_future = future
+        self.send_command(go_cmd)
+        return await future
+
+    async def stop(self) -> None:
+        """
+        探索を止める。bestmoveはgo()の呼び出し側に返る
+        """
+        self.send_command("stop")
+
+    async def get_usi_option(self) -> List[str]:
+        """
+        usiコマンドで出力するべきオプションを列挙する
+
+        return:
+            list(str) : 標準出力されるべきstrのリスト
+        """
+        await self.wait_for_state(UsiEngineState.WaitCommand)
+        loop = asyncio.get_running_loop()
+        self.usiok_future = loop.create_future()
+        self.usi_options = []
+        await self.change_state(UsiEngineState.PrintUSI)
+        self.send_command("usi")
+        return await self.usiok_future
+
+    async def send_command_and_getline(self, command: str) -> str:
+        """
+        エンジンに対して1行送って、すぐに返ってくる1行を返す
+        """
+        await self.wait_for_state(UsiEngineState.WaitCommand)
+        loop = asyncio.get_running_loop()
+        self.oneline_future = loop.create_future()
+        self.send_command(command)
+        return await self.oneline_future
+
+    async def change_state(self, state: UsiEngineState) -> None:
+        # 切断されたあとでは変更できない
+        if self.engine_state == UsiEngineState.Disconnected:
+            return
+        if state == UsiEngineState.WaitBestmove:
+            if self.engine_state != UsiEngineState.WaitCommand:
+                raise ValueError(
+                    "can't send go command when engine_state != WaitCommand"
+                )
+        if self.state_changed is None:
+            self.engine_state = state
+            return
+        async with self.state_changed:
+            self.engine_state = state
+            self.state_changed.notify_all()
+
+    async def wait_for_state(self, state: UsiEngineState) -> None:
+        assert self.state_changed is not None
+        async with self.state_changed:
+            while True:
+                if self.dead or self.engine_state == state:
+                    return
+                if self.engine_state == UsiEngineState.Disconnected:
+                    raise ValueError("engine_state == UsiEngineState.Disconnected.")
+                await self.state_changed.wait()
+
+    # エンジンとやりとりを行うタスク(write方向)
+    async def write_worker(self) -> None:
+        assert self.proc is not None and self.proc.stdin is not None
+        assert self.send_queue is not None
+        while True:
+            message = await self.send_queue.get()
+            messages = message.split()
+            token = messages[0] if len(messages) else ""
+            # stopコマンドではあるが、goコマンドを送信していないなら送信しない。
+            if token == "stop":
+                if self.engine_state != UsiEngineState.WaitBestmove:
+                    continue
+                self.latency.start("stop_bestmove")
+            elif token == "go":
+                await self.wait_for_state(UsiEngineState.WaitCommand)
+                self.think_result = BasePlayInfoPack()
+                self.latency.start("go_first_info")
+                self.latency.start("go_bestmove")
+                self.latency.cancel("stop_bestmove")
+                await self.change_state(UsiEngineState.WaitBestmove)
+            elif token == "isready":
+                self.latency.start("isready")
+            elif token == "position":
+                self.current_position = message
+                await self.wait_for_state(UsiEngineState.WaitCommand)
+            elif token == "moves" or token == "side":
+                await self.wait_for_state(UsiEngineState.WaitCommand)
+                await self.change_state(UsiEngineState.WaitOneLine)
+            elif token == "usinewgame" or token == "gameover":
+                await self.wait_for_state(UsiEngineState.WaitCommand)
+
+            try:
+                self.proc.stdin.write((message + "\n").encode("shift-jis"))
+                await self.proc.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                self.dead = True
+                break
+
+            if token == "quit":
+                await self.change_state(UsiEngineState.Disconnected)
+                break
+
+    # エンジンとのやりとりを行うタスク(read方向)
+    async def read_worker(self) -> None:
+        assert self.proc is not None and self.proc.stdout is not None
+        while True:
+            line = await self.proc.stdout.readline()
+            if not line:
+                # プロセスの終了
+                self.exit_state = "0"
+                break
+            await self.dispatch_message(
+                line.decode("shift-jis", errors="ignore").strip()
+            )
+
+        # 待っている側を起こす
+        if self.engine_state != UsiEngineState.Disconnected:
+            self.dead = True
+        for future in [
+            self.readyok_future,
+            self.bestmove_future,
+            self.oneline_future,
+            self.usiok_future,
+        ]:
+            if future is not None and not future.done():
+                future.set_exception(ValueError("engine process terminated."))
+        if self.state_changed is not None:
+            async with self.state_changed:
+                self.state_changed.notify_all()
+
+    # エンジン側から送られてきたメッセージを解釈する。
+    async def dispatch_message(self, message: str) -> None:
+        index = message.find(" ")
+        token = message if index == -1 else message[0:index]
+
+        if self.engine_state == UsiEngineState.WaitOneLine:
+            if self.oneline_future is not None and not self.oneline_future.done():
+                self.oneline_future.set_result(message)
+            await self.change_state(UsiEngineState.WaitCommand)
+        elif token == "readyok":
+            self.latency.stop("isready")
+            await self.change_state(UsiEngineState.WaitCommand)
+            if self.readyok_future is not None and not self.readyok_future.done():
+                self.readyok_future.set_result(None)
+        elif token == "bestmove":
+            self.latency.stop("go_bestmove")
+            self.latency.stop("stop_bestmove")
+            with self.latency.measure("bestmove_dispatch"):
+                self.handle_bestmove(message)
+                await self.change_state(UsiEngineState.WaitCommand)
+                if self.bestmove_future is not None and not self.bestmove_future.done():
+                    self.bestmove_future.set_result(self.think_result)
+        elif token == "info":
+            if self.print_info:
+                print(message, flush=True)
+            self.handle_info(message)
+        elif self.engine_state == UsiEngineState.PrintUSI:
+            if token == "usiok":
+                await self.change_state(UsiEngineState.WaitCommand)
+                if self.usiok_future is not None and not self.usiok_future.done():
+                    self.usiok_future.set_result(self.usi_options)
+            elif not token.startswith("id"):
+                self.usi_options.append(message)
+
+    # エンジンから送られてきた"bestmove"を処理する。
+    def handle_bestmove(self, message: str) -> None:
+        messages = message.split()
+        if len(messages) >= 4 and messages[2] == "ponder":
+            self.think_result.ponder = messages[3]
+        if len(messages) >= 2:
+            self.think_result.bestmove = messages[1]
+        else:
+            self.think_result.bestmove = "none"
+
+    # エンジンから送られてきた"info ..."を処理する。
+    def handle_info(self, message: str) -> None:
+        self.latency.stop("go_first_info")
+        info: Optional[BasePlayInfo] = parse_info_line(message)
+        if info is None:
+            return
+        if len(self.think_result.infos) < info.multipv:
+            self.think_result.infos.append(None)  # type:ignore
+        self.think_result.infos[info.multipv - 1] = info
+
+
+# 全てのAsyncEngineAdapterで共有するイベントループ
+event_loop: Optional[asyncio.AbstractEventLoop] = None
+event_loop_lock = threading.Lock()
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    アダプタ用のイベントループを返す。初回呼び出し時にループ用のスレッドを1本だけ立てる
+    """
+    global event_loop
+    with event_loop_lock:
+        if event_loop is None:
+            event_loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=event_loop.run_forever, daemon=True)
+            thread.start()
+        return event_loop
+
+
+class AsyncEngineAdapter(BaseEngine):
+    """
+    AsyncUsiEngineをBaseEngineと同じ同期APIで使うためのアダプタ
+
+    仮想エンジンやBattleServerからは通常のBaseEngineとして扱える。
+    内部の通信は全アダプタ共通のイベントループ1本で行うので、エンジン毎のスレッドが不要になる
+    """
+
+    def __init__(self, engine_name: str = "") -> None:
+        self.async_engine = AsyncUsiEngine(engine_name)
+        super().__init__(engine_name)
+        self.latency = self.async_engine.latency
+
+    @property  # type:ignore
+    def print_info(self) -> bool:  # type:ignore
+        return self.async_engine.print_info
+
+    @print_info.setter
+    def print_info(self, print_info: bool) -> None:
+        self.async_engine.print_info = print_info
+
+    @property  # type:ignore
+    def dead(self) -> bool:  # type:ignore
+        return self.async_engine.dead
+
+    @dead.setter
+    def dead(self, dead: bool) -> None:
+        self.async_engine.dead = dead
+
+    def run(self, coro: Coroutine[Any, Any, Any]) -> Any:
+        """
+        コルーチンをイベントループ上で実行し、結果を待つ
+        """
+        return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result()
+
+    def boot(self, engine_path: str) -> None:
+        self.engine_path = engine_path
+        self.async_engine.set_option(self.options)
+        self.run(self.async_engine.boot(engine_path))
+        self.proc = None
+
+    def quit(self) -> None:
+        if self.async_engine.is_connected():
+            self.run(self.async_engine.quit())
+
+    def is_connected(self) -> bool:
+        return self.async_engine.is_connected()
+
+    def get_state(self) -> Optional[UsiEngineState]:
+        return self.async_engine.engine_state
+
+    def get_current_think_result(self) -> BasePlayInfoPack:
+        return self.async_engine.think_result
+
+    def get_usi_option(self) -> List[str]:
+        return self.run(self.async_engine.get_usi_option())  # type:ignore
+
+    def send_isready_and_wait(self) -> None:
+        self.run(self.async_engine.isready())
+
+    def send_go_and_wait(self, go_cmd: str) -> BasePlayInfoPack:
+        self.think_result = self.run(self.async_engine.go(go_cmd))
+        return self.think_result
+
+    def send_command(self, cmd: str) -> None:
+        token = cmd.split(" ")[0]
+        if token == "position":
+            self.position = cmd
+        elif token == "usinewgame" or token == "gameover":
+            self.reflesh_game()
+        get_event_loop().call_soon_threadsafe(self.async_engine.send_command, cmd)
+
+    def send_command_and_getline(self, command: str) -> str:
+        return self.run(  # type:ignore
+            self.async_engine.send_command_and_getline(command)
+        )
+
+    def wait_for_state(self, state: UsiEngineState) -> None:
+        self.run(self.async_engine.wait_for_state(state))
+
+    def wait_for_bestmove(self) -> None:
+        # AsyncUsiEngineはgoを送りなおさないので、コマンド待ちに戻ればbestmoveが返っている
+        self.wait_for_state(UsiEngineState.WaitCommand)
+
+    # デストラクタで通信の切断を行う。
+    def __del__(self) -> None:
+        async_engine = getattr(self, "async_engine", None)
+        loop = event_loop
+        # インタプリタの終了中はループのスレッドが止まっていて待てない
+        if (
+            async_engine is None
+            or not async_engine.is_connected()
+            or loop is None
+            or loop.is_closed()
+            or sys.is_finalizing()
+        ):
+            return
+        try:
+            if loop.is_running() and self.in_event_loop(loop):
+                # ループのスレッド上でGCが走った場合、quit()の完了を待つとデッドロックするので積むだけにする
+                loop.create_task(async_engine.quit())
+            else:
+                asyncio.run_coroutine_threadsafe(async_engine.quit(), loop).result(
+                    timeout=10.0
+                )
+        except Exception as e:
+            print(f"info string failed to quit {self.get_name()} {e}")
+
+    @staticmethod
+    def in_event_loop(loop: asyncio.AbstractEventLoop) -> bool:
+        try:
+            return asyncio.get_running_loop() is loop
+        except RuntimeError:
+            return False
+
+
+class AsyncYaneuraOuEngine(AsyncEngineAdapter, YaneuraOuEngine):
+    """
+    やねうら王をasyncioで動かすクラス。movesやsideなどの拡張コマンドもそのまま使える
+    """
+
+    pass
@@ -1,15 +1,18 @@
 import os
 import subprocess
 import threading
-import time
+from concurrent.futures import Future
 from enum import Enum, IntEnum
-from queue import Queue
-from typing import List, Optional, Tuple
+from queue import Empty, Queue
+from typing import List, Optional, Tuple, Union
 
+from sekisyu.engine.latency import LatencyRecorder
+from sekisyu.engine.usi_reactor import get_reactor
 from sekisyu.playout.playinfo import (
     BasePlayInfo,
     BasePlayInfoPack,
-    generate_playinfo_from_info,
+    get_multipv_from_info,
+    parse_info_line,
 )
 
 """
@@ -55,6 +58,10 @@ class BaseEngine:
     # ↑の変数を変更するときのlock object
     static_lock_object = threading.Lock()
 
+    # 全エンジンの通信を1本のselectorスレッド(UsiReactor)で行う。
+    # windowsのパイプはselectに対応していないので従来通りエンジン毎に読み書きスレッドを立てる
+    use_reactor = os.name != "nt"
+
     def __init__(self, engine_name: str = "") -> None:
         """
         エンジンの初期化
@@ -66,6 +73,12 @@ class BaseEngine:
         # infoから始まる文字列を標準出力する(gui用のdirty hack)
         self.print_info = False
         self.think_result: BasePlayInfoPack = BasePlayInfoPack()
+        # multipv毎の最新のinfo。think_result.infosへはget_current_think_result, bestmoveで反映する
+        self.info_slots: List[Union[None, str, BasePlayInfo]] = []
+        # Trueのとき、受信時には最後の1行を文字列のまま残すだけにしてparseは必要になってから行う
+        self.lazy_info = False
+        # lazy_info時にparseした結果。(元の行, parse結果)
+        self.parsed_slots: List[Optional[Tuple[str, BasePlayInfo]]] = []
         # private
         # エンジンのプロセスハンドル
         self.proc: Optional[subprocess.Popen] = None
@@ -79,6 +92,21 @@ class BaseEngine:
 
         # エンジンにコマンドを送信するためのqueue(送信スレッドとのやりとりに用いる)
         self.send_queue: Queue = Queue()
+        # 状態待ちで送れずにいるコマンド(reactor利用時)
+        self.pending_command: Optional[str] = None
+        # 受信途中の行(reactor利用時)
+        self.read_buffer = b""
+        self.encoding = "shift-jis"
+        # reactorに登録されているか。切断されるとFalseに戻り、transport_closedがセットされる
+        self.reactor_registered = False
+        self.transport_closed = threading.Event()
+
+        # send_go_and_wait, send_isready_and_waitの応答待ち
+        self.go_future: Optional["Future[BasePlayInfoPack]"] = None
+        self.readyok_future: Optional["Future[None]"] = None
+        # 送ったgoの数と受け取ったbestmoveの数
+        self.go_serial = 0
+        self.bestmove_serial = 0
 
         # print()を呼び出すときのlock object
         self.lock_object = threading.Lock()
@@ -92,6 +120,8 @@ class BaseEngine:
             BaseEngine.static_count += 1
         self.position = ""
         self.dead = False
+        # コマンド毎の応答時間の計測
+        self.latency = LatencyRecorder()
 
     def get_name(self) -> str:
         """
@@ -135,11 +165,23 @@ class BaseEngine:
 
         # write workerに対するコマンドqueue
         self.send_queue = Queue()
+        self.pending_command = None
+        self.read_buffer = b""
+        self.transport_closed = threading.Event()
 
         # 最後にエンジン側から受信した行
         self.last_received_line = None
         self.change_state(UsiEngineState.WaitConnecting)
 
+        self.open_process()
+        # self.send_command("usi")
+        self.change_state(UsiEngineState.Connected)
+        self.start_transport()
+
+    def open_process(self) -> None:
+        """
+        エンジンのプロセスを起動する
+        """
         # このフィルタリングは本当は危うい
         if "ssh " not in self.engine_path:
             # 実行ファイルの存在するフォルダ
@@ -171,14 +213,51 @@ class BaseEngine:
                 stdin=subprocess.PIPE,
                 encoding="shift-jis",
             )
-        # self.send_command("usi")
-        self.change_state(UsiEngineState.Connected)
 
-        # 読み書きスレッド
-        self.read_thread = threading.Thread(target=self.read_worker)
-        self.read_thread.start()
-        self.write_thread = threading.Thread(target=self.write_worker)
-        self.write_thread.start()
+    def close_process(self) -> None:
+        """
+        エンジンのプロセスとのパイプを閉じる
+        """
+        # GCが呼び出されたときに回収されるはずだが、UnitTestでresource leakの警告が出るのが許せないので
+        # この時点でclose()を呼び出しておく。
+        if self.proc is not None:
+            self.proc.stdin.close()  # type:ignore
+            self.proc.stdout.close()  # type:ignore
+            self.proc.stderr.close()  # type:ignore
+            self.proc.terminate()  # type:ignore
+        self.proc = None
+
+    def process_exited(self) -> bool:
+        """
+        エンジンのプロセスが終了しているか
+        """
+        return self.proc is None or self.proc.poll() is not None
+
+    def start_transport(self) -> None:
+        """
+        起動したエンジンとの読み書きを開始する
+        """
+        self.send_initial_commands()
+        if self.use_reactor:
+            self.reactor_registered = True
+            get_reactor().register(self)
+        else:
+            # 読み書きスレッド
+            self.read_thread = threading.Thread(target=self.read_worker)
+            self.read_thread.start()
+            self.write_thread = threading.Thread(target=self.write_worker)
+            self.write_thread.start()
+
+    def send_initial_commands(self) -> None:
+        """
+        起動直後に送るコマンドを積む
+        """
+        for option in self.options:
+            self.send_command(
+                "setoption name {0} value {1}".format(option[0], option[1])
+            )
+        self.send_command("isready")  # 先行して"isready"を送信
+        self.change_state(UsiEngineState.WaitReadyOk)
 
     def change_multipv(self, multipv: int) -> None:
         """
@@ -192,16 +271,26 @@ class BaseEngine:
     def is_connected(self) -> bool:
         return self.proc is not None
 
+    def is_dead(self) -> bool:
+        """
+        エンジンのプロセスが落ちているか
+        """
+        return self.dead
+
     def quit(self) -> None:
         """
         エンジンにquitコマンドを送る
         """
-        if self.proc is not None:
+        if self.is_connected():
             self.send_command("quit")
             # スレッドをkillするのはpythonでは難しい。
             # エンジンが行儀よく動作することを期待するしかない。
             # "quit"メッセージを送信して、エンジン側に終了してもらうしかない。
 
+        # reactorがエンジンの終了(EOF)を検出するまで待つ
+        if self.reactor_registered and not get_reactor().in_reactor_thread():
+            self.transport_closed.wait()
+
         if self.read_thread is not None:
             self.read_thread.join()
             self.read_thread = None
@@ -210,15 +299,7 @@ class BaseEngine:
             self.write_thread.join()
             self.write_thread = None
 
-        # GCが呼び出されたときに回収されるはずだが、UnitTestでresource leakの警告が出るのが許せないので
-        # この時点でclose()を呼び出しておく。
-        if self.proc is not None:
-            self.proc.stdin.close()  # type:ignore
-            self.proc.stdout.close()  # type:ignore
-            self.proc.stderr.close()  # type:ignore
-            self.proc.terminate()  # type:ignore
-
-        self.proc = None
+        self.close_process()
         self.change_state(UsiEngineState.Disconnected)
 
     def set_print_info(self, print_info: bool) -> None:
@@ -254,6 +335,7 @@ class BaseEngine:
         """
         現時点でのpvの様子を吐く
         """
+        self.materialize_infos()
         return self.think_result
 
     def parse_pv(
@@ -281,16 +363,21 @@ class BaseEngine:
         """
         # 過去のgoの結果を消す
         self.think_result = BasePlayInfoPack()
-        self.send_queue.put(go_cmd)
-        self.wait_for_state(UsiEngineState.WaitBestmove)
-        self.wait_for_state(UsiEngineState.WaitCommand)
-        return self.think_result
+        # state_changed_cvの通知ではなく、このgoに対するfutureで待つ
+        future: "Future[BasePlayInfoPack]" = Future()
+        self.go_future = future
+        self.send_command(go_cmd)
+        return future.result()
 
     def send_command(self, cmd: str) -> None:
         """
         エンジンに特別なコマンドを送る。
         """
+        if cmd.startswith("go"):
+            self.go_serial += 1
         self.send_queue.put(cmd)
+        if self.reactor_registered:
+            get_reactor().request_send(self)
 
     # self.engine_stateを変更する。
     def change_state(self, state: UsiEngineState) -> None:
@@ -311,6 +398,10 @@ class BaseEngine:
             self.engine_state = state
             self.state_changed_cv.notify_all()
 
+        # 状態待ちで止まっているコマンドが送れるようになったかもしれない
+        if self.reactor_registered and state == UsiEngineState.WaitCommand:
+            get_reactor().request_send(self)
+
     # エンジンとのやりとりを行うスレッド(read方向)
     def read_worker(self) -> None:
         assert self.proc is not None
@@ -324,9 +415,49 @@ class BaseEngine:
             # プロセスが生きているかのチェック
             retcode = self.proc.poll()  # type:ignore
             if not line and retcode is not None:
-                self.exit_state = "0"
                 # エラー以外の何らかの理由による終了
                 break
+        self.on_transport_closed()
+
+    def get_read_fd(self) -> int:
+        """
+        reactorで監視するファイルディスクリプタ
+        """
+        assert self.proc is not None
+        return self.proc.stdout.fileno()  # type:ignore
+
+    def read_chunk(self) -> bytes:
+        """
+        reactorから呼ばれる。読めるだけ読む。空のbytesは切断を表す
+        """
+        return os.read(self.get_read_fd(), 65536)
+
+    def feed(self, chunk: bytes) -> None:
+        """
+        reactorが受信したデータを行に分けてdispatch_messageに渡す
+        """
+        lines = (self.read_buffer + chunk).split(b"\n")
+        self.read_buffer = lines.pop()
+        for line in lines:
+            self.dispatch_message(line.decode(self.encoding, errors="ignore").strip())
+
+    def on_transport_closed(self) -> None:
+        """
+        エンジンとの通信が切れたときの処理
+        """
+        self.exit_state = "0"
+        if self.engine_state != UsiEngineState.Disconnected:
+            self.dead = True
+        # 応答待ちをしている側を起こす
+        if self.go_future is not None and not self.go_future.done():
+            self.materialize_infos()
+            self.go_future.set_result(self.think_result)
+        if self.readyok_future is not None and not self.readyok_future.done():
+            self.readyok_future.set_result(None)
+        with self.state_changed_cv:
+            self.state_changed_cv.notify_all()
+        self.reactor_registered = False
+        self.transport_closed.set()
 
     def reflesh_game(self) -> None:
         """
@@ -339,20 +470,94 @@ class BaseEngine:
         """
         isreadyコマンドを送り、readyokを待つ
         """
-        self.send_command("isready")  # 先行して"isready"を送信
+        # readyokの方が先に返ってきても取りこぼさないよう、状態を変えてから送る
+        future: "Future[None]" = Future()
+        self.readyok_future = future
         self.change_state(UsiEngineState.WaitReadyOk)
-        self.wait_for_state(UsiEngineState.WaitCommand)
+        self.send_command("isready")
+        future.result()
+
+    # 先頭のtokenのコマンドを今の状態で送ってよいか
+    def can_send_command(self, token: str) -> bool:
+        if self.dead:
+            return True
+        # go, positionなどのコマンドは、WaitCommand状態でないと送信できない。
+        if token in ["go", "position", "moves", "side", "usinewgame", "gameover"]:
+            return self.engine_state == UsiEngineState.WaitCommand
+        return True
+
+    # コマンドを送る直前の処理。Falseを返したコマンドはエンジンに送らない
+    def before_send_command(self, message: str, token: str) -> bool:
+        # stopコマンドではあるが、goコマンドを送信していないなら送信しない。
+        if token == "stop":
+            if self.engine_state != UsiEngineState.WaitBestmove:
+                return False
+            self.latency.start("stop_bestmove")
+        elif token == "go":
+            # go cmdならthink_resultを初期化する
+            self.think_result.infos = []
+            self.reset_info_slots()
+            self.latency.start("go_first_info")
+            self.latency.start("go_bestmove")
+            self.latency.cancel("stop_bestmove")
+            self.change_state(UsiEngineState.WaitBestmove)
+        elif token == "isready":
+            self.latency.start("isready")
+        elif token == "position":
+            self.position = message
+        elif token == "moves" or token == "side":
+            self.change_state(UsiEngineState.WaitOneLine)
+        elif token == "usinewgame" or token == "gameover":
+            self.reflesh_game()
+        return True
+
+    # 1行をエンジンに書き込む
+    def write_line(self, message: str) -> None:
+        self.proc.stdin.write(message + "\n")  # type:ignore
+        self.proc.stdin.flush()  # type:ignore
+
+    # コマンドを1つ送る。以降コマンドを送れない(quitした、エンジンが落ちた)場合Falseを返す
+    def send_one_command(self, message: str, token: str) -> bool:
+        if not self.before_send_command(message, token):
+            return True
+        try:
+            self.write_line(message)
+        except (OSError, ValueError):
+            self.dead = True
+            return False
+
+        if token == "quit":
+            self.change_state(UsiEngineState.Disconnected)
+            return False
+
+        if self.process_exited():
+            self.dead = True
+            return False
+        return True
+
+    # 送信キューのうち、今の状態で送れるコマンドを送る(reactorのスレッドから呼ばれる)
+    def pump_send_queue(self) -> None:
+        while self.is_connected():
+            if self.pending_command is not None:
+                message = self.pending_command
+            else:
+                try:
+                    message = self.send_queue.get_nowait()
+                except Empty:
+                    return
+            # 先頭の文字列で判別する。
+            messages = message.split()
+            token = messages[0] if len(messages) else ""
+            if not self.can_send_command(token):
+                self.pending_command = message
+                return
+            self.pending_command = None
+            if not self.send_one_command(message, token):
+                return
 
     # エンジンとやりとりを行うスレッド(write方向)
     def write_worker(self) -> None:
-
-        for option in self.options:
-            self.send_command(
-                "setoption name {0} value {1}".format(option[0], option[1])
-            )
-        self.send_command("isready")  # 先行して"isready"を送信
-        self.change_state(UsiEngineState.WaitReadyOk)
-        assert self.proc is not None
+        assert self.is_connected()
 
         try:
             while True:
@@ -363,40 +568,15 @@ class BaseEngine:
                     token = messages[0]
                 else:
                     token = ""
-                # stopコマンドではあるが、goコマンドを送信していないなら送信しない。
-                if token == "stop":
-                    if self.engine_state != UsiEngineState.WaitBestmove:
-                        continue
-                elif token == "go":
-                    # go cmdならthink_resultを初期化する
-                    self.think_result.infos = []
-                    self.wait_for_state(UsiEngineState.WaitCommand)
-                    self.change_state(UsiEngineState.WaitBestmove)
-                # positionコマンドは、WaitCommand状態でないと送信できない。
-                elif token == "position":
-                    self.position = message
-                    self.wait_for_state(UsiEngineState.WaitCommand)
-                elif token == "moves" or token == "side":
-                    self.wait_for_state(UsiEngineState.WaitCommand)
-                    self.change_state(UsiEngineState.WaitOneLine)
-                elif token == "usinewgame" or token == "gameover":
-                    self.reflesh_game()
-                    self.wait_for_state(UsiEngineState.WaitCommand)
-                elif token == "ponderhit":
-                    pass
-                self.proc.stdin.write(message + "\n")  # type:ignore
-                self.proc.stdin.flush()  # type:ignore
-
-                if token == "quit":
-                    self.change_state(UsiEngineState.Disconnected)
+                with self.state_changed_cv:
+                    self.state_changed_cv.wait_for(
+                        lambda: self.can_send_command(token)
+                        or self.engine_state == UsiEngineState.Disconnected
+                    )
+                if not self.send_one_command(message, token):
                     # 終了コマンドを送信したなら自発的にこのスレッドを終了させる。
                     break
 
-                retcode = self.proc.poll()
-                if retcode is not None:
-                    self.dead = True
-                    break
-
         except Exception:
             raise ValueError
 
@@ -421,14 +601,14 @@ class BaseEngine:
         # "isready"に対する応答
         elif token == "readyok":
             # print("info string receive readyok from engine", flush=True)
-            self.change_state(UsiEngineState.WaitCommand)
+            self.finish_isready()
         # "go"に対する応答
         elif token == "bestmove":
-            # 指し手待機の状態になるまで待機
-            time.sleep(0.001)
-            self.handle_bestmove(message)
-            # print("bm received")
-            self.change_state(UsiEngineState.WaitCommand)
+            # send_go_and_waitはfutureで待つので、状態の変化を待つためのsleepは不要
+            with self.latency.measure("bestmove_dispatch"):
+                self.handle_bestmove(message)
+                # print("bm received")
+                self.finish_go()
         # エンジンの読み筋に対する応答
         elif token == "info":
             if self.print_info:
@@ -442,6 +622,9 @@ class BaseEngine:
 
     # エンジンから送られてきた"bestmove"を処理する。
     def handle_bestmove(self, message: str) -> None:
+        self.latency.stop("go_bestmove")
+        self.latency.stop("stop_bestmove")
+        self.materialize_infos()
         messages = message.split()
         if len(messages) >= 4 and messages[2] == "ponder":
             self.think_result.ponder = messages[3]
@@ -452,15 +635,96 @@ class BaseEngine:
             # 思考内容返ってきてない。どうなってんの…。
             self.think_result.bestmove = "none"
 
+    # readyokを受け取ったときの状態遷移と待っている側への通知
+    def finish_isready(self) -> None:
+        self.latency.stop("isready")
+        self.change_state(UsiEngineState.WaitCommand)
+        future = self.readyok_future
+        if future is not None and not future.done():
+            future.set_result(None)
+
+    # bestmoveを受け取ったときの状態遷移と待っている側への通知
+    def finish_go(self) -> None:
+        self.bestmove_serial += 1
+        self.change_state(UsiEngineState.WaitCommand)
+        future = self.go_future
+        if future is not None and not future.done():
+            future.set_result(self.think_result)
+
     # エンジンから送られてきた"info ..."を処理する。
     def handle_info(self, message: str) -> None:
-        # まだ"go"を発行していないのか？
-        info: Optional[BasePlayInfo] = generate_playinfo_from_info(message)
-        if info is None:
-            return
-        if len(self.think_result.infos) < info.multipv:
-            self.think_result.infos.append(None)  # type:ignore
-        self.think_result.infos[info.multipv - 1] = info
+        self.latency.stop("go_first_info")
+        if self.lazy_info:
+            # 読み筋を含まない行は捨てる。multipvだけ読んで行はそのまま残す
+            if " pv " not in message or message.startswith("info string"):
+                return
+            index = get_multipv_from_info(message) - 1
+            slot: Union[None, str, BasePlayInfo] = message
+        else:
+            info: Optional[BasePlayInfo] = parse_info_line(message)
+            if info is None:
+                return
+            index = info.multipv - 1
+            slot = info
+        if index >= len(self.info_slots):
+            self.info_slots.extend([None] * (index + 1 - len(self.info_slots)))
+        self.info_slots[index] = slot
+
+    def set_lazy_info(self, lazy_info: bool) -> None:
+        """
+        infoのparseを遅延させるかを設定する
+
+        lazy_info (bool):
+            Trueならinfoは受信時にparseせず、get_current_think_resultやbestmoveの受信時にparseする
+        """
+        self.lazy_info = lazy_info
+
+    def get_multipv(self) -> int:
+        """
+        setoptionで指定したMultiPVの値
+        """
+        for option in self.options:
+            if option[0] == "MultiPV":
+                try:
+                    return max(1, int(option[1]))
+                except ValueError:
+                    break
+        return 1
+
+    def reset_info_slots(self) -> None:
+        """
+        goを送るときにmultipv分のslotを確保しなおす
+        """
+        self.info_slots = [None] * self.get_multipv()
+        self.parsed_slots = []
+
+    def materialize_infos(self) -> None:
+        """
+        slotに溜まっているinfoをthink_result.infosに反映する
+        """
+        infos: List[BasePlayInfo] = []
+        # 受信スレッドがslotを書き換えてもいいように手元にコピーしてから読む
+        slots = list(self.info_slots)
+        if len(self.parsed_slots) < len(slots):
+            self.parsed_slots.extend([None] * (len(slots) - len(self.parsed_slots)))
+        for index, slot in enumerate(slots):
+            if slot is None:
+                continue
+            if isinstance(slot, str):
+                # 前回parseした行と同じならその結果を使い回す
+                parsed = self.parsed_slots[index]
+                if parsed is not None and parsed[0] is slot:
+                    infos.append(parsed[1])
+                    continue
+                info = parse_info_line(slot)
+                if info is None:
+                    continue
+                self.parsed_slots[index] = (slot, info)
+                infos.append(info)
+            else:
+                infos.append(slot)
+        if infos:
+            self.think_result.infos = infos
 
     # デストラクタで通信の切断を行う。
     def __del__(self) -> None:
@@ -473,6 +737,13 @@ class BaseEngine:
             with self.state_changed_cv:
                 if self.engine_state == state:
                     return
+                # bestmoveが即座に返ってきてWaitBestmoveを見逃した場合
+                if (
+                    state == UsiEngineState.WaitBestmove
+                    and self.go_serial > 0
+                    and self.bestmove_serial >= self.go_serial
+                ):
+                    return
                 if self.engine_state == UsiEngineState.Disconnected:
                     # pass
                     raise ValueError("engine_state == UsiEngineState.Disconnected.")
@@ -480,6 +751,17 @@ class BaseEngine:
                 # Eventが変化するのを待機する。
                 self.state_changed_cv.wait()
 
+    def wait_for_bestmove(self) -> None:
+        """
+        それまでに送ったgo全てに対するbestmoveが返るまで待つ。
+        状態ではなくgoとbestmoveの数で待つので、ponderhitでgoを送りなおす間の一時的なWaitCommandでは返らない
+        """
+        with self.state_changed_cv:
+            while not self.dead and self.bestmove_serial < self.go_serial:
+                if self.engine_state == UsiEngineState.Disconnected:
+                    raise ValueError("engine_state == UsiEngineState.Disconnected.")
+                self.state_changed_cv.wait()
+
     # [SYNC] エンジンに対して1行送って、すぐに1行返ってくるので、それを待って、この関数の返し値として返す。
     def send_command_and_getline(self, command: str) -> str:
         self.wait_for_state(UsiEngineState.WaitCommand)
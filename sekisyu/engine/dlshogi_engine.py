@@ -1,4 +1,3 @@
-import time
 from typing import Optional
 
 from sekisyu.engine.base_engine import BaseEngine, UsiEngineState
@@ -26,84 +25,69 @@ class DlshogiEngine(BaseEngine):
         self.send_command("isready")  # 先行して"isready"を送信
         self.change_state(UsiEngineState.WaitReadyOk)
 
-    # エンジンとやりとりを行うスレッド(write方向)
-    def write_worker(self) -> None:
-
-        for option in self.options:
-            self.send_command(
-                "setoption name {0} value {1}".format(option[0], option[1])
-            )
-        self.send_command("isready")  # 先行して"isready"を送信
-        self.change_state(UsiEngineState.WaitReadyOk)
+    def send_initial_commands(self) -> None:
+        super().send_initial_commands()
         self.ponder_str = None
 
-        try:
-            while True:
-                message = self.send_queue.get()
-                # 先頭の文字列で判別する。
-                messages = message.split()
-                if len(messages):
-                    token = messages[0]
-                else:
-                    token = ""
-                # stopコマンドではあるが、goコマンドを送信していないなら送信しない。
-                if token == "stop":
-                    # stopをもらったらresignを吐く
-                    # looks like dlshogi does not return bestmove
-                    # make move to legal thanks to shameful usi protocol
-                    # self.think_result.infos[0].pv[0] = "resign"
-                    self.change_state(UsiEngineState.WaitCommand)
-                elif token == "go":
-                    # go ponderは無視する
-                    if self.print_info_before is None:
-                        self.print_info_before = self.print_info
-                    self.set_print_info(self.print_info_before)
-                    if messages[1] == "ponder":
-                        print(
-                            "info string dlshogi engine does not depends on shameful usi ponder protocol"
-                        )
-                        self.ponder_str = message.replace("ponder", "")
-                        self.change_state(UsiEngineState.WaitBestmove)
-                        continue
-                    else:
-                        self.ponder_str = None
-                    # go cmdならthink_resultを初期化する
-                    self.think_result.infos = []
-                    self.wait_for_state(UsiEngineState.WaitCommand)
-                    self.change_state(UsiEngineState.WaitBestmove)
-                # positionコマンドは、WaitCommand状態でないと送信できない。
-                elif token == "position":
-                    self.position = message
-                    self.wait_for_state(UsiEngineState.WaitCommand)
-                elif token == "moves" or token == "side":
-                    self.wait_for_state(UsiEngineState.WaitCommand)
-                    self.change_state(UsiEngineState.WaitOneLine)
-                elif token == "usinewgame" or token == "gameover":
-                    self.reflesh_game()
-
-                    self.wait_for_state(UsiEngineState.WaitCommand)
-                elif token == "ponderhit":
-                    # ponderhitも破棄する
-                    if self.ponder_str is not None:
-                        print(  # type:ignore
-                            f"info string ponderhit go_cmd {self.ponder_str}"
-                        )
-                        self.send_command(self.ponder_str)
-                        continue
-                self.proc.stdin.write(message + "\n")  # type:ignore
-                self.proc.stdin.flush()  # type:ignore
-
-                if token == "quit":
-                    self.change_state(UsiEngineState.Disconnected)
-                    # 終了コマンドを送信したなら自発的にこのスレッドを終了させる。
-                    break
-
-                retcode = self.proc.poll()  # type:ignore
-                if retcode is not None:
-                    break
-
-        except Exception:
-            raise ValueError
+    # コマンドを送る直前の処理。Falseを返したコマンドはエンジンに送らない
+    def before_send_command(self, message: str, token: str) -> bool:
+        messages = message.split()
+        # stopコマンドではあるが、goコマンドを送信していないなら送信しない。
+        if token == "stop":
+            # stopをもらったらresignを吐く
+            # looks like dlshogi does not return bestmove
+            # make move to legal thanks to shameful usi protocol
+            # self.think_result.infos[0].pv[0] = "resign"
+            if (
+                self.ponder_str is not None
+                and self.engine_state == UsiEngineState.WaitBestmove
+            ):
+                # go ponderはエンジンに送っていないのでbestmoveは返ってこない
+                self.bestmove_serial += 1
+            else:
+                self.latency.start("stop_bestmove")
+            self.change_state(UsiEngineState.WaitCommand)
+            # bestmoveを待たずに返す(元の挙動と同じ)
+            future = self.go_future
+            if future is not None and not future.done():
+                self.materialize_infos()
+                future.set_result(self.think_result)
+            return True
+        elif token == "go":
+            # go ponderは無視する
+            if self.print_info_before is None:
+                self.print_info_before = self.print_info
+            self.set_print_info(self.print_info_before)
+            if len(messages) >= 2 and messages[1] == "ponder":
+                print(
+                    "info string dlshogi engine does not depends on shameful usi ponder protocol"
+                )
+                self.ponder_str = message.replace("ponder", "")
+                self.change_state(UsiEngineState.WaitBestmove)
+                return False
+            else:
+                self.ponder_str = None
+        elif token == "ponderhit":
+            # ponderhitも破棄する
+            if self.ponder_str is not None:
+                print(  # type:ignore
+                    f"info string ponderhit go_cmd {self.ponder_str}"
+                )
+                # 送っていないgo ponderを終わらせてから改めてgoを送る。
+                # goを先に積んでおき、bestmoveを待つ側がgo ponderの終わりで起きないようにする
+                self.send_command(self.ponder_str)
+                self.bestmove_serial += 1
+                self.change_state(UsiEngineState.WaitCommand)
+                return False
+        elif token == "usinewgame" or token == "gameover":
+            # reflesh_gameでisreadyをキューに積むと後続のpositionより後ろになり
+            # readyokが返ってこなくなるので、ここで直接送る
+            self.write_line(message)
+            self.change_state(UsiEngineState.WaitReadyOk)
+            self.latency.start("isready")
+            self.write_line("isready")
+            return False
+        return super().before_send_command(message, token)
 
     # エンジン側から送られてきたメッセージを解釈する。
     def dispatch_message(self, message: str) -> None:
@@ -126,17 +110,16 @@ class DlshogiEngine(BaseEngine):
         # "isready"に対する応答
         elif token == "readyok":
             # print("info string receive readyok from engine", flush=True)
-            self.change_state(UsiEngineState.WaitCommand)
+            self.finish_isready()
         # "go"に対する応答
         elif token == "bestmove":
-            # 指し手待機の状態になるまで待機
-            time.sleep(0.001)
-            self.handle_bestmove(message)
-            # print("bm received")
-            self.think_result.generate_ponder_from_pv()
-            self.change_state(UsiEngineState.WaitCommand)
-            self.print_info_before = self.print_info
-            self.set_print_info(False)
+            with self.latency.measure("bestmove_dispatch"):
+                self.handle_bestmove(message)
+                # print("bm received")
+                self.think_result.generate_ponder_from_pv()
+                self.print_info_before = self.print_info
+                self.set_print_info(False)
+                self.finish_go()
         # エンジンの読み筋に対する応答
         elif token == "info":
             if self.print_info:
@@ -147,6 +130,7 @@ class DlshogiEngine(BaseEngine):
             # 候補手の生成順序の順番で出てくる。
             mpv_ply = message.split(" ")[0].split(":")[-1]
             mpv_nodes = int(message.split("move_count:")[1].split(" ")[0])
+            self.materialize_infos()
             for idx in range(len(self.think_result.infos)):
                 if self.think_result.infos[idx].pv[0] == mpv_ply:
                     self.think_result.infos[idx].nodes = mpv_nodes
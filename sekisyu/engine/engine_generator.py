@@ -1,7 +1,12 @@
 from typing import Any, Dict
 
+from sekisyu.engine.analysis_cache import AnalysisCache
+from sekisyu.engine.async_engine import AsyncEngineAdapter, AsyncYaneuraOuEngine
 from sekisyu.engine.base_engine import BaseEngine, UsiEngineState
 from sekisyu.engine.dlshogi_engine import DlshogiEngine
+from sekisyu.engine.remote_engine import RemoteEngine
+from sekisyu.engine.virtual_engine.cached_engine import CachedEngine
+from sekisyu.engine.virtual_engine.cluster_engine import ClusterEngine
 from sekisyu.engine.virtual_engine.ensemble_engine import EnsembleEngine
 from sekisyu.engine.virtual_engine.forcebook_engine import ForceBookEngine
 from sekisyu.engine.virtual_engine.relay_engine import RelayEngine
@@ -24,12 +29,33 @@ def generate_engine_dict(config: Dict[str, Any]) -> BaseEngine:
         BaseEngine : エンジン
     """
     if config["engine_mode"] == "yaneuraou":
-        engine = YaneuraOuEngine(config["engine_name"])
+        # use_asyncを指定した場合はスレッドを立てずにasyncioのイベントループで通信する
+        if config.get("use_async", False):
+            engine = AsyncYaneuraOuEngine(config["engine_name"])
+        else:
+            engine = YaneuraOuEngine(config["engine_name"])
         engine.set_option(config["option"])
+        # lazy_infoを指定した場合、infoのparseをbestmove受信時まで遅延させる
+        engine.set_lazy_info(config.get("lazy_info", False))
         engine.boot(config["engine_path"])
     elif config["engine_mode"] == "dlshogi":
+        # dlshogi用のponderの読み替えはBaseEngineの送受信処理に依存しているのでasyncでは使えない
+        if config.get("use_async", False):
+            raise ValueError("use_async is not supported for engine_mode dlshogi")
         engine = DlshogiEngine(config["engine_name"])
         engine.set_option(config["option"])
+        engine.set_lazy_info(config.get("lazy_info", False))
+        engine.boot(config["engine_path"])
+    elif config["engine_mode"] == "remote":
+        # engine_hostで起動済のエンジンを借りる。engine_pathは"tcp://host:port/エンジン名"
+        engine = RemoteEngine(
+            config["engine_name"],
+            reconnect_retry=config.get("reconnect_retry", 5),
+            reconnect_interval=config.get("reconnect_interval", 1.0),
+            token=config.get("remote_token"),
+        )
+        engine.set_option(config["option"])
+        engine.set_lazy_info(config.get("lazy_info", False))
         engine.boot(config["engine_path"])
 
     elif config["engine_mode"] == "forcebook":
@@ -47,23 +73,62 @@ def generate_engine_dict(config: Dict[str, Any]) -> BaseEngine:
         engine = SekisyuEngine(
             base_engine, analyze_engine, config["engine_name"], config["engine_config"]
         )
+    elif config["engine_mode"] == "cached":
+        # send_go_and_waitの結果をsqliteにキャッシュする
+        base_engine = generate_engine_dict(config["base_engine_config"])
+        cache = AnalysisCache(
+            config["cache_path"], config.get("cache_max_entries", 100000)
+        )
+        engine = CachedEngine(
+            base_engine,
+            cache,
+            config.get("engine_name", ""),
+            config.get("cache_history_plies", 16),
+        )
     elif config["engine_mode"] == "ensemble":
         engines = []
         for base in config["base_engine_configs"]:
             engines.append(generate_engine_dict(base))
         ensembler = generate_ensembler_dict(config["ensembler_config"])
-        engine = EnsembleEngine(engines, ensembler, config["engine_name"])
+        engine = EnsembleEngine(
+            engines,
+            ensembler,
+            config["engine_name"],
+            config.get("stop_margin_ratio", 0.1),
+            config.get("stop_timeout", 1.0),
+        )
+
+    elif config["engine_mode"] == "cluster":
+        # 合法手を分けて探索させるエンジン。remoteのエンジンを混ぜてもよい
+        engines = []
+        for base in config["base_engine_configs"]:
+            engines.append(generate_engine_dict(base))
+        engine = ClusterEngine(
+            engines, config["engine_name"], config.get("use_engine_moves", False)
+        )
 
     elif config["engine_mode"] == "relay":
         engines = []
         for base in config["base_engine_configs"]:
             engines.append(generate_engine_dict(base))
-        engine = RelayEngine(engines, config["ply_to_pass"], config["engine_name"])
+        engine = RelayEngine(
+            engines,
+            config["ply_to_pass"],
+            config["engine_name"],
+            config.get("prefetch_plies", 0),
+        )
 
     else:
-        engine = BaseEngine(config["engine_name"])
+        if config.get("use_async", False):
+            engine = AsyncEngineAdapter(config["engine_name"])
+        else:
+            engine = BaseEngine(config["engine_name"])
         engine.set_option(config["option"])
+        engine.set_lazy_info(config.get("lazy_info", False))
         engine.boot(config["engine_path"])
 
     engine.wait_for_state(UsiEngineState.WaitCommand)
+    # 応答時間の集計を定期的にinfo stringで出力する
+    if config.get("latency_dump_interval", 0) > 0:
+        engine.latency.start_dump(config["latency_dump_interval"], engine.get_name())
     return engine
@@ -0,0 +1,288 @@
+import hmac
+import os
+import socket
+import subprocess
+import threading
+from typing import Any, Dict, Optional
+
+"""
+エンジンの動くマシン上で常駐し、TCP経由でエンジンを貸し出すエージェント
+
+sshでエンジンを起動すると毎回ハンドシェイクと評価関数の読み込みが走るので、
+エンジンはこちらで起動したままにしておき、RemoteEngineからの接続を受け付ける。
+
+プロトコル(utf-8の行単位)
+    client -> host : "attach <エンジン名>"。hostにtokenを設定した場合は"attach <エンジン名> <token>"
+    host -> client : "attached booted" または "attached reused"。失敗時は"error <理由>"
+    以降はUSIプロトコルをそのまま中継する。
+    clientの"quit"はエンジンに送らず切断のみ行う(エンジンは起動したまま次の接続を待つ)
+    探索中に切断された場合はstopを送り、その探索のbestmoveが返るまで次のattachを待たせる
+    (返ってきたbestmoveは捨てる)。古いbestmoveを次のclientが自分のgoへの応答と取り違えないため
+"""
+
+
+class HostedEngine:
+    """
+    エージェントが起動したエンジン1つ分。接続中のclientは高々1つ
+    """
+
+    def __init__(self, name: str, engine_path: str, encoding: str = "shift-jis"):
+        self.name = name
+        self.engine_path = engine_path
+        self.encoding = encoding
+        self.lock = threading.Lock()
+        self.client: Optional[socket.socket] = None
+        self.proc: Optional[subprocess.Popen] = None
+        self.read_thread: Optional[threading.Thread] = None
+        # goを送ってからbestmoveが返るまでTrue
+        self.searching = False
+        # 切断されたclientの探索のbestmoveを捨てるか
+        self.discard_bestmove = False
+        # 探索中でなければset
+        self.idle = threading.Event()
+        self.idle.set()
+
+    def boot(self) -> None:
+        fullpath = os.path.join(os.getcwd(), self.engine_path)
+        if not os.path.exists(fullpath):
+            raise FileNotFoundError(fullpath + " not found.")
+        self.proc = subprocess.Popen(
+            fullpath,
+            shell=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            stdin=subprocess.PIPE,
+            cwd=os.path.dirname(fullpath),
+        )
+        self.read_thread = threading.Thread(target=self.read_worker, daemon=True)
+        self.read_thread.start()
+
+    def is_alive(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+    def read_worker(self) -> None:
+        """
+        エンジンの出力を接続中のclientに転送する。clientがいなければ捨てる
+        """
+        assert self.proc is not None
+        for line in self.proc.stdout:  # type:ignore
+            data = line.decode(self.encoding, errors="ignore").rstrip() + "\n"
+            with self.lock:
+                if data.startswith("bestmove"):
+                    discard = self.discard_bestmove
+                    self.searching = False
+                    self.discard_bestmove = False
+                    self.idle.set()
+                    if discard:
+                        continue
+                if self.client is None:
+                    continue
+                try:
+                    self.client.sendall(data.encode("utf-8"))
+                except OSError:
+                    self.client = None
+        # エンジンが落ちたらclientにも切断を伝える
+        with self.lock:
+            self.searching = False
+            self.idle.set()
+            if self.client is not None:
+                close_socket(self.client)
+                self.client = None
+
+    def write(self, message: str) -> None:
+        assert self.proc is not None
+        if message.startswith("go"):
+            with self.lock:
+                self.searching = True
+                self.idle.clear()
+        self.proc.stdin.write(message.encode(self.encoding) + b"\n")  # type:ignore
+        self.proc.stdin.flush()  # type:ignore
+
+    def attach(
+        self, client: socket.socket, reply: bytes, stop_timeout: float = 10.0
+    ) -> bool:
+        """
+        clientを繋ぐ。既に別のclientが繋がっていたら切断する。
+        前のclientの探索が終わるまで待ってから、replyを送って出力の転送を始める
+
+        Args:
+            reply (bytes): 繋いだときにclientに送る行
+            stop_timeout (float): 前の探索のbestmoveを待つ秒数
+
+        Returns:
+            bool : 繋いだらTrue。前の探索が終わらなければFalse
+        """
+        with self.lock:
+            previous = self.client
+        if previous is not None:
+            close_socket(previous)
+            self.detach(previous)
+        if not self.idle.wait(stop_timeout):
+            return False
+        with self.lock:
+            client.sendall(reply)
+            self.client = client
+        return True
+
+    def detach(self, client: socket.socket) -> None:
+        """
+        clientを切り離す。探索中ならstopを送り、その探索のbestmoveは捨てる
+        """
+        with self.lock:
+            if self.client is not client:
+                return
+            self.client = None
+            searching = self.searching
+            if searching:
+                self.discard_bestmove = True
+        if searching and self.is_alive():
+            try:
+                self.write("stop")
+            except OSError:
+                pass
+
+    def quit(self) -> None:
+        if self.is_alive():
+            try:
+                self.write("quit")
+                self.proc.wait(10)  # type:ignore
+            except (OSError, subprocess.TimeoutExpired):
+                self.proc.kill()  # type:ignore
+
+
+def close_socket(sock: socket.socket) -> None:
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+    sock.close()
+
+
+class EngineHost:
+    """
+    エンジンを貸し出すTCPサーバ
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        engines: Dict[str, Dict[str, Any]],
+        token: Optional[str] = None,
+    ):
+        """
+        Args:
+            host (str): 待ち受けるアドレス。接続してきた相手はエンジンに任意のコマンドを送れるので、
+                他のマシンから使う場合以外は"127.0.0.1"にする
+            port (int): 待ち受けるポート。0なら空いているポートを使う
+            engines (dict(str, dict)): エンジン名 -> {"engine_path": str, "encoding": str}
+            token (str): attachで一致を確かめる共有の文字列。Noneなら確かめない
+        """
+        self.engine_configs = engines
+        self.engines: Dict[str, HostedEngine] = {}
+        self.lock = threading.Lock()
+        self.token = token
+        # socket.create_serverはpython3.8以降なので使わない
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen()
+        self.address = self.server.getsockname()
+        self.stopped = False
+
+    def get_engine(self, name: str) -> Optional[HostedEngine]:
+        """
+        起動済のエンジンを返す。未起動か落ちていれば起動する
+
+        Returns:
+            HostedEngine : 未知のエンジン名ならNone
+        """
+        if name not in self.engine_configs:
+            return None
+        with self.lock:
+            engine = self.engines.get(name)
+            if engine is not None and engine.is_alive():
+                return engine
+            config = self.engine_configs[name]
+            engine = HostedEngine(
+                name, config["engine_path"], config.get("encoding", "shift-jis")
+            )
+            engine.boot()
+            self.engines[name] = engine
+            return engine
+
+    def handle_client(self, client: socket.socket) -> None:
+        reader = client.makefile("rb")
+        engine: Optional[HostedEngine] = None
+        try:
+            first = reader.readline().decode("utf-8", errors="ignore").split()
+            if len(first) not in (2, 3) or first[0] != "attach":
+                client.sendall(b"error expected attach\n")
+                return
+            if self.token is not None and not hmac.compare_digest(
+                (first[2] if len(first) == 3 else "").encode("utf-8"),
+                self.token.encode("utf-8"),
+            ):
+                client.sendall(b"error invalid token\n")
+                return
+            with self.lock:
+                reused = first[1] in self.engines and self.engines[first[1]].is_alive()
+            try:
+                engine = self.get_engine(first[1])
+            except OSError as e:
+                client.sendall(f"error {e}\n".encode("utf-8"))
+                return
+            if engine is None:
+                client.sendall(f"error unknown engine {first[1]}\n".encode("utf-8"))
+                return
+            if not engine.attach(
+                client, b"attached reused\n" if reused else b"attached booted\n"
+            ):
+                client.sendall(f"error {engine.name} is busy\n".encode("utf-8"))
+                return
+            print(
+                f"attach {engine.name} {'reused' if reused else 'booted'}", flush=True
+            )
+            for line in reader:
+                message = line.decode("utf-8", errors="ignore").strip()
+                # quitはエンジンを落とさずに切断だけする
+                if message == "quit":
+                    break
+                engine.write(message)
+        except OSError:
+            pass
+        finally:
+            if engine is not None:
+                engine.detach(client)
+                print(f"detach {engine.name}", flush=True)
+            reader.close()
+            close_socket(client)
+
+    def serve_forever(self) -> None:
+        while not self.stopped:
+            try:
+                client, _ = self.server.accept()
+            except OSError:
+                break
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(
+                target=self.handle_client, args=(client,), daemon=True
+            ).start()
+
+    def start(self) -> None:
+        """
+        別スレッドで接続の受付を始める
+        """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def shutdown(self) -> None:
+        """
+        受付を止めて全てのエンジンを終了させる
+        """
+        self.stopped = True
+        # closeだけではacceptで待っているスレッドが起きないのでshutdownしてから閉じる
+        close_socket(self.server)
+        with self.lock:
+            for engine in self.engines.values():
+                engine.quit()
+            self.engines = {}
@@ -0,0 +1,125 @@
+import copy
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from queue import Queue
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, TypeVar
+
+from sekisyu.engine.base_engine import BaseEngine
+from sekisyu.engine.engine_generator import generate_engine_dict
+from sekisyu.playout.playinfo import BasePlayInfoPack
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class EnginePool:
+    """
+    同じ設定のエンジンをN個起動し、局面の解析を空いているエンジンに割り振る
+
+    棋譜の一括解析のように、1局面ずつ独立に解析できる処理を全コアで回すためのもの
+    """
+
+    def __init__(self, config: Dict[str, Any], pool_size: int) -> None:
+        """
+        Args:
+            config (dict(str, any)): generate_engine_dictに渡すエンジンの設定
+            pool_size (int): 起動するエンジンの数
+        """
+        assert pool_size >= 1
+        self.pool_size = pool_size
+        self.executor = ThreadPoolExecutor(max_workers=pool_size)
+        # エンジンの起動(isready待ち)も並列に行う
+        self.engines: List[BaseEngine] = list(
+            self.executor.map(
+                lambda _: generate_engine_dict(copy.deepcopy(config)),
+                range(pool_size),
+            )
+        )
+        # 解析に使われていないエンジン
+        self.free_engines: Queue = Queue()
+        for engine in self.engines:
+            self.free_engines.put(engine)
+
+    def get_name(self) -> str:
+        return self.engines[0].get_name()
+
+    def run_with_engine(self, func: Callable[[BaseEngine, T], R], item: T) -> R:
+        """
+        空いているエンジンを1つ借りてfuncを実行する
+        """
+        engine = self.free_engines.get()
+        try:
+            return func(engine, item)
+        finally:
+            self.free_engines.put(engine)
+
+    def map(
+        self, func: Callable[[BaseEngine, T], R], items: Iterable[T]
+    ) -> Iterator[R]:
+        """
+        func(engine, item)を空いているエンジンで並列に実行し、itemsの順番で結果を返す
+
+        Args:
+            func (callable): エンジンと入力を受け取って結果を返す関数
+            items (iterable): 入力のリスト
+
+        Returns:
+            iterator: 結果。itemsと同じ順番
+        """
+        # 全部を一度に投げるとitemsが巨大なときにメモリを食うので、先行させるのはエンジン数の2倍まで
+        max_pending = self.pool_size * 2
+        pending: Deque[Future] = deque()
+        for item in items:
+            pending.append(self.executor.submit(self.run_with_engine, func, item))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def analyze_many(
+        self, positions: Iterable[str], go_cmd: str
+    ) -> Iterator[BasePlayInfoPack]:
+        """
+        局面をまとめて解析する
+
+        Args:
+            positions (iterable(str)): usiプロトコルのposition cmd
+            go_cmd (str): 解析に使うgo cmd
+
+        Returns:
+            iterator(BasePlayInfoPack): 解析結果。positionsと同じ順番
+        """
+
+        def analyze(engine: BaseEngine, position: str) -> BasePlayInfoPack:
+            engine.send_command(position)
+            # think_resultはエンジンが使いまわすのでコピーして返す
+            return engine.send_go_and_wait(go_cmd).copy()
+
+        return self.map(analyze, positions)
+
+    def quit(self) -> None:
+        for engine in self.engines:
+            engine.quit()
+        self.executor.shutdown()
+
+
+if __name__ == "__main__":
+    import time
+
+    config = {
+        "engine_mode": "yaneuraou",
+        "engine_name": "yane",
+        "engine_path": "engine/YaneuraOu-by-gcc",
+        "option": [["Threads", "1"], ["MultiPV", "3"]],
+    }
+    moves = "7g7f 3c3d 2g2f 4c4d 2f2e 2b3c 3i4h 3a4b 5i6h 5a6b".split()
+    positions = [
+        "position startpos moves " + " ".join(moves[:i]) for i in range(len(moves))
+    ]
+    for size in [1, 4]:
+        pool = EnginePool(config, size)
+        start = time.time()
+        for result in pool.analyze_many(positions, "go nodes 100000"):
+            print(result.bestmove, result.infos[0].eval)
+        print(f"pool_size {size} : {time.time() - start:.2f}s")
+        pool.quit()
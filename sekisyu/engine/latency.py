@@ -0,0 +1,186 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+
+"""
+エンジンとのやりとりにかかった時間の計測
+
+isready→readyok, go→最初のinfo, go→bestmove, stop→bestmove, parse_pvなどの所要時間を
+対数スケールのヒストグラムに積む。計測1回あたりはperf_counterとdict操作数回で済む
+"""
+
+# 1 bucketあたりの幅。2^(1/4)倍ごとに区切る
+BUCKETS_PER_OCTAVE = 4
+# 1us - 2^32us(約70分)まで
+NUM_BUCKETS = 32 * BUCKETS_PER_OCTAVE + 1
+
+
+class LatencyHistogram:
+    """
+    所要時間のヒストグラム
+
+    count (int):
+        計測回数
+
+    total (float):
+        合計時間(秒)
+
+    max (float):
+        最大の時間(秒)
+
+    buckets (list(int)):
+        1usから2^(1/4)倍ごとに区切った回数
+    """
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets: List[int] = [0] * NUM_BUCKETS
+
+    def record(self, elapsed: float) -> None:
+        """
+        所要時間を1つ積む
+
+        Args:
+            elapsed (float): 所要時間(秒)
+        """
+        self.count += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+        us = elapsed * 1e6
+        if us <= 1.0:
+            index = 0
+        else:
+            index = min(int(math.log2(us) * BUCKETS_PER_OCTAVE) + 1, NUM_BUCKETS - 1)
+        self.buckets[index] += 1
+
+    def percentile(self, ratio: float) -> float:
+        """
+        ratio分位点を返す。bucketの上端を返すので概算
+
+        Args:
+            ratio (float): 0-1の値。0.5なら中央値
+
+        Returns:
+            float : 所要時間(秒)
+        """
+        if self.count == 0:
+            return 0.0
+        target = self.count * ratio
+        cumulative = 0
+        for index, num in enumerate(self.buckets):
+            cumulative += num
+            if cumulative >= target:
+                return min(2 ** (index / BUCKETS_PER_OCTAVE) * 1e-6, self.max)
+        return self.max
+
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def to_str(self) -> str:
+        return (
+            f"n={self.count} mean={self.mean() * 1000:.3f}ms "
+            f"p50={self.percentile(0.5) * 1000:.3f}ms "
+            f"p99={self.percentile(0.99) * 1000:.3f}ms "
+            f"max={self.max * 1000:.3f}ms"
+        )
+
+
+class LatencyRecorder:
+    """
+    コマンド毎のLatencyHistogramをまとめたもの。各エンジンがlatencyとして1つ持つ
+    """
+
+    def __init__(self) -> None:
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        # 計測中の項目と開始時刻
+        self.pending: Dict[str, float] = {}
+        self.dump_thread: Optional[threading.Thread] = None
+        self.dump_stop = threading.Event()
+
+    def record(self, name: str, elapsed: float) -> None:
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = LatencyHistogram()
+        histogram.record(elapsed)
+
+    def start(self, name: str) -> None:
+        """
+        計測を開始する。既に計測中なら開始時刻を上書きする
+        """
+        self.pending[name] = time.perf_counter()
+
+    def stop(self, name: str) -> None:
+        """
+        計測中であれば所要時間を記録する。計測中でなければ何もしない
+        """
+        start = self.pending.pop(name, None)
+        if start is not None:
+            self.record(name, time.perf_counter() - start)
+
+    def cancel(self, name: str) -> None:
+        self.pending.pop(name, None)
+
+    @contextmanager
+    def measure(self, name: str) -> Iterator[None]:
+        """
+        with文の中の処理時間を記録する
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def get(self, name: str) -> Optional[LatencyHistogram]:
+        return self.histograms.get(name)
+
+    def summary(self) -> List[str]:
+        """
+        項目毎の集計結果を返す
+
+        Returns:
+            list(str) : "項目名 集計結果"のリスト
+        """
+        return [
+            f"{name} {histogram.to_str()}"
+            for name, histogram in sorted(self.histograms.items())
+        ]
+
+    def start_dump(
+        self,
+        interval: float,
+        name: str = "",
+        output: Optional[Callable[[str], None]] = None,
+    ) -> None:
+        """
+        interval秒毎に集計結果をinfo stringで出力するスレッドを立てる
+
+        Args:
+            interval (float): 出力間隔(秒)
+            name (str): 出力の先頭に付けるエンジン名
+            output (callable): 出力先。指定しなければ標準出力
+        """
+        if output is None:
+            output = lambda line: print(line, flush=True)  # noqa: E731
+        self.stop_dump()
+        self.dump_stop = threading.Event()
+
+        def dump_worker(stop_event: threading.Event, output: Callable) -> None:
+            while not stop_event.wait(interval):
+                for line in self.summary():
+                    output(f"info string latency {name} {line}")
+
+        self.dump_thread = threading.Thread(
+            target=dump_worker, args=(self.dump_stop, output), daemon=True
+        )
+        self.dump_thread.start()
+
+    def stop_dump(self) -> None:
+        if self.dump_thread is not None:
+            self.dump_stop.set()
+            self.dump_thread = None
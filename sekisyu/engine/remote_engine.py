@@ -0,0 +1,217 @@
+import socket
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from sekisyu.engine.base_engine import BaseEngine, UsiEngineState
+from sekisyu.engine.usi_reactor import get_reactor
+
+
+def parse_remote_path(engine_path: str) -> Tuple[str, int, str]:
+    """
+    "tcp://host:port/エンジン名"を分解する
+
+    Returns:
+        tuple(str, int, str) : host, port, エンジン名
+    """
+    if not engine_path.startswith("tcp://"):
+        raise ValueError(f"invalid remote engine path {engine_path}")
+    address, _, name = engine_path[len("tcp://") :].partition("/")
+    host, _, port = address.rpartition(":")
+    if host == "" or name == "":
+        raise ValueError(f"invalid remote engine path {engine_path}")
+    return host, int(port), name
+
+
+class RemoteEngine(BaseEngine):
+    """
+    engine_hostで貸し出されているエンジンにTCPで接続するエンジン
+
+    engine_pathには"tcp://host:port/エンジン名"を指定する。
+    接続が切れた場合は再接続し、探索中だったならpositionとgoを送りなおす
+    """
+
+    def __init__(
+        self,
+        engine_name: str = "",
+        reconnect_retry: int = 5,
+        reconnect_interval: float = 1.0,
+        connect_timeout: float = 30.0,
+        token: Optional[str] = None,
+    ) -> None:
+        super().__init__(engine_name)
+        # engine_hostに設定した共有のtoken
+        self.token = token
+        self.encoding = "utf-8"
+        self.sock: Optional[socket.socket] = None
+        self.reconnect_retry = reconnect_retry
+        self.reconnect_interval = reconnect_interval
+        self.connect_timeout = connect_timeout
+        # quitを送った後の切断は再接続しない
+        self.quitting = False
+        # 再接続時に送りなおすgo
+        self.last_go_cmd: Optional[str] = None
+        # 最後の接続でエンジンを使い回したか
+        self.reused = False
+        # 切断中に送れなかった行。再接続後に送る
+        self.unsent: List[str] = []
+        # 接続中ならset。読み書きスレッドを使う場合の再接続待ちに使う
+        self.connected_event = threading.Event()
+
+    def connect(self) -> socket.socket:
+        """
+        エージェントに接続してエンジンを借りる
+        """
+        host, port, name = parse_remote_path(self.engine_path)
+        sock = socket.create_connection((host, port), timeout=self.connect_timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        attach_cmd = f"attach {name}"
+        if self.token is not None:
+            attach_cmd += f" {self.token}"
+        sock.sendall(f"{attach_cmd}\n".encode("utf-8"))
+        # 返答の1行だけはここで読む。それ以降のデータは読みすぎないよう1byteずつ
+        reply = b""
+        while not reply.endswith(b"\n"):
+            data = sock.recv(1)
+            if not data:
+                break
+            reply += data
+        tokens = reply.decode("utf-8", errors="ignore").split()
+        if len(tokens) < 2 or tokens[0] != "attached":
+            sock.close()
+            raise ConnectionError(f"failed to attach {self.engine_path} : {reply!r}")
+        self.reused = tokens[1] == "reused"
+        sock.settimeout(None)
+        return sock
+
+    def open_process(self) -> None:
+        self.engine_fullpath = self.engine_path
+        self.quitting = False
+        self.last_go_cmd = None
+        self.unsent = []
+        try:
+            self.sock = self.connect()
+        except (OSError, ValueError):
+            self.change_state(UsiEngineState.Disconnected)
+            self.exit_state = "Connection Error"
+            raise
+        self.connected_event.set()
+
+    def close_process(self) -> None:
+        self.connected_event.clear()
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+
+    def process_exited(self) -> bool:
+        return self.sock is None
+
+    def is_connected(self) -> bool:
+        return self.sock is not None
+
+    def quit(self) -> None:
+        self.quitting = True
+        super().quit()
+
+    def get_read_fd(self) -> int:
+        assert self.sock is not None
+        return self.sock.fileno()
+
+    def read_chunk(self) -> bytes:
+        assert self.sock is not None
+        return self.sock.recv(65536)
+
+    def write_line(self, message: str) -> None:
+        if self.sock is None and not self.quitting and not self.use_reactor:
+            # 書き込みスレッドは再接続が終わるまで待つ
+            self.connected_event.wait(
+                self.reconnect_retry * self.reconnect_interval + self.connect_timeout
+            )
+        sock = self.sock
+        if sock is None:
+            raise OSError(f"not connected to {self.engine_path}")
+        try:
+            sock.sendall((message + "\n").encode(self.encoding))
+        except OSError:
+            if self.quitting:
+                raise
+            # 切断は読み込み側で検出して再接続するので、送れなかった行は取っておく
+            self.unsent.append(message)
+
+    def before_send_command(self, message: str, token: str) -> bool:
+        if token == "go":
+            self.last_go_cmd = message
+        return super().before_send_command(message, token)
+
+    # エンジンとのやりとりを行うスレッド(read方向)。reactorを使わない場合
+    def read_worker(self) -> None:
+        while True:
+            try:
+                chunk = self.read_chunk()
+            except (OSError, AssertionError):
+                chunk = b""
+            if not chunk:
+                break
+            self.feed(chunk)
+        self.on_transport_closed()
+
+    def on_transport_closed(self) -> None:
+        if self.quitting or self.reconnect_retry <= 0:
+            super().on_transport_closed()
+            return
+        # reactorのスレッドを止めないよう再接続は別スレッドで行う
+        self.reactor_registered = False
+        threading.Thread(target=self.reconnect_worker, daemon=True).start()
+
+    def reconnect_worker(self) -> None:
+        """
+        エージェントに再接続する。失敗し続けたらエンジンが落ちたものとして扱う
+        """
+        self.close_process()
+        for _ in range(self.reconnect_retry):
+            time.sleep(self.reconnect_interval)
+            if self.quitting:
+                break
+            try:
+                sock = self.connect()
+            except (OSError, ValueError):
+                continue
+            print(f"info string reconnected to {self.engine_path}", flush=True)
+            self.sock = sock
+            self.read_buffer = b""
+            self.resume_after_reconnect()
+            return
+        super().on_transport_closed()
+
+    def resume_after_reconnect(self) -> None:
+        """
+        再接続後にオプションを送りなおし、探索中だったならgoを送りなおす
+        """
+        searching = self.engine_state == UsiEngineState.WaitBestmove
+        unsent, self.unsent = self.unsent, []
+        # 送信キューに残っているコマンドより先に送る
+        for option in self.options:
+            self.write_line("setoption name {0} value {1}".format(option[0], option[1]))
+        if (
+            searching
+            and self.last_go_cmd is not None
+            and (self.last_go_cmd not in unsent)
+        ):
+            # エージェントは切断時にstopを送っているので、改めて同じ探索をさせる
+            self.think_result.infos = []
+            self.reset_info_slots()
+            self.write_line(self.position)
+            self.write_line(self.last_go_cmd)
+        for message in unsent:
+            self.write_line(message)
+        self.connected_event.set()
+        if self.use_reactor:
+            self.reactor_registered = True
+            get_reactor().register(self)
+            get_reactor().request_send(self)
+        else:
+            self.read_thread = threading.Thread(target=self.read_worker)
+            self.read_thread.start()
@@ -0,0 +1,134 @@
+import os
+import selectors
+import threading
+from typing import TYPE_CHECKING, List, Optional, Set
+
+if TYPE_CHECKING:
+    from sekisyu.engine.base_engine import BaseEngine
+
+"""
+全エンジンのパイプを1本のスレッドで捌くselectorループ
+
+エンジン毎に読み書きスレッドを立てると、合議やリレーのように子エンジンが多い構成では
+state_changed_cvの通知でスレッドが一斉に起きてbestmoveの遅延になるのでこちらを使う。
+windowsのパイプはselectに対応していないのでposix専用
+"""
+
+
+class UsiReactor:
+    """
+    プロセス内の全エンジンの標準出力の読み込みと、キューに積まれたコマンドの書き込みを行う
+    """
+
+    def __init__(self) -> None:
+        self.selector = selectors.DefaultSelector()
+        self.lock = threading.Lock()
+        # 他スレッドからselect()を起こすためのパイプ
+        self.wake_read, self.wake_write = os.pipe()
+        os.set_blocking(self.wake_read, False)
+        os.set_blocking(self.wake_write, False)
+        self.selector.register(self.wake_read, selectors.EVENT_READ, None)
+
+        # selectorの操作はループのスレッドでしか行わないので、登録要求は一旦ここに積む
+        self.engines_to_register: List["BaseEngine"] = []
+        # 送信キューを確認するべきエンジン
+        self.engines_to_send: Set["BaseEngine"] = set()
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def in_reactor_thread(self) -> bool:
+        return threading.current_thread() is self.thread
+
+    def wake(self) -> None:
+        try:
+            os.write(self.wake_write, b"\0")
+        except BlockingIOError:
+            # 既に起こすためのデータが溜まっている
+            pass
+
+    def register(self, engine: "BaseEngine") -> None:
+        """
+        エンジンを監視対象に加える
+        """
+        with self.lock:
+            self.engines_to_register.append(engine)
+            self.engines_to_send.add(engine)
+        self.wake()
+
+    def request_send(self, engine: "BaseEngine") -> None:
+        """
+        エンジンの送信キューを確認するよう要求する
+        """
+        with self.lock:
+            self.engines_to_send.add(engine)
+        if not self.in_reactor_thread():
+            self.wake()
+
+    def run(self) -> None:
+        while True:
+            # ループ内で送信要求が積まれていたら待たずに処理する
+            with self.lock:
+                timeout = 0 if self.engines_to_send else None
+            for key, _ in self.selector.select(timeout):
+                engine: Optional["BaseEngine"] = key.data
+                if engine is None:
+                    try:
+                        while os.read(self.wake_read, 4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    continue
+                try:
+                    chunk = engine.read_chunk()
+                except OSError:
+                    chunk = b""
+                if not chunk:
+                    self.selector.unregister(key.fileobj)
+                    engine.on_transport_closed()
+                    continue
+                try:
+                    engine.feed(chunk)
+                except Exception as e:
+                    print(f"info string reactor error {engine.get_name()} {e}")
+                # 受信によって状態が変わり、送れるようになったコマンドがあるかもしれない
+                with self.lock:
+                    self.engines_to_send.add(engine)
+
+            with self.lock:
+                engines_to_register = self.engines_to_register
+                self.engines_to_register = []
+                engines_to_send = self.engines_to_send
+                self.engines_to_send = set()
+            for engine in engines_to_register:
+                try:
+                    self.selector.register(
+                        engine.get_read_fd(), selectors.EVENT_READ, engine
+                    )
+                except (KeyError, ValueError, OSError) as e:
+                    # 閉じた、あるいは登録済のfdを渡されても他のエンジンの通信は止めない
+                    print(f"info string reactor register error {engine.get_name()} {e}")
+                    engine.dead = True
+                    engine.on_transport_closed()
+            for engine in engines_to_send:
+                try:
+                    engine.pump_send_queue()
+                except Exception as e:
+                    # 1つのエンジンの不調で全エンジンの通信を止めない
+                    print(f"info string reactor error {engine.get_name()} {e}")
+                    engine.dead = True
+
+
+reactor: Optional[UsiReactor] = None
+reactor_lock = threading.Lock()
+
+
+def get_reactor() -> UsiReactor:
+    """
+    プロセスで共有するreactorを返す。初回呼び出し時にスレッドを立てる
+    """
+    global reactor
+    with reactor_lock:
+        if reactor is None:
+            reactor = UsiReactor()
+        return reactor
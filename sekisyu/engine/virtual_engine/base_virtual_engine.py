@@ -1,6 +1,7 @@
 from typing import List, Optional, Tuple
 
 from sekisyu.engine.base_engine import BaseEngine, UsiEngineState
+from sekisyu.engine.latency import LatencyRecorder
 from sekisyu.playout.playinfo import BasePlayInfoPack
 
 
@@ -19,6 +20,8 @@ class BaseVirtualEngine(BaseEngine):
         self.dead = False
         self.engine = engine
         self.engine_name = engine_name
+        # 子エンジンの計測はself.engine.latencyにある
+        self.latency = LatencyRecorder()
 
     def get_name(self) -> str:
         """
@@ -44,7 +47,8 @@ class BaseVirtualEngine(BaseEngine):
         """
         isreadyコマンドを送り、readyokを待つ
         """
-        self.engine.send_isready_and_wait()
+        with self.latency.measure("isready"):
+            self.engine.send_isready_and_wait()
 
     def set_print_info(self, print_info: bool) -> None:
         """
@@ -75,6 +79,12 @@ class BaseVirtualEngine(BaseEngine):
     def is_connected(self) -> bool:
         return self.engine.is_connected()
 
+    def is_dead(self) -> bool:
+        """
+        元となるエンジンのプロセスが落ちているか
+        """
+        return self.engine.is_dead()
+
     def quit(self) -> None:
         """
         エンジンにquitコマンドを送る
@@ -175,3 +185,6 @@ class BaseVirtualEngine(BaseEngine):
 
     def wait_for_state(self, state: UsiEngineState) -> None:
         self.engine.wait_for_state(state)
+
+    def wait_for_bestmove(self) -> None:
+        self.engine.wait_for_bestmove()
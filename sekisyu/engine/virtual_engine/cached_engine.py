@@ -0,0 +1,79 @@
+from typing import Optional
+
+from sekisyu.engine.analysis_cache import (
+    DEFAULT_HISTORY_PLIES,
+    AnalysisCache,
+    make_cache_key,
+)
+from sekisyu.engine.base_engine import BaseEngine
+from sekisyu.engine.virtual_engine.base_virtual_engine import BaseVirtualEngine
+from sekisyu.playout.playinfo import BasePlayInfoPack
+
+
+class CachedEngine(BaseVirtualEngine):
+    """
+    send_go_and_waitの結果をAnalysisCacheに保存し、同じ局面、同じ条件の解析を省略するエンジン
+
+    send_commandで送られたgoなど、対局中の通常の思考はそのまま元のエンジンに渡す。
+    千日手が絡む局面で別の手順の結果を使わないよう、キーには直近の指し手も含める(analysis_cacheを参照)
+    """
+
+    def __init__(
+        self,
+        engine: BaseEngine,
+        cache: AnalysisCache,
+        engine_name: str = "",
+        history_plies: int = DEFAULT_HISTORY_PLIES,
+    ) -> None:
+        """
+        engine (BaseEngine) :
+            元となるエンジン
+
+        cache (AnalysisCache) :
+            解析結果の保存先。複数のエンジンで共有してもよい
+
+        history_plies (int) :
+            キーに含める直近の指し手の最大数。0なら手順の違う同じ局面で結果を使い回すが、
+            千日手で最善手が変わる局面でも同じ結果を返す
+        """
+        super().__init__(engine, engine_name)
+        self.cache = cache
+        self.history_plies = history_plies
+        self.position = "position startpos"
+        self.think_result = BasePlayInfoPack()
+
+    def get_cache_key(self, go_cmd: str) -> Optional[str]:
+        """
+        現在の局面とgo_cmdに対するキャッシュのキーを返す。
+        ponder, infiniteなど結果が定まらないgoはキャッシュしないのでNone
+        """
+        tokens = go_cmd.split()
+        if "ponder" in tokens or "infinite" in tokens:
+            return None
+        return make_cache_key(
+            self.position,
+            go_cmd,
+            self.engine.get_name(),
+            self.engine.get_option(),
+            self.history_plies,
+        )
+
+    def send_go_and_wait(self, go_cmd: str) -> BasePlayInfoPack:
+        """
+        キャッシュにあればそれを返し、なければ元のエンジンで解析して保存する
+
+        go_cmd (str):
+            送られるgoコマンド。ex "go byoyomi 1000"
+        """
+        key = self.get_cache_key(go_cmd)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.think_result = cached
+                return cached
+        with self.latency.measure("go_bestmove"):
+            think_result = self.engine.send_go_and_wait(go_cmd)
+        if key is not None and not self.engine.is_dead():
+            self.cache.put(key, think_result)
+        self.think_result = think_result
+        return think_result
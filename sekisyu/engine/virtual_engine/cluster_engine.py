@@ -0,0 +1,277 @@
+import dataclasses
+from typing import List, Optional, Tuple
+
+from sekisyu.board.get_board_from_pos_cmd import get_board_from_pos_cmd
+from sekisyu.engine.base_engine import BaseEngine, UsiEngineState
+from sekisyu.engine.latency import LatencyRecorder
+from sekisyu.engine.virtual_engine.base_virtual_engine import BaseVirtualEngine
+from sekisyu.engine.yaneuraou_engine import YaneuraOuEngine
+from sekisyu.playout.playinfo import BasePlayInfoPack
+
+
+class ClusterEngine(BaseVirtualEngine):
+    """
+    ルート局面の合法手を複数のエンジンに分けて探索させるクラスタエンジン
+
+    合法手をエンジンの数で分け、それぞれのエンジンに go ... searchmoves で担当の指し手だけを読ませる。
+    各エンジンの読み筋を評価値順に並べ直したものを1つの結果とする。
+    remoteのエンジンを使えば別のマシンのエンジンにも分けられる
+    """
+
+    def __init__(
+        self,
+        engines: List[BaseEngine],
+        engine_name: str,
+        use_engine_moves: bool = False,
+    ) -> None:
+        """
+        エンジンの初期化
+
+        engines (list(BaseEngine)) :
+            探索を分担するエンジン。同じエンジン、同じ評価関数であること
+
+        use_engine_moves (bool) :
+            Trueならengines[0]がやねうら王の場合、合法手の生成にmovesコマンドを使う。
+            Falseならpython-shogiで生成する
+        """
+        self.engines = engines
+        self.engine_name = engine_name
+        self.use_engine_moves = use_engine_moves
+        self.print_info = True
+        self.latency = LatencyRecorder()
+        self.position = "position startpos"
+        # 現在のgoで探索しているエンジン
+        self.active_engines: List[BaseEngine] = [self.engines[0]]
+
+    def get_name(self) -> str:
+        """
+        エンジン名を取得する
+
+        Returns:
+            str: エンジン名
+        """
+        if self.engine_name == "":
+            return "cluster_engine"
+        return self.engine_name
+
+    def boot_cluster(self, engine_path: List[str]) -> None:
+        """
+        エンジンを起動する
+
+        engine_path (str):
+            起動するエンジンのパス
+        """
+        for engine, path in zip(self.engines, engine_path):
+            engine.boot(path)
+
+    def boot(self, engine_path: str) -> None:
+        raise NotImplementedError
+
+    def send_isready_and_wait(self) -> None:
+        """
+        isreadyコマンドを送り、readyokを待つ
+        """
+        with self.latency.measure("isready"):
+            for engine in self.engines:
+                engine.send_isready_and_wait()
+
+    def quit(self) -> None:
+        """
+        エンジンにquitコマンドを送る
+        """
+        for engine in self.engines:
+            engine.quit()
+
+    def set_print_info(self, print_info: bool) -> None:
+        """
+        エンジンのログ出力に関する設定を行う。
+        Trueにすることでエンジンからの標準出力のうちinfoから始まるものが出力される
+
+        print_info(bool):
+            Trueにすることでエンジンからの標準出力のうちinfoから始まるものが出力される
+        """
+        self.print_info = print_info
+        for engine in self.engines:
+            engine.set_print_info(print_info)
+
+    def get_state(self) -> Optional[UsiEngineState]:
+        """
+        現在のエンジンの状況を出力する
+        """
+        return self.active_engines[0].get_state()
+
+    def get_usi_option(self) -> List[str]:
+        """
+        usiコマンドで出力するべきオプションを列挙する。全てのエンジンに同じオプションを送るのでengines[0]のもの
+
+        return:
+            list(str) : 標準出力されるべきstrのリスト
+        """
+        return self.engines[0].get_usi_option()
+
+    # エンジンのconnect()が呼び出されたあとであるか
+    def is_connected(self) -> bool:
+        for engine in self.engines:
+            if not engine.is_connected():
+                return False
+        return True
+
+    def is_dead(self) -> bool:
+        """
+        どれか1つでもエンジンのプロセスが落ちているか
+        """
+        return any(engine.is_dead() for engine in self.engines)
+
+    def set_option(self, options: List[Tuple[str, str]]) -> None:
+        """
+        全てのエンジンに同じオプションを送る
+
+        options list((str, str)):
+            USIプロトコルによってオプションを設定する
+            setoption name options[i][0] value options[i][1]
+        """
+        for engine in self.engines:
+            engine.set_option(options)
+
+    def get_option(self) -> List[Tuple[str, str]]:
+        """
+        エンジンのオプションを返す
+
+        Returns:
+            list((str, str)) : オプション一覧
+        """
+        return self.engines[0].get_option()
+
+    def get_root_moves(self) -> List[str]:
+        """
+        現在の局面の合法手
+        """
+        if self.use_engine_moves and isinstance(self.engines[0], YaneuraOuEngine):
+            return self.engines[0].get_moves().split()
+        board = get_board_from_pos_cmd(self.position)
+        return [move.usi() for move in board.legal_moves]
+
+    def split_moves(self, moves: List[str]) -> List[List[str]]:
+        """
+        合法手をエンジン毎に分ける。手の並びに偏りがあっても均等になるように1手ずつ順番に配る。
+        合法手がエンジンより少ない場合は余ったエンジンを使わない
+        """
+        num = min(len(self.engines), len(moves))
+        return [moves[i::num] for i in range(num)]
+
+    def send_go(self, go_cmd: str) -> None:
+        """
+        担当の指し手を付けたgoを各エンジンに送る
+        """
+        moves = self.get_root_moves()
+        if len(moves) <= 1:
+            # 詰んでいる、または1手しかない場合は分ける必要がない
+            self.active_engines = [self.engines[0]]
+            self.engines[0].send_command(go_cmd)
+        else:
+            splits = self.split_moves(moves)
+            self.active_engines = self.engines[: len(splits)]
+            for engine, searchmoves in zip(self.active_engines, splits):
+                # searchmovesは以降の指し手を全て読むので末尾に付ける
+                engine.send_command(f"{go_cmd} searchmoves {' '.join(searchmoves)}")
+        # send_commandは非同期なので、全てのエンジンがgoを受け取るまで待つ
+        for engine in self.active_engines:
+            engine.wait_for_state(UsiEngineState.WaitBestmove)
+
+    def send_go_and_wait(self, go_cmd: str) -> BasePlayInfoPack:
+        """
+        エンジンにgo コマンドを送り、bestmoveが帰ってくるまで待つ
+
+        go_cmd (str):
+            送られるgoコマンド。ex "go byoyomi 1000"
+        """
+        with self.latency.measure("go_bestmove"):
+            self.send_go(go_cmd)
+            self.wait_for_state(UsiEngineState.WaitCommand)
+            with self.latency.measure("parse_pv"):
+                return self.parse_pv(self.get_current_think_result())
+
+    def parse_pv(
+        self, think_result: BasePlayInfoPack, is_ponder: bool = False
+    ) -> BasePlayInfoPack:
+        """
+        まとめた読み筋の最善手をbestmoveにする
+        """
+        if len(think_result.infos) == 0:
+            return think_result
+        think_result.bestmove = think_result.infos[0].pv[0]
+        think_result.ponder = ""
+        if len(think_result.infos[0].pv) > 1:
+            think_result.ponder = think_result.infos[0].pv[1]
+        if self.print_info:
+            print(think_result.infos[0].get_usi_str())
+        return think_result
+
+    def send_command(self, cmd: str) -> None:
+        """
+        エンジンに特別なコマンドを送る。
+        positionなどは全てのエンジンに、goは担当の指し手を付けて送る
+        """
+        if cmd == "gameover" or cmd == "usinewgame":
+            self.reflesh_game()
+        if cmd.startswith("setoption"):
+            option = cmd.split(" ")
+            if len(option) > 4:
+                self.set_option([(option[2], " ".join(option[4:]))])
+            else:
+                self.set_option([(option[2], "")])
+            return
+        if cmd.startswith("position"):
+            self.position = cmd
+        if cmd.startswith("go"):
+            self.send_go(cmd)
+        elif cmd.startswith("stop") or cmd.startswith("ponderhit"):
+            for engine in self.active_engines:
+                engine.send_command(cmd)
+        else:
+            for engine in self.engines:
+                engine.send_command(cmd)
+
+    def reflesh_game(self) -> None:
+        for engine in self.engines:
+            engine.reflesh_game()
+
+    def wait_for_state(self, state: UsiEngineState) -> None:
+        for engine in self.active_engines:
+            engine.wait_for_state(state)
+
+    def wait_for_bestmove(self) -> None:
+        for engine in self.active_engines:
+            engine.wait_for_bestmove()
+
+    def get_current_think_result(self) -> BasePlayInfoPack:
+        """
+        各エンジンの読み筋を評価値順に並べてまとめる
+        """
+        results = [engine.get_current_think_result() for engine in self.active_engines]
+        output = BasePlayInfoPack(
+            elapsed=max(result.elapsed for result in results),
+            bestmove=results[0].bestmove,
+            ponder=results[0].ponder,
+        )
+        used = set()
+        infos = [info for result in results for info in result.infos if info.pv]
+        # 同じ評価値なら先に並んでいる(各エンジン内で上位の)ものを優先する
+        for info in sorted(infos, key=lambda info: -int(info.eval)):
+            if info.pv[0] in used:
+                continue
+            used.add(info.pv[0])
+            output.infos.append(
+                dataclasses.replace(info, multipv=len(output.infos) + 1)
+            )
+        if self.print_info and len(self.active_engines) > 1:
+            best = [
+                f"{result.infos[0].pv[0]}:{int(result.infos[0].eval)}"
+                for result in results
+                if len(result.infos) > 0 and result.infos[0].pv
+            ]
+            nodes = sum(
+                result.infos[0].nodes for result in results if len(result.infos) > 0
+            )
+            print(f"info string cluster best {' '.join(best)} nodes {nodes}")
+        return output
@@ -1,6 +1,10 @@
-from typing import List, Optional, Tuple
+import concurrent.futures
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
 
 from sekisyu.engine.base_engine import BaseEngine, UsiEngineState
+from sekisyu.engine.latency import LatencyRecorder
 from sekisyu.engine.virtual_engine.base_virtual_engine import BaseVirtualEngine
 from sekisyu.ensemble.base_ensembler import BaseEnsembler
 from sekisyu.playout.playinfo import BasePlayInfoPack
@@ -8,18 +12,38 @@ from sekisyu.playout.playinfo import BasePlayInfoPack
 
 class EnsembleEngine(BaseVirtualEngine):
     def __init__(
-        self, engines: List[BaseEngine], ensembler: BaseEnsembler, engine_name: str
+        self,
+        engines: List[BaseEngine],
+        ensembler: BaseEnsembler,
+        engine_name: str,
+        stop_margin_ratio: float = 0.1,
+        stop_timeout: float = 1.0,
     ) -> None:
         """
         エンジンの初期化
 
         engine (BaseEngine) :
             元となるエンジン。合議の場合はlistになる(多分)
+
+        stop_margin_ratio (float) :
+            slaveのstopを待つ期限。byoyomiのstop_margin_ratio倍まで待ち、間に合わなければその時点の読み筋を使う
+
+        stop_timeout (float) :
+            byoyomiのないgoの場合にslaveのstopを待つ期限(秒)
         """
         self.engines = engines
         self.engine_name = engine_name
         self.ensembler = ensembler
         self.print_info = True
+        self.latency = LatencyRecorder()
+        self.stop_margin_ratio = stop_margin_ratio
+        self.stop_timeout = stop_timeout
+        self.go_cmd = ""
+        # slaveの停止待ち用。slave毎に待つスレッドは高々1つなのでslaveの数だけあれば足りる
+        self.stop_executor = ThreadPoolExecutor(max_workers=max(1, len(engines) - 1))
+        # slave毎の停止待ち。応答しないslaveを待つスレッドは前の手から残り続けるので、
+        # 終わるまでは新たに待たない(スレッドが尽きて他のslaveまでtimeoutになるのを防ぐ)
+        self.stop_futures: Dict[int, "concurrent.futures.Future[float]"] = {}
 
     def get_name(self) -> str:
         """
@@ -49,8 +73,9 @@ class EnsembleEngine(BaseVirtualEngine):
         """
         isreadyコマンドを送り、readyokを待つ
         """
-        for engine in self.engines:
-            engine.send_isready_and_wait()
+        with self.latency.measure("isready"):
+            for engine in self.engines:
+                engine.send_isready_and_wait()
 
     def quit(self) -> None:
         """
@@ -58,6 +83,7 @@ class EnsembleEngine(BaseVirtualEngine):
         """
         for engine in self.engines:
             engine.quit()
+        self.stop_executor.shutdown(wait=False)
 
     def set_print_info(self, print_info: bool) -> None:
         """
@@ -99,6 +125,12 @@ class EnsembleEngine(BaseVirtualEngine):
                 return False
         return True
 
+    def is_dead(self) -> bool:
+        """
+        どれか1つでもエンジンのプロセスが落ちているか
+        """
+        return any(engine.is_dead() for engine in self.engines)
+
     def set_option(self, options: List[Tuple[str, str]]) -> None:
         """
         エンジンにオプションを送る
@@ -149,11 +181,14 @@ class EnsembleEngine(BaseVirtualEngine):
             送られるgoコマンド。ex "go byoyomi 1000"
         """
         # dlshogiなどのponderを本来返さないものについても返す仕様にengine側で修正する
-        for engine in self.engines[1:]:
-            # idx 0 をtimekeeperとする
-            engine.send_command("go infinite")
-        result = self.engines[0].send_go_and_wait(go_cmd)
-        return self.parse_pv(result)
+        self.go_cmd = go_cmd
+        with self.latency.measure("go_bestmove"):
+            for engine in self.engines[1:]:
+                # idx 0 をtimekeeperとする
+                engine.send_command("go infinite")
+            result = self.engines[0].send_go_and_wait(go_cmd)
+            with self.latency.measure("parse_pv"):
+                return self.parse_pv(result)
 
     def parse_pv(
         self, think_result: BasePlayInfoPack, is_ponder: bool = False
@@ -163,10 +198,10 @@ class EnsembleEngine(BaseVirtualEngine):
         デフォルトでは何もしない
         """
         print("info string parse pv start")
-        # step 1 まずslaveのエンジンを全て止める
-        for engine in self.engines[1:]:
-            engine.send_command("stop")
-            engine.wait_for_state(UsiEngineState.WaitCommand)
+        # step 1 まずslaveのエンジンを全て止める。期限に間に合わなかったslaveはその時点の読み筋を使う
+        elapsed = self.stop_slaves()
+        if self.print_info:
+            print(f"info string ensemble stop {self.get_stop_time_str(elapsed)}")
 
         infos = [
             engine.parse_pv(engine.get_current_think_result())
@@ -180,6 +215,74 @@ class EnsembleEngine(BaseVirtualEngine):
             print(out.infos[0].get_usi_str())
         return out
 
+    def get_stop_timeout(self) -> float:
+        """
+        slaveのstopを待つ期限(秒)。goにbyoyomiがあればその持ち時間から決める
+        """
+        tokens = self.go_cmd.split()
+        if "byoyomi" in tokens:
+            try:
+                byoyomi = int(tokens[tokens.index("byoyomi") + 1])
+            except (IndexError, ValueError):
+                return self.stop_timeout
+            if byoyomi > 0:
+                return byoyomi / 1000 * self.stop_margin_ratio
+        return self.stop_timeout
+
+    def stop_slaves(self) -> List[Optional[float]]:
+        """
+        slaveのエンジン全てに同時にstopを送り、期限までbestmoveを待つ
+
+        Returns:
+            list(float) : slave毎の、stopを送ってから止まるまでの時間(秒)。期限に間に合わなかったslaveはNone
+        """
+        start = time.perf_counter()
+        deadline = start + self.get_stop_timeout()
+
+        def wait_stop(engine: BaseEngine) -> float:
+            engine.wait_for_state(UsiEngineState.WaitCommand)
+            return time.perf_counter() - start
+
+        for engine in self.engines[1:]:
+            engine.send_command("stop")
+        futures: List[Optional["concurrent.futures.Future[float]"]] = []
+        for i, engine in enumerate(self.engines[1:]):
+            pending = self.stop_futures.get(i)
+            if pending is not None and not pending.done():
+                # 前の手の停止をまだ待っている。このslaveはtimeoutとして扱う
+                futures.append(None)
+                continue
+            self.stop_futures[i] = self.stop_executor.submit(wait_stop, engine)
+            futures.append(self.stop_futures[i])
+        output: List[Optional[float]] = []
+        for i, future in enumerate(futures):
+            if future is None:
+                output.append(None)
+                continue
+            try:
+                elapsed: Optional[float] = future.result(
+                    timeout=max(0.0, deadline - time.perf_counter())
+                )
+            except concurrent.futures.TimeoutError:
+                elapsed = None
+            except Exception as e:
+                print(f"info string ensemble engine_{i + 1} stop failed {e}")
+                elapsed = None
+            if elapsed is not None:
+                self.latency.record(f"stop_engine_{i + 1}", elapsed)
+            output.append(elapsed)
+        return output
+
+    def get_stop_time_str(self, elapsed: List[Optional[float]]) -> str:
+        """
+        slave毎の停止までの時間をinfo string用の文字列にする。期限切れのslaveはtimeout
+        """
+        output = []
+        for i, (engine, value) in enumerate(zip(self.engines[1:], elapsed)):
+            time_str = "timeout" if value is None else f"{value * 1000:.1f}ms"
+            output.append(f"engine_{i + 1}({engine.get_name()}) {time_str}")
+        return " ".join(output)
+
     def send_command(self, cmd: str) -> None:
         """
         エンジンに特別なコマンドを送る。
@@ -195,6 +298,7 @@ class EnsembleEngine(BaseVirtualEngine):
             # TODO : optionはどのengine向けかを解析して送る
             pass
         elif cmd.startswith("go"):
+            self.go_cmd = cmd
             self.engines[0].send_command(cmd)
             for engine in self.engines[1:]:
                 # idx 0 をtimekeeperとする
@@ -218,6 +322,9 @@ class EnsembleEngine(BaseVirtualEngine):
     def wait_for_state(self, state: UsiEngineState) -> None:
         self.engines[0].wait_for_state(state)
 
+    def wait_for_bestmove(self) -> None:
+        self.engines[0].wait_for_bestmove()
+
     def get_current_think_result(self) -> BasePlayInfoPack:
         """
         現時点でのpvの様子を吐く
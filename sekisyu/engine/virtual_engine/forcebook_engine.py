@@ -1,11 +1,26 @@
 import dataclasses
-import glob
 import random
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
+import numpy as np
 import shogi
 from dacite import from_dict
+from sekisyu.board.board_feature import (
+    HAND_MAX,
+    NUM_HAND_PIECE,
+    NUM_PIECE_ID,
+    encode_board,
+    encode_boards,
+    encode_hand,
+    encode_moves,
+    hand_to_onehot,
+)
+from sekisyu.board.get_board_from_pos_cmd import copy_board
+from sekisyu.board.kif_heatmap import KifHeatmap, load_kif_heatmap
+from sekisyu.board.kif_index import KifIndex, load_kif_index, load_kif_moves
+from sekisyu.board.kif_manifest import KifManifest
 from sekisyu.engine.base_engine import BaseEngine
+from sekisyu.engine.latency import LatencyRecorder
 from sekisyu.engine.virtual_engine.base_virtual_engine import BaseVirtualEngine
 from sekisyu.playout.playinfo import BasePlayInfoPack
 from shogi import CSA, KIF, SQUARES, Consts
@@ -53,6 +68,33 @@ def similar_bonus(idx: int) -> float:
     return similar_bonus_const[idx]
 
 
+# 駒id毎、升毎の重み
+PIECE_BONUS = np.array([similar_bonus(idx) for idx in range(NUM_PIECE_ID)])
+BOARD_BONUS = np.repeat(PIECE_BONUS, 81)
+# 持ち駒の[先後][駒の種類 - 1]毎の重み
+HAND_BONUS = np.tile(np.array(similar_bonus_const[:NUM_HAND_PIECE]), (2, 1))
+HAND_BONUS_FLAT = np.repeat(HAND_BONUS.reshape(-1), HAND_MAX)
+# hand_to_onehotの各要素に対応する枚数
+HAND_COUNT_FLAT = np.tile(np.arange(1, HAND_MAX + 1), 2 * NUM_HAND_PIECE)
+
+
+def get_side_mask(black: bool, ignore_enemy: bool) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    類似度の計算に使う駒のmask。ignore_enemyなら自分の駒だけを使う
+
+    Returns:
+        tuple(np.ndarray, np.ndarray) : shape (28, 81)の盤上の駒のmask、shape (2, 7)の持ち駒のmask
+    """
+    board_mask = np.ones((NUM_PIECE_ID, 81))
+    hand_mask = np.ones((2, NUM_HAND_PIECE))
+    if ignore_enemy:
+        enemy = Consts.WHITE if black else Consts.BLACK
+        half = NUM_PIECE_ID // 2
+        board_mask[enemy * half : (enemy + 1) * half] = 0.0
+        hand_mask[enemy] = 0.0
+    return board_mask, hand_mask
+
+
 class BoardSimularityCalculator:
     """
     局面の類似度を計算する。
@@ -60,33 +102,146 @@ class BoardSimularityCalculator:
     カウントした方が計算的に得なのでそれをする
     """
 
-    def __init__(self, black_file_glob: str, white_file_glob: str) -> None:
+    def __init__(
+        self,
+        black_file_glob: str,
+        white_file_glob: str,
+        black_index_path: str = "",
+        white_index_path: str = "",
+        black_heatmap_path: str = "",
+        white_heatmap_path: str = "",
+        black_manifest_path: str = "",
+        white_manifest_path: str = "",
+    ) -> None:
+        """
+        black_index_path, white_index_path (str) :
+            kif_index.pyで作った棋譜の索引。空でなければswitch_game_by_indexで対局中に棋譜を選びなおす
+
+        black_heatmap_path, white_heatmap_path (str) :
+            kif_heatmap.pyで作った頻度表のprefix。空でなければupdate_board_from_heatmapが使える
+
+        black_manifest_path, white_manifest_path (str) :
+            棋譜ファイル一覧のキャッシュの保存先。空なら保存せず、起動時に1度だけディレクトリを読む
+        """
         self.black_file_glob = black_file_glob
         self.white_file_glob = white_file_glob
+        self.black_manifest = KifManifest(
+            black_file_glob, black_manifest_path or None, parse_header=False
+        )
+        self.white_manifest = KifManifest(
+            white_file_glob, white_manifest_path or None, parse_header=False
+        )
         self.game_to_use_black = None
         self.game_to_use_white = None
+        self.index_black: Optional[KifIndex] = load_kif_index(black_index_path)
+        self.index_white: Optional[KifIndex] = load_kif_index(white_index_path)
+        self.heatmap_black: Optional[KifHeatmap] = load_kif_heatmap(black_heatmap_path)
+        self.heatmap_white: Optional[KifHeatmap] = load_kif_heatmap(white_heatmap_path)
+        # 棋譜ファイル -> 各手数の局面をencodeしたもの。採択中の棋譜だけを持つ
+        self.game_features: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+    def get_game_features(self, file_name: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        棋譜の各局面をencodeしたものを返す。棋譜の読み込みと再生は1つの棋譜につき1度だけ行う
+
+        Returns:
+            tuple(np.ndarray, np.ndarray) : shape (手数, 28 x 81)の盤上の駒、shape (手数, 2, 7)の持ち駒。
+                i番目はi + 1手目を指した後の局面
+        """
+        if file_name not in self.game_features:
+            self.game_features[file_name] = encode_moves(load_kif_moves(file_name))
+        return self.game_features[file_name]
 
     def reflesh_game(self):
         """
         ゲームの初期化。採択する棋譜をランダムに選ぶ
         TODO : ゲームの進行に応じて最も類似度が高い棋譜を選ぶとかしたい
         """
-        if len(glob.glob(self.black_file_glob)) != 0:
-            print(
-                f"info string load kif file from {len(glob.glob(self.black_file_glob))} files"
-            )
-            self.game_to_use_black = random.choice(glob.glob(self.black_file_glob))
+        # 変化のないディレクトリは読み直さない
+        black_files = self.black_manifest.refresh()
+        white_files = self.white_manifest.refresh()
+        if len(black_files) != 0:
+            print(f"info string load kif file from {len(black_files)} files")
+            self.game_to_use_black = random.choice(black_files)
         else:
             print("info string kif file not found. possibly wrong path")
             self.game_to_use_black = None
-        if len(glob.glob(self.white_file_glob)) != 0:
-            print(
-                f"info string load kif file from {len(glob.glob(self.white_file_glob))} files"
-            )
-            self.game_to_use_white = random.choice(glob.glob(self.white_file_glob))
+        if len(white_files) != 0:
+            print(f"info string load kif file from {len(white_files)} files")
+            self.game_to_use_white = random.choice(white_files)
         else:
             print("info string kif file not found. possibly wrong path")
             self.game_to_use_white = None
+        # 選んだ棋譜はここで読み込んでおき、対局中は類似度の計算だけをする
+        self.game_features = {}
+        for file_name in [self.game_to_use_black, self.game_to_use_white]:
+            if file_name is not None:
+                self.get_game_features(file_name)
+
+    def switch_game_by_index(
+        self,
+        board: shogi.Board,
+        black: bool,
+        ignore_enemy: bool = True,
+        top_k: int = 1,
+        ply_window: int = 10,
+    ) -> None:
+        """
+        索引から現在の局面に最も似た局面を含む棋譜を探し、採択する棋譜をそれに切り替える
+
+        Args:
+            top_k (int): 類似度の高い順にtop_k個の棋譜からランダムに選ぶ
+            ply_window (int): 現在の手数の前後ply_window手の局面だけを比べる
+        """
+        index = self.index_black if black else self.index_white
+        if index is None:
+            return
+        board_mask, hand_mask = get_side_mask(black, ignore_enemy)
+        ply = board.move_number - 1
+        found = index.query(
+            board,
+            PIECE_BONUS * board_mask[:, 0],
+            HAND_BONUS * hand_mask,
+            top_k,
+            ply - ply_window,
+            ply + ply_window,
+        )
+        if len(found) == 0:
+            return
+        file_name = random.choice(found)[0]
+        if black:
+            self.game_to_use_black = file_name
+        else:
+            self.game_to_use_white = file_name
+        # 使わなくなった棋譜は捨てる
+        self.game_features = {
+            key: value
+            for key, value in self.game_features.items()
+            if key in (self.game_to_use_black, self.game_to_use_white)
+        }
+
+    def has_heatmap(self, black: bool) -> bool:
+        return (self.heatmap_black if black else self.heatmap_white) is not None
+
+    def update_board_from_heatmap(
+        self, ply: int, black: bool, ignore_enemy: bool = True
+    ) -> None:
+        """
+        棋譜集全体の駒の頻度表からboard_score, hand_scoreを作る。
+        update_board_oldで全ての棋譜の平均をとるのを、類似度の重み無しで事前に計算しておいたもの
+
+        Args:
+            ply (int): 候補手を指した後の手数
+        """
+        heatmap = self.heatmap_black if black else self.heatmap_white
+        board_freq, hand_freq = heatmap.get(ply)
+        board_mask, hand_mask = get_side_mask(black, ignore_enemy)
+        self.board_score = board_freq * PIECE_BONUS[:, None] * board_mask
+        self.hand_score = (
+            hand_freq
+            * (HAND_BONUS_FLAT * HAND_COUNT_FLAT).reshape(2 * NUM_HAND_PIECE, HAND_MAX)
+            * hand_mask.reshape(-1, 1)
+        )
 
     def update_board_old(
         self,
@@ -104,9 +259,9 @@ class BoardSimularityCalculator:
         # piece_type, 枚数を引数とする 先後 2 x コマの種類 7 x 所持数(面倒なのですべて最大18枚とする)
         self.hand_score = [[0 for i in range(18)] for j in range(14)]
         if black:
-            file_list = glob.glob(self.black_file_glob)
+            file_list = self.black_manifest.refresh()
         else:
-            file_list = glob.glob(self.white_file_glob)
+            file_list = self.white_manifest.refresh()
         for file_name in file_list:
             if file_name.endswith(".csa"):
                 csa_dat = CSA.Parser.parse_file(file_name)[0]
@@ -164,6 +319,8 @@ class BoardSimularityCalculator:
                                 * board.pieces_in_hand[c][piece_key]
                                 / len(file_list)
                             )
+        self.board_score = np.array(self.board_score)
+        self.hand_score = np.array(self.hand_score)
 
     def visualize_score(self) -> None:
         """
@@ -183,9 +340,9 @@ class BoardSimularityCalculator:
         ignore_enemy: bool = True,
     ):
         # piece_type, boardを引数とする 先後 2 x コマの種類 14
-        self.board_score = [[0 for i in range(81)] for j in range(28)]
+        self.board_score = np.zeros((NUM_PIECE_ID, 81))
         # piece_type, 枚数を引数とする 先後 2 x コマの種類 7 x 所持数(面倒なのですべて最大18枚とする)
-        self.hand_score = [[0 for i in range(18)] for j in range(14)]
+        self.hand_score = np.zeros((2 * NUM_HAND_PIECE, HAND_MAX))
 
         # 特定のプレイヤーを真似るにあたり、棋譜の平均みたいなものをとると特徴が平均化されてしまうらしい
         # 佐藤康光九段とかの棋譜がその典型で正当居飛車と力戦振り飛車が平均された結果
@@ -201,81 +358,79 @@ class BoardSimularityCalculator:
         if file_name is None:
             return
 
-        if file_name.endswith(".csa"):
-            csa_dat = CSA.Parser.parse_file(file_name)[0]
-        elif file_name.endswith(".kif"):
-            csa_dat = KIF.Parser.parse_file(file_name)[0]
-        moves = csa_dat["moves"]
-        # print(moves)
-        board = shogi.Board()
-        for i in range(min(ply_max, len(moves))):
-            board.push(shogi.Move.from_usi(moves[i]))
-            if i < ply_min:
-                continue
-            sim = self.calc_board_similarity(board, ref_board, black, ignore_enemy)
-            for sq in SQUARES:
-                p = board.piece_at(sq)
-                if p is None:
-                    continue
-                # コマの種類に応じて加点
-                pidx: int = get_piece_id(p)
-
-                if ignore_enemy and black and pidx > 13:
-                    continue
-                if ignore_enemy and not black and pidx < 14:
-                    continue
-
-                self.board_score[pidx][int(sq)] += sim * sim * similar_bonus(pidx)
-
-            # 持ち駒に応じて加点
-            for c in [Consts.BLACK, Consts.WHITE]:
-                if ignore_enemy and black and c == Consts.WHITE:
-                    continue
-                if ignore_enemy and not black and c == Consts.BLACK:
-                    continue
+        # 棋譜の各局面と類似度を求め、類似度^2で重み付けして足し合わせる
+        game_boards, game_hands = self.get_game_features(file_name)
+        game_boards = game_boards[ply_min:ply_max]
+        game_hands = game_hands[ply_min:ply_max]
+        sims = self.calc_similarity_from_features(
+            game_boards,
+            game_hands,
+            encode_board(ref_board),
+            encode_hand(ref_board),
+            black,
+            ignore_enemy,
+        )
+        weight = sims * sims
+        board_mask, hand_mask = get_side_mask(black, ignore_enemy)
+        self.board_score = (
+            (weight @ game_boards) * BOARD_BONUS * board_mask.reshape(-1)
+        ).reshape(NUM_PIECE_ID, 81)
+        # 持ち駒はsim^2 x 重み x 枚数を(駒, 枚数)の位置に足す
+        self.hand_score = (
+            (weight @ hand_to_onehot(game_hands))
+            * HAND_BONUS_FLAT
+            * HAND_COUNT_FLAT
+            * np.repeat(hand_mask.reshape(-1), HAND_MAX)
+        ).reshape(2 * NUM_HAND_PIECE, HAND_MAX)
+
+    def calc_board_scores(self, boards: List[shogi.Board]) -> np.ndarray:
+        """
+        board_scoreに応じて複数の局面のボーナス値をまとめて求める
 
-                for piece_key in board.pieces_in_hand[c]:
-                    pc = piece_key - 1
-                    if c == Consts.BLACK:
-                        self.hand_score[pc][board.pieces_in_hand[c][piece_key] - 1] += (
-                            sim
-                            * sim
-                            * similar_bonus(pc)
-                            * board.pieces_in_hand[c][piece_key]
-                        )
-                    else:
-                        self.hand_score[pc + 7][
-                            board.pieces_in_hand[c][piece_key] - 1
-                        ] += (
-                            sim
-                            * sim
-                            * similar_bonus(pc)
-                            * board.pieces_in_hand[c][piece_key]
-                        )
+        Returns:
+            np.ndarray : shape (len(boards),)のボーナス値
+        """
+        board_features, hands = encode_boards(boards)
+        return board_features @ np.asarray(self.board_score).reshape(
+            -1
+        ) + hand_to_onehot(hands) @ np.asarray(self.hand_score).reshape(-1)
 
     def calc_board_score(self, board) -> float:
         """
         board_scoreに応じて局面のボーナス値を決める
         """
-        output = 0.0
-        for sq in SQUARES:
-            p = board.piece_at(sq)
-            if p is None:
-                continue
-            pidx: int = get_piece_id(p)
-            output += self.board_score[pidx][int(sq)]
-        # 持ち駒に応じて加点。
-        for c in [Consts.BLACK, Consts.WHITE]:
-            for piece_key in board.pieces_in_hand[c]:
-                pc = piece_key - 1
-                if c == Consts.BLACK:
-                    output += self.hand_score[pc][
-                        board.pieces_in_hand[c][piece_key] - 1
-                    ]
-                else:
-                    output += self.hand_score[pc + 7][
-                        board.pieces_in_hand[c][piece_key] - 1
-                    ]
+        return float(self.calc_board_scores([board])[0])
+
+    def calc_similarity_from_features(
+        self,
+        boards: np.ndarray,
+        hands: np.ndarray,
+        ref_board: np.ndarray,
+        ref_hand: np.ndarray,
+        black: bool = True,
+        ignore_enemy: bool = True,
+    ) -> np.ndarray:
+        """
+        encodeした盤面と基準の盤面との類似度。boards, handsは先頭に局面数の次元があってもよい
+
+        Args:
+            boards (np.ndarray): encode_boardの結果。shape (..., 28 x 81)
+            hands (np.ndarray): encode_handの結果。shape (..., 2, 7)
+            ref_board (np.ndarray): 基準の盤面のencode_boardの結果
+            ref_hand (np.ndarray): 基準の盤面のencode_handの結果
+
+        Returns:
+            np.ndarray : 類似度。shape (...)
+        """
+        board_mask, hand_mask = get_side_mask(black, ignore_enemy)
+        # 同じ升に同じ駒がある場合に駒毎の重みを足す
+        output = boards @ (ref_board * BOARD_BONUS * board_mask.reshape(-1))
+        # 持ち駒は少ない方の枚数 x 重み
+        output = output + (np.minimum(hands, ref_hand) * HAND_BONUS * hand_mask).sum(
+            axis=(-2, -1)
+        )
+        if ignore_enemy:
+            return output * 2.0
         return output
 
     def calc_board_similarity(
@@ -284,38 +439,16 @@ class BoardSimularityCalculator:
         """
         盤面の類似度を計算する
         """
-        output = 0.0
-        for sq in SQUARES:
-            p = board1.piece_at(sq)
-            if p is None:
-                continue
-            p2 = board2.piece_at(sq)
-            if p2 is None:
-                continue
-            idx = get_piece_id(p)
-            if ignore_enemy and black and idx > 13:
-                continue
-            if ignore_enemy and not black and idx < 14:
-                continue
-
-            if p == p2:
-                output += similar_bonus(idx)
-
-        # 持ち駒に応じて加点。
-        for c in [Consts.BLACK, Consts.WHITE]:
-            if ignore_enemy and black and c == Consts.WHITE:
-                continue
-            if ignore_enemy and not black and c == Consts.BLACK:
-                continue
-            for piece_key in board1.pieces_in_hand[c]:
-                pc = piece_key - 1
-                output += similar_bonus(pc) * min(
-                    board1.pieces_in_hand[c][piece_key],
-                    board2.pieces_in_hand[c][piece_key],
-                )
-        if ignore_enemy:
-            return output * 2.0
-        return output
+        return float(
+            self.calc_similarity_from_features(
+                encode_board(board1),
+                encode_hand(board1),
+                encode_board(board2),
+                encode_hand(board2),
+                black,
+                ignore_enemy,
+            )
+        )
 
 
 @dataclasses.dataclass
@@ -337,6 +470,20 @@ class ConfigForceEngine:
     # 類似度計算のときに相手の盤面を考慮する
     ignore_enemy: bool = True
 
+    # 棋譜の索引(kif_index.pyで作る)。指定すると毎手、現在の局面に最も似た棋譜に切り替える
+    kif_index_black: str = ""
+    kif_index_white: str = ""
+    # 類似度の高い順にindex_top_k個の棋譜からランダムに選ぶ
+    index_top_k: int = 1
+    # 現在の手数の前後index_ply_window手の局面と比べる
+    index_ply_window: int = 10
+    # 棋譜集の駒の頻度表(kif_heatmap.pyで作る)のprefix。指定すると棋譜を選ばず、頻度表のボーナスを使う
+    heatmap_black: str = ""
+    heatmap_white: str = ""
+    # 棋譜ファイル一覧のキャッシュ(json)の保存先。指定すると次回の起動時に変化のないディレクトリを読まない
+    kif_manifest_black: str = ""
+    kif_manifest_white: str = ""
+
     # 許容できる評価値の下限
     min_score: int = -300
     # forcebook中のMultiPV
@@ -410,11 +557,22 @@ class ForceBookEngine(BaseVirtualEngine):
         )
 
         # print(self.engine_name, "level", self.config.level)
-        self.bn = BoardSimularityCalculator(
-            self.config.kif_file_black, self.config.kif_file_white
-        )
+        self.bn = self.create_calculator()
         self.engine.change_multipv(self.config.forcebook_mutipv)
         self.pv_changed = False
+        self.latency = LatencyRecorder()
+
+    def create_calculator(self) -> BoardSimularityCalculator:
+        return BoardSimularityCalculator(
+            self.config.kif_file_black,
+            self.config.kif_file_white,
+            self.config.kif_index_black,
+            self.config.kif_index_white,
+            self.config.heatmap_black,
+            self.config.heatmap_white,
+            self.config.kif_manifest_black,
+            self.config.kif_manifest_white,
+        )
 
     def boot(self, engine_path: str) -> None:
         """
@@ -438,6 +596,10 @@ class ForceBookEngine(BaseVirtualEngine):
         # 棋風のデータ
         opt_list.append("option name KifBlack type string default kif/black/*")
         opt_list.append("option name KifWhite type string default kif/white/*")
+        opt_list.append("option name KifIndexBlack type string default <empty>")
+        opt_list.append("option name KifIndexWhite type string default <empty>")
+        opt_list.append("option name HeatmapBlack type string default <empty>")
+        opt_list.append("option name HeatmapWhite type string default <empty>")
         opt_list.append("option name MPVBook type spin default 30 min 1 max 800")
         opt_list.append("option name MPVMoves type spin default 16 min 1 max 300")
         opt_list.append("option name MPVStrength type spin default 500 min 0 max 10000")
@@ -472,14 +634,22 @@ class ForceBookEngine(BaseVirtualEngine):
                 self.config.node_range = int(opt[1])
             if opt[0] == "KifBlack":
                 self.config.kif_file_black = opt[1]
-                self.bn = BoardSimularityCalculator(
-                    self.config.kif_file_black, self.config.kif_file_white
-                )
+                self.bn = self.create_calculator()
             elif opt[0] == "KifWhite":
                 self.config.kif_file_white = opt[1]
-                self.bn = BoardSimularityCalculator(
-                    self.config.kif_file_black, self.config.kif_file_white
-                )
+                self.bn = self.create_calculator()
+            elif opt[0] == "KifIndexBlack":
+                self.config.kif_index_black = opt[1]
+                self.bn = self.create_calculator()
+            elif opt[0] == "KifIndexWhite":
+                self.config.kif_index_white = opt[1]
+                self.bn = self.create_calculator()
+            elif opt[0] == "HeatmapBlack":
+                self.config.heatmap_black = opt[1]
+                self.bn = self.create_calculator()
+            elif opt[0] == "HeatmapWhite":
+                self.config.heatmap_white = opt[1]
+                self.bn = self.create_calculator()
             elif opt[0] == "MPVBook":
                 self.config.forcebook_mutipv = int(opt[1])
             elif opt[0] == "MPVMoves":
@@ -528,16 +698,30 @@ class ForceBookEngine(BaseVirtualEngine):
 
     def change_result_by_forcebook(self, board, think_result):
 
-        self.bn.update_board(
-            self.config.ply_min,
-            self.config.ply_max,
-            board.turn == Consts.BLACK,
-            board,
-            self.config.ignore_enemy,
-        )
+        black = board.turn == Consts.BLACK
+        if self.bn.has_heatmap(black):
+            # 候補手を指した後の手数の頻度表を使う
+            self.bn.update_board_from_heatmap(
+                board.move_number, black, self.config.ignore_enemy
+            )
+        else:
+            self.bn.switch_game_by_index(
+                board,
+                black,
+                self.config.ignore_enemy,
+                self.config.index_top_k,
+                self.config.index_ply_window,
+            )
+            self.bn.update_board(
+                self.config.ply_min,
+                self.config.ply_max,
+                black,
+                board,
+                self.config.ignore_enemy,
+            )
         # 類似度ベースの盤面ボーナスを計算する
-        max_score = -float("inf")
-        max_id = 0
+        candidate_ids = []
+        candidate_boards = []
         for i, candidate in enumerate(think_result.infos):
             # 悪すぎる手は除去する
             if (
@@ -550,9 +734,17 @@ class ForceBookEngine(BaseVirtualEngine):
                 and think_result.infos[0].eval - candidate.eval > self.config.loss_limit
             ):
                 continue
-
             board.push(shogi.Move.from_usi(candidate.pv[0]))
-            bonus = self.bn.calc_board_score(board)
+            candidate_ids.append(i)
+            candidate_boards.append(copy_board(board))
+            board.pop()
+
+        # 候補手のボーナスはまとめて計算する
+        bonuses = self.bn.calc_board_scores(candidate_boards)
+        max_score = -float("inf")
+        max_id = 0
+        for i, bonus in zip(candidate_ids, bonuses):
+            candidate = think_result.infos[i]
             value = (
                 candidate.eval
                 + bonus * self.config.bonus_amp
@@ -562,7 +754,6 @@ class ForceBookEngine(BaseVirtualEngine):
             if value > max_score:
                 max_id = i
                 max_score = value
-            board.pop()
         think_result.bestmove = think_result.infos[max_id].pv[0]
         print(f"info string max_id changed to {max_id}")
         # print(think_result.infos[max_id].pv[0])
@@ -677,9 +868,11 @@ class ForceBookEngine(BaseVirtualEngine):
         go_cmd (str):
             送られるgoコマンド。ex "go byoyomi 1000"
         """
-        go_cmd_use = self.before_go_cmd(go_cmd)
-        think_result = self.engine.send_go_and_wait(go_cmd_use)
-        return self.parse_pv(think_result, "ponder" in go_cmd)
+        with self.latency.measure("go_bestmove"):
+            go_cmd_use = self.before_go_cmd(go_cmd)
+            think_result = self.engine.send_go_and_wait(go_cmd_use)
+            with self.latency.measure("parse_pv"):
+                return self.parse_pv(think_result, "ponder" in go_cmd)
 
 
 if __name__ == "__main__":
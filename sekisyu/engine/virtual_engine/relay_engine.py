@@ -1,35 +1,166 @@
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import List, Optional, Tuple
 
+import shogi
+from sekisyu.board.get_board_from_pos_cmd import get_board_from_pos_cmd
 from sekisyu.engine.base_engine import BaseEngine, UsiEngineState
+from sekisyu.engine.latency import LatencyRecorder
 from sekisyu.engine.virtual_engine.base_virtual_engine import BaseVirtualEngine
 from sekisyu.playout.playinfo import BasePlayInfoPack
 
 
 class RelayEngine(BaseVirtualEngine):
     def __init__(
-        self, engines: List[BaseEngine], ply_to_pass: List[int], engine_name: str
+        self,
+        engines: List[BaseEngine],
+        ply_to_pass: List[int],
+        engine_name: str,
+        prefetch_plies: int = 0,
     ) -> None:
         """
         エンジンの初期化
 
         engine (BaseEngine) :
             元となるエンジン。リレーを担当するエンジンたち
+
+        prefetch_plies (int) :
+            交代のprefetch_plies手前から、次のエンジンにも同じ局面をgo infiniteで読ませてハッシュを温めておく。
+            0なら何もしない。交代時に止めるまでにかかった時間は最初のgoの持ち時間から引く。
+            先読みの間は対局中のエンジンとCPUを取り合うので、並んで動いた時間をprefetch_overlapに記録する。
+            取り合いを減らしたい場合は各エンジンのconfigでThreadsを合計がコア数に収まるように決めておく
+            (やねうら王などはThreadsを変えると置換表を確保しなおして消すので、対局中には変えない)
         """
         self.engines = engines
         self.engine_name = engine_name
         self.ply_to_pass = ply_to_pass
         self.print_info = True
+        self.latency = LatencyRecorder()
         assert len(self.ply_to_pass) + 1 == len(self.engines)
         self.engine_to_use = self.engines[0]
-
-    def get_engine_to_use(self, pos_cmd: str) -> BaseEngine:
+        self.position = "position startpos"
+        self.prefetch_plies = prefetch_plies
+        # 先読みを始めた時刻。対局中のエンジンと並んで動いていた時間の記録に使う
+        self.prefetch_start: Optional[float] = None
+        # 最後に止めた先読みが対局中のエンジンと並んで動いていた時間(秒)
+        self.prefetch_overlap = 0.0
+        # 先読みさせているエンジン
+        self.prefetch_engine: Optional[BaseEngine] = None
+        # 先読みのstop, goの順番を守るため1スレッドで送る
+        self.prefetch_executor = ThreadPoolExecutor(max_workers=1)
+        self.prefetch_future: Optional[Future] = None
+        # 交代時に先読みを止めるのにかかった時間(ms)。次のgoの持ち時間から引く
+        self.handoff_cost = 0
+
+    def get_ply(self, pos_cmd: str) -> int:
         ply = 0
         if "moves" in pos_cmd:
             ply = len(pos_cmd.split(" ")) - 2
+        return ply
+
+    def get_engine_idx(self, pos_cmd: str) -> int:
+        ply = self.get_ply(pos_cmd)
         for i in range(len(self.ply_to_pass)):
             if self.ply_to_pass[i] > ply:
-                return self.engines[i]
-        return self.engines[-1]
+                return i
+        return len(self.engines) - 1
+
+    def get_engine_to_use(self, pos_cmd: str) -> BaseEngine:
+        return self.engines[self.get_engine_idx(pos_cmd)]
+
+    def get_engine_to_prefetch(self, pos_cmd: str) -> Optional[BaseEngine]:
+        """
+        交代のprefetch_plies手前に入っていれば次のエンジン、そうでなければNone
+        """
+        if self.prefetch_plies <= 0:
+            return None
+        idx = self.get_engine_idx(pos_cmd)
+        if idx >= len(self.ply_to_pass):
+            return None
+        if self.get_ply(pos_cmd) < self.ply_to_pass[idx] - self.prefetch_plies:
+            return None
+        return self.engines[idx + 1]
+
+    def start_prefetch(self) -> None:
+        """
+        次のエンジンに現在の局面をgo infiniteで読ませる。読んでいる途中なら止めてから今の局面を読ませる
+        """
+        engine = self.get_engine_to_prefetch(self.position)
+        if engine is None:
+            return
+        # 先読みの読み筋は使わないので出力しない
+        engine.set_print_info(False)
+        if self.prefetch_engine is not engine:
+            self.prefetch_start = time.perf_counter()
+        self.prefetch_engine = engine
+        position = self.position
+
+        def restart() -> None:
+            engine.send_command("stop")
+            engine.wait_for_state(UsiEngineState.WaitCommand)
+            engine.send_command(position)
+            engine.send_command("go infinite")
+            engine.wait_for_state(UsiEngineState.WaitBestmove)
+
+        self.prefetch_future = self.prefetch_executor.submit(restart)
+
+    def stop_prefetch(self) -> float:
+        """
+        先読みを止めて、止まるまで待つ
+
+        Returns:
+            float : 止まるまでにかかった時間(ms)
+        """
+        engine = self.prefetch_engine
+        if engine is None:
+            return 0.0
+        start = time.perf_counter()
+
+        def stop() -> None:
+            engine.send_command("stop")
+            engine.wait_for_state(UsiEngineState.WaitCommand)
+
+        try:
+            self.prefetch_executor.submit(stop).result()
+        except Exception as e:
+            print(f"info string relay prefetch stop failed {e}")
+        engine.set_print_info(self.print_info)
+        self.prefetch_engine = None
+        self.prefetch_future = None
+        elapsed = (time.perf_counter() - start) * 1000
+        self.latency.record("prefetch_stop", elapsed / 1000)
+        if self.prefetch_start is not None:
+            # 対局中のエンジンと先読みが並んで動いていた時間
+            self.latency.record("prefetch_overlap", start - self.prefetch_start)
+            self.prefetch_overlap = start - self.prefetch_start
+            self.prefetch_start = None
+        return elapsed
+
+    def get_go_cmd_with_cost(self, go_cmd: str) -> str:
+        """
+        交代時にかかった時間をgoの持ち時間から引く。byoyomiがあればbyoyomiから、なければ手番側の持ち時間から引く
+        """
+        cost = int(self.handoff_cost)
+        self.handoff_cost = 0
+        if cost <= 0:
+            return go_cmd
+        tokens = go_cmd.split()
+
+        def get_idx(key: str) -> Optional[int]:
+            if key not in tokens or tokens.index(key) + 1 >= len(tokens):
+                return None
+            if not tokens[tokens.index(key) + 1].isdigit():
+                return None
+            return tokens.index(key) + 1
+
+        idx = get_idx("byoyomi")
+        if idx is None or int(tokens[idx]) == 0:
+            black = get_board_from_pos_cmd(self.position).turn == shogi.BLACK
+            idx = get_idx("btime" if black else "wtime")
+        if idx is not None:
+            # 0はbyoyomiなしの意味になるので1msは残す
+            tokens[idx] = str(max(int(tokens[idx]) - cost, 1))
+        return " ".join(tokens)
 
     def get_name(self) -> str:
         """
@@ -68,6 +199,7 @@ class RelayEngine(BaseVirtualEngine):
         """
         for engine in self.engines:
             engine.quit()
+        self.prefetch_executor.shutdown(wait=False)
 
     def set_print_info(self, print_info: bool) -> None:
         """
@@ -79,7 +211,8 @@ class RelayEngine(BaseVirtualEngine):
         """
         self.print_info = print_info
         for engine in self.engines:
-            engine.set_print_info(print_info)
+            if engine is not self.prefetch_engine:
+                engine.set_print_info(print_info)
 
     def get_state(self) -> Optional[UsiEngineState]:
         """
@@ -109,6 +242,12 @@ class RelayEngine(BaseVirtualEngine):
                 return False
         return True
 
+    def is_dead(self) -> bool:
+        """
+        どれか1つでもエンジンのプロセスが落ちているか
+        """
+        return any(engine.is_dead() for engine in self.engines)
+
     def set_option(self, options: List[Tuple[str, str]]) -> None:
         """
         エンジンにオプションを送る
@@ -159,8 +298,12 @@ class RelayEngine(BaseVirtualEngine):
             送られるgoコマンド。ex "go byoyomi 1000"
         """
         # dlshogiなどのponderを本来返さないものについても返す仕様にengine側で修正する
-        result = self.engine_to_use.send_go_and_wait(go_cmd)
-        return self.parse_pv(result)
+        with self.latency.measure("go_bestmove"):
+            go_cmd = self.get_go_cmd_with_cost(go_cmd)
+            self.start_prefetch()
+            result = self.engine_to_use.send_go_and_wait(go_cmd)
+            with self.latency.measure("parse_pv"):
+                return self.parse_pv(result)
 
     def parse_pv(
         self, think_result: BasePlayInfoPack, is_ponder: bool = False
@@ -188,18 +331,35 @@ class RelayEngine(BaseVirtualEngine):
         elif cmd.startswith("position"):
             self.position = cmd
             self.engine_to_use = self.get_engine_to_use(cmd)
+            if self.prefetch_engine is not None and (
+                self.prefetch_engine is not self.get_engine_to_prefetch(cmd)
+            ):
+                # 交代した、または待ったなどで先読みの範囲から外れた
+                handoff = self.prefetch_engine is self.engine_to_use
+                elapsed = self.stop_prefetch()
+                if handoff:
+                    self.handoff_cost += elapsed
+                    if self.print_info:
+                        print(
+                            f"info string relay handoff to {self.engine_to_use.get_name()} "
+                            f"prefetch stop {elapsed:.1f}ms "
+                            f"overlap {self.prefetch_overlap:.1f}s"
+                        )
             self.engine_to_use.send_command(cmd)
         elif cmd.startswith("setoption"):
             # TODO : optionはどのengine向けかを解析して送る
             pass
         elif cmd.startswith("go"):
-            self.engine_to_use.send_command(cmd)
+            self.engine_to_use.send_command(self.get_go_cmd_with_cost(cmd))
+            self.start_prefetch()
         elif cmd.startswith("stop"):
             self.engine_to_use.send_command(cmd)
         elif cmd.startswith("ponderhit"):
             self.engine_to_use.send_command(cmd)
 
     def reflesh_game(self) -> None:
+        self.stop_prefetch()
+        self.handoff_cost = 0
         for engine in self.engines:
             engine.reflesh_game()
         self.engine_to_use = self.engines[0]
@@ -207,6 +367,9 @@ class RelayEngine(BaseVirtualEngine):
     def wait_for_state(self, state: UsiEngineState) -> None:
         self.engine_to_use.wait_for_state(state)
 
+    def wait_for_bestmove(self) -> None:
+        self.engine_to_use.wait_for_bestmove()
+
     def get_current_think_result(self) -> BasePlayInfoPack:
         """
         現時点でのpvの様子を吐く
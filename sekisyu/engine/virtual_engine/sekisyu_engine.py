@@ -2,7 +2,9 @@ import dataclasses
 import json
 import os
 import subprocess
+import threading
 from datetime import datetime
+from queue import Empty, Full, Queue
 from typing import Any, Dict, List, Optional, Tuple
 
 from dacite import from_dict
@@ -10,6 +12,7 @@ from pytz import timezone
 from sekisyu.board.get_board_from_pos_cmd import get_board_from_pos_cmd
 from sekisyu.engine.base_engine import BaseEngine
 from sekisyu.engine.config_engine import ConfigEngine
+from sekisyu.engine.latency import LatencyRecorder
 from sekisyu.engine.virtual_engine.base_virtual_engine import BaseVirtualEngine
 from sekisyu.playout.playinfo import BasePlayInfoPack
 from sekisyu.qgen.question_generator import generate_question_from_pos
@@ -39,6 +42,24 @@ class ConfigSekisyuEngine:
     # 敵側の評価値も計算する
     analyze_enemy: bool = True
 
+    # 問題生成を待っている局面の最大数。溢れたら古いものから捨てる
+    question_queue_size: int = 4
+
+
+@dataclasses.dataclass
+class QuestionJob:
+    """
+    bestmoveを返した後に問題を生成する局面
+
+    position (str): bestmoveを求めた局面のposition cmd
+    bestmove (str): 子エンジンの指し手
+    generation (int): 待ったで古くなったかの判定用。SekisyuEngine.question_generationと違えば捨てる
+    """
+
+    position: str
+    bestmove: str
+    generation: int
+
 
 class SekisyuEngine(BaseVirtualEngine):
     """
@@ -64,6 +85,8 @@ class SekisyuEngine(BaseVirtualEngine):
         if engine_analyze:
             self.engine_analyze = engine_analyze
         else:
+            # 解析用のエンジンがなければ対局用のエンジンで解析する
+            self.engine_analyze = engine
             self.engine_eq = True
         self.engine_name = engine_name
         self.config = from_dict(data=config, data_class=ConfigSekisyuEngine)
@@ -73,6 +96,20 @@ class SekisyuEngine(BaseVirtualEngine):
         self.prev_history_pos = None
         self.ques = None
         self.battle_ts = None
+        self.latency = LatencyRecorder()
+        self.position = "position startpos"
+
+        # 問題生成はbestmoveを返した後にスレッドで行う
+        self.question_queue: "Queue[Optional[QuestionJob]]" = Queue(
+            maxsize=max(1, self.config.question_queue_size)
+        )
+        self.question_generation = 0
+        # 最後に問題生成に回した局面 + 指し手。待ったの判定に使う
+        self.last_question_pos: Optional[str] = None
+        self.question_thread = threading.Thread(
+            target=self.question_worker, daemon=True
+        )
+        self.question_thread.start()
 
     def update_ts(self):
         utc_now = datetime.now(timezone("UTC"))
@@ -141,6 +178,9 @@ class SekisyuEngine(BaseVirtualEngine):
         """
         ゲームを初期化する
         """
+        # 最後の局面の問題まで生成してから棋譜の結果を保存する
+        self.flush_questions()
+        self.last_question_pos = None
         if self.__proc_qsa is not None:
             retcode = self.__proc_qsa.poll()
             if retcode is None:
@@ -270,15 +310,104 @@ class SekisyuEngine(BaseVirtualEngine):
         self, think_result: BasePlayInfoPack, is_ponder: bool = False
     ) -> BasePlayInfoPack:
         """
-        指し手が決まった後でその局面からクイズを生成する
+        子エンジンの指し手をすぐに返し、その局面からのクイズの生成はスレッドに任せる
         """
         if (
             think_result.infos[0].pv[0] == "resign"
             or think_result.infos[0].pv[0] == "win"
         ):
             return think_result
-        value_send = None
+        think_result = self.engine.parse_pv(think_result, is_ponder)
+
         pos_packet = self.position.split(" ")
+        if self.last_question_pos is not None and self.last_question_pos != " ".join(
+            pos_packet[: len(pos_packet) - 1]
+        ):
+            # 待ったで局面が戻ったので、まだ生成していない問題は古い
+            self.cancel_questions()
+        pos_to_use = (
+            self.position if "moves" in self.position else self.position + " moves"
+        )
+        self.last_question_pos = pos_to_use + f" {think_result.infos[0].pv[0]}"
+        self.put_question(
+            QuestionJob(
+                self.position, think_result.infos[0].pv[0], self.question_generation
+            )
+        )
+        return think_result
+
+    def put_question(self, job: QuestionJob) -> None:
+        """
+        問題生成のqueueに局面を積む。queueが一杯なら一番古い局面を捨てる
+        """
+        while True:
+            try:
+                self.question_queue.put_nowait(job)
+                return
+            except Full:
+                pass
+            try:
+                dropped = self.question_queue.get_nowait()
+                self.question_queue.task_done()
+                if dropped is not None:
+                    print(f"info string question queue full. drop {dropped.bestmove}")
+            except Empty:
+                pass
+
+    def cancel_questions(self) -> None:
+        """
+        まだ生成していない問題を全て捨てる。生成中のものは生成後のqsaへの通知を行わない
+        """
+        self.question_generation += 1
+        while True:
+            try:
+                self.question_queue.get_nowait()
+            except Empty:
+                return
+            self.question_queue.task_done()
+
+    def flush_questions(self) -> None:
+        """
+        queueに積んだ問題の生成が全て終わるまで待つ
+        """
+        if not self.question_thread.is_alive():
+            return
+        with self.latency.measure("flush_questions"):
+            self.question_queue.join()
+
+    def send_command(self, cmd: str) -> None:
+        """
+        エンジンに特別なコマンドを送る。
+        解析用のエンジンが対局用のエンジンと同じ場合は、問題の生成が終わってからposition, goを送る
+        """
+        if self.engine_eq and (cmd.startswith("position") or cmd.startswith("go")):
+            self.flush_questions()
+        super().send_command(cmd)
+
+    def question_worker(self) -> None:
+        """
+        queueから局面を取り出して問題を生成するスレッド。Noneを受け取ると終了する
+        """
+        while True:
+            job = self.question_queue.get()
+            try:
+                if job is None:
+                    return
+                if job.generation != self.question_generation:
+                    continue
+                with self.latency.measure("generate_question"):
+                    self.generate_question(job)
+            except Exception as e:
+                print(f"info string failed to generate question {e}")
+            finally:
+                self.question_queue.task_done()
+
+    def generate_question(self, job: QuestionJob) -> None:
+        """
+        指し手が決まった後でその局面からクイズを生成する
+        """
+        value_send = None
+        pos_packet = job.position.split(" ")
 
         # 待ったなどにより一つ前に解析した手と異なる手を評価させられる場合、prev_historyを一旦Noneにする
         # 各種guiはプレイヤーが待ったをしたことを通知してこないため、前の自分の手番の局面を作らねば
@@ -309,13 +438,10 @@ class SekisyuEngine(BaseVirtualEngine):
                     "value": value_send,
                 }
 
-        # 子エンジンの計算結果を先に得る
-        think_result = self.engine.parse_pv(think_result, is_ponder)
-
         # 自分の指し手についても解析を与える(optional)
         if self.config.analyze_enemy:
             pos_to_use = (
-                self.position if "moves" in self.position else self.position + " moves"
+                job.position if "moves" in job.position else job.position + " moves"
             )
             print_before = self.engine_analyze.print_info
 
@@ -364,7 +490,7 @@ class SekisyuEngine(BaseVirtualEngine):
             retcode = self.__proc_qsa.poll()
             ques_fullpath = os.path.join(os.getcwd(), output_file_name)
             # print("load_quiz " + ques_fullpath+"\n")
-            if retcode is None:
+            if retcode is None and job.generation == self.question_generation:
                 if stdin_mode:
                     self.__proc_qsa.stdin.write(f"load_quiz {ques_fullpath}\n")
                     self.__proc_qsa.stdin.flush()
@@ -384,22 +510,22 @@ class SekisyuEngine(BaseVirtualEngine):
             value_send = 334
             for i, ans in enumerate(self.ques.selection_usi):
                 value_send = self.ques.values[0] - self.ques.values[i]
-                if think_result.infos[0].pv[0] == ans:
+                if job.bestmove == ans:
                     rank = i
                     break
 
                 self.history[self.prev_history] = {
                     "path": ques_fullpath,
-                    "answer": think_result.infos[0].pv[0],
+                    "answer": job.bestmove,
                     "rank": rank,
                     "value": value_send,
                 }
 
         # 子エンジンのbestmoveから問題を生成する
         pos_to_use = (
-            self.position if "moves" in self.position else self.position + " moves"
+            job.position if "moves" in job.position else job.position + " moves"
         )
-        pos_to_use += f" {think_result.infos[0].pv[0]}"
+        pos_to_use += f" {job.bestmove}"
         print_before = self.engine_analyze.print_info
 
         # 解析の時のpvは表示しない
@@ -449,7 +575,8 @@ class SekisyuEngine(BaseVirtualEngine):
         self.prev_history_pos = pos_to_use
         self.prev_history = ques_fullpath
         # print("load_quiz " + ques_fullpath+"\n")
-        if retcode is None:
+        # 待ったで古くなった局面の問題はqsaに送らない
+        if retcode is None and job.generation == self.question_generation:
             if stdin_mode:
                 self.__proc_qsa.stdin.write(f"load_quiz {ques_fullpath}\n")
                 self.__proc_qsa.stdin.flush()
@@ -463,8 +590,6 @@ class SekisyuEngine(BaseVirtualEngine):
                 else:
                     self.send_qsa_cmd(f"value {value_send}\n")
 
-        return think_result
-
     def send_go_and_wait(self, go_cmd: str) -> BasePlayInfoPack:
         """
         エンジンにgo コマンドを送り、bestmoveが帰ってくるまで待つ。
@@ -476,14 +601,21 @@ class SekisyuEngine(BaseVirtualEngine):
             送られるgoコマンド。ex "go byoyomi 1000"
         """
 
-        go_cmd_use = self.before_go_cmd(go_cmd)
-        think_result = self.engine.send_go_and_wait(go_cmd_use)
-        return self.parse_pv(think_result, "ponder" in go_cmd)
+        with self.latency.measure("go_bestmove"):
+            if self.engine_eq:
+                self.flush_questions()
+            think_result = self.engine.send_go_and_wait(go_cmd)
+            with self.latency.measure("parse_pv"):
+                return self.parse_pv(think_result, "ponder" in go_cmd)
 
     def quit(self) -> None:
         """
         エンジンにquitコマンドを送る
         """
+        self.flush_questions()
+        if self.question_thread.is_alive():
+            self.question_queue.put(None)
+            self.question_thread.join()
         self.save_history()
         if self.__proc_qsa is not None:
             retcode = self.__proc_qsa.poll()
@@ -499,3 +631,11 @@ class SekisyuEngine(BaseVirtualEngine):
         self.engine.quit()
         if not self.engine_eq:
             self.engine_analyze.quit()
+
+    def is_dead(self) -> bool:
+        """
+        対局用、解析用のエンジンのどちらかが落ちているか
+        """
+        if not self.engine_eq and self.engine_analyze.is_dead():
+            return True
+        return self.engine.is_dead()
@@ -2,6 +2,7 @@ from typing import Any, Dict
 
 from sekisyu.ensemble.base_ensembler import BaseEnsembler
 from sekisyu.ensemble.positive_ensembler import PositiveEnsembler
+from sekisyu.ensemble.vote_ensembler import VoteEnsembler
 from sekisyu.ensemble.yane_dl_ensembler import YaneDLEnsembler, YaneDLEnsemblerPositive
 
 
@@ -27,4 +28,12 @@ def generate_ensembler_dict(config: Dict[str, Any]) -> BaseEnsembler:
         return YaneDLEnsembler(config["bonus_ratio"])
     elif config["ensembler_mode"] == "yanedl_positive":
         return YaneDLEnsemblerPositive(config["bonus_a"], config["bonus_b"])
+    elif config["ensembler_mode"] == "vote":
+        return VoteEnsembler(
+            config.get("engine_weights"),
+            config.get("eval_weight", 1.0),
+            config.get("nodes_weight", 1.0),
+            config.get("rank_weight", 0.0),
+            config.get("eval_scale", 600.0),
+        )
     raise ValueError
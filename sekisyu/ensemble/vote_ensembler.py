@@ -0,0 +1,126 @@
+import dataclasses
+from typing import Dict, List, Optional
+
+import numpy as np
+from sekisyu.ensemble.base_ensembler import BaseEnsembler
+from sekisyu.playout.playinfo import BasePlayInfoPack
+
+
+class VoteEnsembler(BaseEnsembler):
+    """
+    任意の数のエンジンの全てのmultipvの候補手による重み付き投票で指し手を決めるアンサンブラー
+
+    エンジン毎、候補手毎に
+    エンジンの重み x 探索量 ^ nodes_weight x (eval_weight x 勝率 + rank_weight / (順位 + 1))
+    を計算し、同じ指し手の値を足したものを票とする。
+    勝率は評価値をeval_scaleで割ってsigmoidにしたもの。エンジン毎に評価値のスケールが違っても比べられるようにするため。
+    infoのnodesは探索全体のnodesでmultipvの各行で同じなので、候補手毎ではなくエンジン毎の探索量として使う。
+    探索量はそのエンジンのnodesをnodesを出力したエンジンの平均で割ったもの。nodesを出力しないエンジンは1とする
+    """
+
+    def __init__(
+        self,
+        engine_weights: Optional[List[float]] = None,
+        eval_weight: float = 1.0,
+        nodes_weight: float = 1.0,
+        rank_weight: float = 0.0,
+        eval_scale: float = 600.0,
+    ) -> None:
+        """
+        Args:
+            engine_weights (list(float)): エンジン毎の重み。Noneなら全て1
+            eval_weight (float): 勝率の重み
+            nodes_weight (float): 探索量の指数。0ならnodesを使わない
+            rank_weight (float): multipvの順位の重み
+            eval_scale (float): 評価値を勝率にするときのスケール
+        """
+        self.engine_weights = engine_weights
+        self.eval_weight = eval_weight
+        self.nodes_weight = nodes_weight
+        self.rank_weight = rank_weight
+        self.eval_scale = eval_scale
+
+    def ensemble(self, playinfos: List[BasePlayInfoPack], pos: str) -> BasePlayInfoPack:
+        if self.engine_weights is not None and len(self.engine_weights) != len(
+            playinfos
+        ):
+            raise ValueError(
+                f"engine_weights has {len(self.engine_weights)} values "
+                f"but {len(playinfos)} engines"
+            )
+        # 全エンジンの候補手を1つの表にする。指し手は出てきた順にidを振る
+        move_ids: Dict[str, int] = {}
+        moves: List[str] = []
+        engine_idx = []
+        move_idx = []
+        ranks = []
+        evals = []
+        nodes = []
+        infos = []
+        for i, playinfo in enumerate(playinfos):
+            # クラッシュしたエンジンは候補手が空なので票を入れない
+            for rank, info in enumerate(playinfo.infos):
+                if len(info.pv) == 0:
+                    continue
+                move = info.pv[0]
+                if move not in move_ids:
+                    move_ids[move] = len(moves)
+                    moves.append(move)
+                engine_idx.append(i)
+                move_idx.append(move_ids[move])
+                ranks.append(rank)
+                evals.append(int(info.eval))
+                nodes.append(info.nodes)
+                infos.append(info)
+        if len(infos) == 0:
+            return playinfos[0]
+
+        engine_arr = np.array(engine_idx)
+        move_arr = np.array(move_idx)
+        if self.engine_weights is None:
+            engine_weights = np.ones(len(playinfos))
+        else:
+            engine_weights = np.array(self.engine_weights, dtype=float)
+
+        # 詰みの評価値などはsigmoidが飽和する程度に丸める
+        evals_arr = np.clip(np.array(evals, dtype=float) / self.eval_scale, -30, 30)
+        winrates = 1.0 / (1.0 + np.exp(-evals_arr))
+        # エンジン毎の探索量。途中のinfoでnodesが違う場合もあるので最大のもの
+        engine_nodes = np.zeros(len(playinfos))
+        np.maximum.at(engine_nodes, engine_arr, np.array(nodes, dtype=float))
+        effort = np.ones(len(playinfos))
+        reported = engine_nodes > 0
+        if reported.any():
+            effort[reported] = engine_nodes[reported] / engine_nodes[reported].mean()
+        rank_score = 1.0 / (np.array(ranks, dtype=float) + 1.0)
+
+        entry_votes = (
+            engine_weights[engine_arr]
+            * effort[engine_arr] ** self.nodes_weight
+            * (self.eval_weight * winrates + self.rank_weight * rank_score)
+        )
+        votes = np.bincount(move_arr, weights=entry_votes, minlength=len(moves))
+
+        # 指し手毎に最も票を入れた候補手の情報を代表として、票の多い順に並べる
+        order = np.lexsort((-entry_votes, move_arr))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = move_arr[order][1:] != move_arr[order][:-1]
+        representative = np.empty(len(moves), dtype=int)
+        representative[move_arr[order][first]] = order[first]
+
+        ranking = np.argsort(-votes, kind="stable")
+        output = BasePlayInfoPack(elapsed=playinfos[0].elapsed)
+        for rank, move_id in enumerate(ranking):
+            output.infos.append(
+                dataclasses.replace(infos[representative[move_id]], multipv=rank + 1)
+            )
+        print(
+            "info string vote",
+            " ".join(
+                f"{moves[move_id]}:{votes[move_id]:.3f}" for move_id in ranking[:5]
+            ),
+        )
+        output.bestmove = output.infos[0].pv[0]
+        if len(output.infos[0].pv) > 1:
+            output.ponder = output.infos[0].pv[1]
+        return output
@@ -1,7 +1,7 @@
-import glob
 import json
 from typing import Dict, List, Optional
 
+from sekisyu.board.kif_manifest import KifManifest
 from sekisyu.kif_analyzer.accuracy_pack import AccuracyPack, ConfigAccuracyPack
 from sekisyu.playout.playinfo import BasePlayInfoPack
 from sekisyu.playout.playout import BasePlayOut
@@ -93,6 +93,7 @@ def get_accuracy_with_filter(
     name_out_of_filter: str = "",
     auto_filter: bool = False,
     use_timestamp: Optional[int] = None,
+    manifest_path: Optional[str] = None,
 ) -> Dict[str, AccuracyPack]:
     """
     playoutのjsonファイルを受け取って手の一致率を返す。
@@ -105,17 +106,40 @@ def get_accuracy_with_filter(
     write_out_of_filter (bool) : filterに引っかからなかったデータについて出力をするか
     name_out_of_filter (str) : filterに引っかからなかったデータにつける名前。write_out_of_filterがTrueでなければ使われない
     use_timestamp(int) : noneじゃない場合、この文字数分だけtimesampを取ってタグにする
+    manifest_path (str) : ファイル一覧と対局者名のキャッシュ。指定するとfilterに引っかからないjsonは読まない
 
     return:
         AccuracyPack : 手の一致率のデータセットのdict。keyはプレイヤー名
     """
-    json_list = []
-    for json_dir in json_dirs:
-        json_list.extend(glob.glob(json_dir + "/*.json"))
+    manifest = KifManifest(
+        [json_dir + "/*.json" for json_dir in json_dirs],
+        manifest_path,
+        parse_header=manifest_path is not None,
+    )
+    json_list = manifest.files()
 
     ap_dict = {}
 
+    def get_name_to_append(pl_name: str, timestamp: str) -> Optional[str]:
+        if use_timestamp:
+            pl_name += "_" + timestamp[: min(len(timestamp), use_timestamp)]
+        idx = search_filter(pl_name, filter_names, auto_filter)
+        return (
+            filter_names[idx]
+            if idx is not None
+            else name_out_of_filter
+            if write_out_of_filter
+            else None
+        )
+
     for json_name in tqdm(json_list):
+        if manifest_path is not None:
+            # キャッシュの対局者名でどちらもfilterに引っかからないjsonは読まない
+            entry = manifest.entries[json_name]
+            if all(
+                get_name_to_append(name, entry.date) is None for name in entry.players
+            ):
+                continue
         with open(json_name) as f:
             try:
                 dat = json.load(f)
@@ -125,19 +149,7 @@ def get_accuracy_with_filter(
         playout: BasePlayOut = BasePlayOut.from_dict(dat)
 
         # 先手番のプレイヤー名を検索
-        pl_name = playout.player_name[0]
-        if use_timestamp:
-            pl_name += (
-                "_" + playout.timestamp[: min(len(playout.timestamp), use_timestamp)]
-            )
-        idx_black = search_filter(pl_name, filter_names, auto_filter)
-        name_to_append = (
-            filter_names[idx_black]
-            if idx_black is not None
-            else name_out_of_filter
-            if write_out_of_filter
-            else None
-        )
+        name_to_append = get_name_to_append(playout.player_name[0], playout.timestamp)
         if name_to_append is not None:
             if name_to_append not in ap_dict:
                 ap_dict[name_to_append] = AccuracyPack(config=config)
@@ -154,20 +166,7 @@ def get_accuracy_with_filter(
             )
 
         # 後手番のプレイヤー名を検索
-        pl_name = playout.player_name[1]
-        if use_timestamp:
-            pl_name += (
-                "_" + playout.timestamp[: min(len(playout.timestamp), use_timestamp)]
-            )
-
-        idx_white = search_filter(pl_name, filter_names, auto_filter)
-        name_to_append = (
-            filter_names[idx_white]
-            if idx_white is not None
-            else name_out_of_filter
-            if write_out_of_filter
-            else None
-        )
+        name_to_append = get_name_to_append(playout.player_name[1], playout.timestamp)
         if name_to_append is not None:
             if name_to_append not in ap_dict:
                 ap_dict[name_to_append] = AccuracyPack(config=config)
@@ -189,7 +188,11 @@ def get_accuracy_with_filter(
     return ap_dict
 
 
-def get_accuracy(root_json_dir: str, config: ConfigAccuracyPack) -> AccuracyPack:
+def get_accuracy(
+    root_json_dir: str,
+    config: ConfigAccuracyPack,
+    manifest_path: Optional[str] = None,
+) -> AccuracyPack:
     """
     棋譜解析のjsonファイルを受け取って手の一致率を返す。
     dataframeを使いたいのだがpandasを入れると
@@ -197,12 +200,18 @@ def get_accuracy(root_json_dir: str, config: ConfigAccuracyPack) -> AccuracyPack
 
     root_json_dir (str): jsonが入っているフォルダ。blackとwhite以下にjsonがあることが前提
     config (ConfigAccuracyPack) : 一致率解析の条件
+    manifest_path (str) : ファイル一覧のキャッシュ。指定すると前回から変化のないフォルダは読み直さない
 
     return:
         AccuracyPack : 手の一致率のデータセット
     """
-    black_json_list = glob.glob(root_json_dir + "/black/*.json")
-    white_json_list = glob.glob(root_json_dir + "/white/*.json")
+    black_pattern = root_json_dir + "/black/*.json"
+    white_pattern = root_json_dir + "/white/*.json"
+    manifest = KifManifest(
+        [black_pattern, white_pattern], manifest_path, parse_header=False
+    )
+    black_json_list = manifest.files(black_pattern)
+    white_json_list = manifest.files(white_pattern)
     apack = AccuracyPack(config=config)
     apack.load_config(config)
 
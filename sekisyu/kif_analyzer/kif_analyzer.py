@@ -1,8 +1,9 @@
 import tempfile
-from typing import Optional
+from typing import Optional, Union
 
 from sekisyu.csa.csa import playout_to_csa_v22
 from sekisyu.engine.base_engine import BaseEngine
+from sekisyu.engine.engine_pool import EnginePool
 from sekisyu.kif_analyzer.config_kif_analyzer import ConfigAnalysis
 from sekisyu.kif_labeler.kif_labels_getter import get_kif_label_from_kif_data
 from sekisyu.playout.playinfo import BasePlayInfoPack
@@ -17,7 +18,7 @@ def get_go_cmd(config: ConfigAnalysis) -> str:
 
 def analyze_playout(
     playout: BasePlayOut,
-    engine: BaseEngine,
+    engine: Union[BaseEngine, EnginePool],
     config: ConfigAnalysis,
     json_name: str = "",
     csa_name: str = "",
@@ -27,8 +28,8 @@ def analyze_playout(
     """
     playoutを解析する。現状ではplayoutのevalinfo_listを書き換える
 
-    engine (BaseEngine):
-        解析に用いたエンジン
+    engine (BaseEngine or EnginePool):
+        解析に用いたエンジン。EnginePoolを渡した場合は全局面を並列に解析する
 
     playout (BasePlayOut):
         解析するplayout
@@ -45,14 +46,21 @@ def analyze_playout(
     playout.config_analysis = config
     playout.evalinfo_list = []
     sfen = "position startpos moves "
-    engine.send_command(sfen)
-    play_info: BasePlayInfoPack = engine.send_go_and_wait(get_go_cmd(config))
-    playout.evalinfo_list.append(play_info.copy())
-    for move_str in playout.plys:
-        sfen += move_str + " "
+    if isinstance(engine, EnginePool):
+        positions = [sfen]
+        for move_str in playout.plys:
+            sfen += move_str + " "
+            positions.append(sfen)
+        playout.evalinfo_list = list(engine.analyze_many(positions, get_go_cmd(config)))
+    else:
         engine.send_command(sfen)
         play_info: BasePlayInfoPack = engine.send_go_and_wait(get_go_cmd(config))
         playout.evalinfo_list.append(play_info.copy())
+        for move_str in playout.plys:
+            sfen += move_str + " "
+            engine.send_command(sfen)
+            play_info = engine.send_go_and_wait(get_go_cmd(config))
+            playout.evalinfo_list.append(play_info.copy())
 
     if not original_csa_name:
         with tempfile.TemporaryDirectory() as temp_dir:
@@ -1,7 +1,7 @@
 import copy
 import dataclasses
 from dataclasses import field
-from typing import Dict, List, Union
+from typing import Dict, List, Optional, Union
 
 from sekisyu.playout.log_scanner import Scanner
 from sekisyu.playout.usi_value import UsiEvalValue
@@ -266,3 +266,136 @@ def generate_playinfo_from_info(message: str) -> Union[BasePlayInfo, None]:
     if "%" in pv.pv[-1]:
         pv.pv = pv.pv[:-1]
     return pv
+
+
+# parse_info_lineでint値をそのまま格納するtoken
+INFO_INT_FIELDS = {
+    "depth": "depth",
+    "seldepth": "seldepth",
+    "nodes": "nodes",
+    "nps": "nps",
+    "hashfull": "hashfull",
+    "multipv": "multipv",
+    "time": "time",
+}
+
+
+def parse_info_line(message: str) -> Optional[BasePlayInfo]:
+    """
+    generate_playinfo_from_infoの高速版。正しい形式の行に対する結果は同じ
+
+    pvを含まない行(currmoveの途中経過など)とinfo stringはBasePlayInfoを作らずにNoneを返す。
+    pvより後ろは全て読み筋なので、pvより前だけをtokenに分けて表を引く
+
+    Args:
+        message (str): エンジンから送られてきた"info ..."
+
+    Returns:
+        BasePlayInfo : 解析結果。読み筋の行でなければNone
+    """
+    head, sep, pv_str = message.partition(" pv ")
+    if not sep or message.startswith("info string"):
+        return None
+    pv = pv_str.split()
+    # やねうら王の場合、定跡にあたると文字列に%が含まれてしまうのでソイツを削る
+    if pv and "%" in pv[-1]:
+        pv = pv[:-1]
+    info = BasePlayInfo(pv=pv)
+    values = info.__dict__
+    tokens = head.split()
+    num_tokens = len(tokens)
+    index = 1
+    while index < num_tokens:
+        token = tokens[index]
+        index += 1
+        field_name = INFO_INT_FIELDS.get(token)
+        if field_name is not None:
+            if index < num_tokens:
+                try:
+                    values[field_name] = int(tokens[index])
+                except ValueError:
+                    pass
+                index += 1
+        elif token == "score":
+            kind = tokens[index] if index < num_tokens else None
+            index += 1
+            if kind == "mate":
+                if index < num_tokens:
+                    is_minus = tokens[index][0] == "-"
+                    try:
+                        ply = int(tokens[index])
+                    except ValueError:
+                        ply = 3  # if no ply info is given assume this is checkmate+1
+                    index += 1
+                    if not is_minus:
+                        info.eval = UsiEvalValue.mate_in_ply(ply)
+                    else:
+                        info.eval = UsiEvalValue.mated_in_ply(-ply)
+            elif kind == "cp":
+                if index < num_tokens:
+                    try:
+                        info.eval = UsiEvalValue(int(tokens[index]))
+                    except ValueError:
+                        pass
+                    index += 1
+            # この直後に"upperbound"/"lowerbound"が付与されている可能性がある。
+            bound = tokens[index] if index < num_tokens else None
+            info.is_upperbound = bound == "upperbound"
+            info.is_lowerbound = bound == "lowerbound"
+            if info.is_upperbound or info.is_lowerbound:
+                index += 1
+        elif token == "string":
+            return None
+        else:
+            raise ValueError(f"ParseError {token}")
+    return info
+
+
+def get_multipv_from_info(message: str) -> int:
+    """
+    infoの行からmultipvの値だけを取り出す。指定がなければ1
+
+    Args:
+        message (str): エンジンから送られてきた"info ..."
+
+    Returns:
+        int : multipvの値
+    """
+    index = message.find(" multipv ")
+    if index == -1:
+        return 1
+    value = message[index + 9 :].split(" ", 1)[0]
+    try:
+        return int(value)
+    except ValueError:
+        return 1
+
+
+if __name__ == "__main__":
+    import timeit
+
+    # 現行のparserとの速度比較
+    lines = [
+        "info depth 20 seldepth 28 score cp 123 upperbound multipv 3 nodes 12345678 nps 1234567 hashfull 345 time 10000 pv 7g7f 3c3d 2g2f 4c4d 2f2e 2b3c 3i4h 3a4b",
+        "info depth 20 seldepth 28 score mate 7 multipv 1 nodes 12345678 nps 1234567 time 10000 pv 7g7f 3c3d 2g2f 4c4d 2f2e 2b3c 3i4h",
+        "info depth 20 currmove 7g7f currmovenumber 3",
+        "info string book hit",
+    ]
+    for line in lines:
+        fast = parse_info_line(line)
+        if " pv " in line:
+            assert fast == generate_playinfo_from_info(line), line
+        else:
+            assert fast is None
+    for line in lines[:2]:
+        n = 100000
+        old = timeit.timeit(lambda: generate_playinfo_from_info(line), number=n)
+        new = timeit.timeit(lambda: parse_info_line(line), number=n)
+        print(
+            f"{line[:40]}... scanner {old / n * 1e6:.2f}us fast {new / n * 1e6:.2f}us"
+        )
+        lazy = timeit.timeit(lambda: get_multipv_from_info(line), number=n)
+        print(f"{line[:40]}... lazy(multipv only) {lazy / n * 1e6:.2f}us")
+    n = 100000
+    new = timeit.timeit(lambda: parse_info_line(lines[2]), number=n)
+    print(f"{lines[2][:40]}... fast {new / n * 1e6:.2f}us (scanner raises)")
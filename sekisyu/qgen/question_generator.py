@@ -1,10 +1,10 @@
 import random
 from typing import List, Optional, Tuple
 
-from sekisyu.board.get_board_from_pos_cmd import get_board_from_pos_cmd
+from sekisyu.board.get_board_from_pos_cmd import BoardCursor, get_board_from_pos_cmd
 from sekisyu.engine.base_engine import BaseEngine
 from sekisyu.kif_analyzer.get_nullmove_info import get_nullmove_info
-from sekisyu.kif_ja.kif_ja_parser import translate_pv
+from sekisyu.kif_ja.kif_ja_parser import get_ja_move, translate_pv
 from sekisyu.playout.playinfo import BasePlayInfoPack
 from sekisyu.qgen.next_ply_question import NextPlyQuestion
 
@@ -12,6 +12,19 @@ from sekisyu.qgen.next_ply_question import NextPlyQuestion
 def parse_pv_info(
     start_pos_in, infos: BasePlayInfoPack, mv_show: Optional[str] = None
 ) -> Tuple[List[str], List[List[str]], List[int]]:
+    """
+    読み筋を日本語の棋譜と、読み筋の各局面のsfenに変換する
+
+    pvの指し手を1つの盤面に順にpushしながら日本語化とsfenの取得を行い、最後にpopして戻す
+
+    Args:
+        start_pos_in (str) : 読みを行った局面のposition cmd
+        infos (BasePlayInfoPack) : 読みの情報
+        mv_show (str) : 指定した場合、解答の先頭の指し手の表記をこれにする
+
+    Returns:
+        tuple(list(str), list(list(str)), list(int)) : multipv毎の日本語の読み筋、各局面のsfen、評価値
+    """
 
     if "moves" not in start_pos_in:
         start_pos = start_pos_in + " moves "
@@ -22,19 +35,32 @@ def parse_pv_info(
     sfen_list: List[List[str]] = []
     values: List[int] = []
 
+    cursor = BoardCursor(start_pos)
     for info in infos.infos:
         sfen_pv = []
-        mv_str = translate_pv(start_pos, [info.pv[0]])
+        pv_ja: List[str] = []
+        # 日本語にできない指し手が出たらそれ以降は日本語化しない(translate_pvと同じ)
+        translating = True
+        prev = None
+        for pv in info.pv:
+            if translating:
+                jmove = get_ja_move(cursor.board, pv, prev)
+                if jmove is None:
+                    translating = False
+                else:
+                    pv_ja.append(jmove)
+                    prev = pv
+            cursor.push(pv)
+            sfen_pv.append(cursor.sfen())
+        cursor.pop_all()
+
+        mv_str = pv_ja[0] if len(pv_ja) > 0 else ""
         if mv_show:
             ans = f"{mv_show} 評価値 {info.eval} : "
         else:
             ans = f"{mv_str} 評価値 {info.eval} : "
-        ans += translate_pv(start_pos, info.pv)
+        ans += "、".join(pv_ja)
         values.append(info.eval)
-        pv_str = start_pos
-        for pv in info.pv:
-            pv_str += pv + " "
-            sfen_pv.append(get_board_from_pos_cmd(pv_str).sfen())
         sfen_list.append(sfen_pv)
         ans_list.append(ans)
 
@@ -133,13 +159,16 @@ def generate_question_from_pos(
     null_enemy_sfen_list: Optional[List[List[str]]] = []
     null_enemy_value_list: Optional[List[int]] = []
     if go_cmd_null_enemy:
+        cursor = BoardCursor(start_pos + " " + pv)
         for i, info in enumerate(infos.infos):
             if null_enemy_rank and i >= null_enemy_rank:
                 break
             move_name = ans_list[i].split(" ")[0]
-            board_null = get_board_from_pos_cmd(start_pos + " " + pv + " " + info.pv[0])
+            cursor.push(info.pv[0])
+            is_check = cursor.board.is_check()
+            cursor.pop()
             # 王手の場合はこの処理は出来ない
-            if board_null.is_check():
+            if is_check:
                 null_enemy_move_info.append(None)
                 null_enemy_sfen_list.append([])
                 null_enemy_value_list.append(-99999)